@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Headless batch generation of ParGaMD configuration bundles
+
+Expands a JSON or YAML sweep file into parameter sets and generates one
+bundle per set in a process pool, written as a directory or a ZIP:
+
+    python batch_generate.py sweep.yaml -o bundles/ --zip --jobs 8
+
+Sweep file layout (keys of base / runs / sweep are the Streamlit form keys):
+
+    base:                      # parameters shared by every bundle
+      protein_name: chignolin
+      account: abc123
+      email: me@example.org
+      hpc_system: expanse
+      nstlim: 50000
+      ntpr: 500
+      bin_target_counts: 4
+      max_total_iterations: 1000
+      enable_gpu_parallelization: false
+      cv_list:
+        - {type: rmsd, min: 0.0, max: 8.0, step: 0.2}
+    uploads:                   # optional input files, paths relative to the sweep file
+      pdb_file: chignolin.pdb
+      prmtop_file: chignolin.prmtop
+    runs:                      # optional explicit variants (may carry their own uploads)
+      - {protein_name: trpcage, uploads: {prmtop_file: trpcage.prmtop}}
+    sweep:                     # value lists, dotted keys reach into nested values
+      nstlim: [50000, 100000]
+      cv_list.*.step: [0.1, 0.2]
+    mode: product              # or zip (sweep lists advance together)
+    name: "{protein_name}_n{nstlim}_s{cv_list.0.step}"
+
+Every run is combined with every sweep point.
+"""
+
+import os
+import sys
+import csv
+import copy
+import json
+import time
+import string
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+from config_generator import ParGaMDConfigGenerator, is_text, write_bundle, DEFAULT_COMPRESSLEVEL
+
+SUMMARY_FIELDS = ['name', 'status', 'files', 'bytes', 'n_bins', 'max_walkers', 'seconds', 'output', 'error']
+
+
+def load_spec(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            sys.exit("YAML sweep files need PyYAML (pip install pyyaml); or use JSON")
+        return yaml.safe_load(text) or {}
+    return json.loads(text)
+
+
+def set_path(params: Dict[str, Any], dotted: str, value):
+    """Assign value at a dotted key; '*' applies to every list element"""
+    head, _, rest = dotted.partition('.')
+    if not rest:
+        if isinstance(params, list):
+            params[int(head)] = value
+        else:
+            params[head] = value
+        return
+    if head == '*':
+        for item in params:
+            set_path(item, rest, value)
+        return
+    child = params[int(head)] if isinstance(params, list) else params.setdefault(head, {})
+    set_path(child, rest, value)
+
+
+def get_path(params: Dict[str, Any], dotted: str):
+    value = params
+    for part in dotted.split('.'):
+        value = value[int(part) if isinstance(value, list) else part]
+    return value
+
+
+def sweep_points(sweep: Dict[str, List], mode: str) -> List[Dict[str, Any]]:
+    """One {dotted key: value} dict per sweep point"""
+    if not sweep:
+        return [{}]
+    keys = list(sweep)
+    values = [sweep[key] if isinstance(sweep[key], list) else [sweep[key]] for key in keys]
+    if mode == 'zip':
+        lengths = {len(v) for v in values}
+        if len(lengths) != 1:
+            raise ValueError(f"zip sweep needs equally long value lists, got lengths {sorted(lengths)}")
+        combos = zip(*values)
+    elif mode == 'product':
+        combos = itertools.product(*values)
+    else:
+        raise ValueError(f"Unknown sweep mode '{mode}'; expected product or zip")
+    return [dict(zip(keys, combo)) for combo in combos]
+
+
+def expand(spec: Dict[str, Any], spec_dir: str) -> List[Dict[str, Any]]:
+    """Parameter sets of a sweep spec: [{'name', 'params', 'uploads'}, ...]"""
+    base = spec.get('base', {})
+    runs = spec.get('runs') or [{}]
+    points = sweep_points(spec.get('sweep', {}), spec.get('mode', 'product'))
+    name_format = spec.get('name')
+
+    jobs = []
+    for run, point in itertools.product(runs, points):
+        run = dict(run)
+        uploads = dict(spec.get('uploads', {}))
+        uploads.update(run.pop('uploads', {}))
+        run_name = run.pop('name', None)
+        params = copy.deepcopy(base)
+        params.update(copy.deepcopy(run))
+        for key, value in point.items():
+            set_path(params, key, value)
+
+        index = len(jobs)
+        if name_format:
+            name = format_name(name_format, params, index)
+        elif run_name:
+            name = run_name if len(points) == 1 else f"{run_name}_{index:03d}"
+        else:
+            name = f"run_{index:03d}"
+        jobs.append({
+            'name': name,
+            'params': params,
+            'uploads': {key: os.path.join(spec_dir, path) for key, path in uploads.items()}
+        })
+
+    names = [job['name'] for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Bundle names are not unique: {', '.join(duplicates)}; add sweep keys to 'name'")
+    return jobs
+
+
+def format_name(name_format: str, params: Dict[str, Any], index: int) -> str:
+    """Fill {key} / {dotted.key} / {index} placeholders; keep names filesystem-safe"""
+    out = []
+    for literal, field, spec, _ in string.Formatter().parse(name_format):
+        out.append(literal)
+        if field is None:
+            continue
+        value = index if field == 'index' else get_path(params, field)
+        out.append(format(value, spec or ''))
+    return ''.join(c if c.isalnum() or c in '._-' else '_' for c in ''.join(out))
+
+
+_generator: Optional[ParGaMDConfigGenerator] = None
+
+
+def build_bundle(job: Dict[str, Any], output_dir: str, as_zip: bool, compresslevel: int) -> Dict[str, Any]:
+    """Generate and write one bundle (runs in a worker process)"""
+    global _generator
+    if _generator is None:
+        # One generator per worker: templates and static files stay warm across jobs
+        _generator = ParGaMDConfigGenerator()
+
+    start = time.perf_counter()
+    row = {'name': job['name'], 'status': 'ok', 'files': 0, 'bytes': 0}
+    try:
+        uploads = {}
+        for key, path in job['uploads'].items():
+            with open(path, 'rb') as f:
+                uploads[key] = {'name': os.path.basename(path), 'content': f.read()}
+
+        estimate = _generator.estimate_max_walkers(job['params'])
+        row.update(n_bins=estimate['n_bins'], max_walkers=estimate['max_walkers'])
+
+        entries = _counted(_generator.iter_bundle_entries(job['params'], uploads), row)
+        if as_zip:
+            output = os.path.join(output_dir, job['name'] + '.zip')
+            with open(output, 'wb') as f:
+                write_bundle(entries, f, compresslevel)
+        else:
+            output = os.path.join(output_dir, job['name'])
+            write_directory(entries, output)
+        row['output'] = output
+    except (KeyError, ValueError, OSError) as e:
+        row.update(status='failed', error=f"{type(e).__name__}: {e}")
+    row['seconds'] = round(time.perf_counter() - start, 3)
+    return row
+
+
+def _counted(entries, row):
+    for path, content in entries:
+        row['files'] += 1
+        row['bytes'] += len(content.encode('utf-8')) if is_text(content) else memoryview(content).nbytes
+        yield path, content
+
+
+def write_directory(entries, root: str):
+    for path, content in entries:
+        target = os.path.join(root, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if is_text(content):
+            with open(target, 'w', encoding='utf-8', newline='') as f:
+                f.write(content)
+        else:
+            with open(target, 'wb') as f:
+                f.write(content)
+
+
+def print_summary(rows: List[Dict[str, Any]]):
+    print(f"{'bundle':<40} {'status':<7} {'files':>5} {'MB':>8} {'bins':>7} {'walkers':>8} {'s':>7}")
+    for row in rows:
+        print(f"{row['name']:<40} {row['status']:<7} {row['files']:>5} {row['bytes'] / 1e6:>8.2f} "
+              f"{row.get('n_bins', '-'):>7} {row.get('max_walkers', '-'):>8} {row['seconds']:>7.2f}")
+        if row.get('error'):
+            print(f"    {row['error']}")
+    failed = sum(row['status'] != 'ok' for row in rows)
+    print(f"\n{len(rows) - failed} bundles written, {failed} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate ParGaMD configuration bundles from a sweep file')
+    parser.add_argument('spec', help='JSON or YAML sweep file')
+    parser.add_argument('-o', '--output-dir', default='bundles', help='where bundles are written (default: bundles)')
+    parser.add_argument('--zip', action='store_true', help='write one ZIP per bundle instead of a directory')
+    parser.add_argument('--compresslevel', type=int, default=DEFAULT_COMPRESSLEVEL, help='ZIP compression level 0-9')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--force', action='store_true', help='overwrite existing bundles')
+    parser.add_argument('--dry-run', action='store_true', help='list the parameter sets without generating')
+    parser.add_argument('--csv', help='also write the summary table to this CSV file')
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    try:
+        jobs = expand(spec, os.path.dirname(os.path.abspath(args.spec)))
+    except (KeyError, ValueError, IndexError) as e:
+        sys.exit(f"Invalid sweep file {args.spec}: {e}")
+
+    if args.dry_run:
+        for job in jobs:
+            print(job['name'])
+            print('    ' + json.dumps(job['params'], sort_keys=True))
+        print(f"\n{len(jobs)} bundles")
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    if not args.force:
+        existing = [job['name'] for job in jobs
+                    if os.path.exists(os.path.join(args.output_dir, job['name'] + ('.zip' if args.zip else '')))]
+        if existing:
+            sys.exit(f"{len(existing)} bundles already exist in {args.output_dir} (e.g. {existing[0]}); use --force")
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(jobs)))) as pool:
+        futures = [pool.submit(build_bundle, job, args.output_dir, args.zip, args.compresslevel) for job in jobs]
+        for future in as_completed(futures):
+            rows.append(future.result())
+    order = {job['name']: i for i, job in enumerate(jobs)}
+    rows.sort(key=lambda row: order[row['name']])
+
+    print_summary(rows)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Wrote summary to {args.csv}")
+    if any(row['status'] != 'ok' for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
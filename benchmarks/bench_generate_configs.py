@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Per-call latency of ParGaMDConfigGenerator.generate_configs
+
+Run from the repository root (generate_configs reads the bundled files
+relative to the working directory):
+
+    python benchmarks/bench_generate_configs.py --repeat 200
+
+Reports the cost of constructing a generator and the median / p95
+latency of generate_configs for every supported HPC system.
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config_generator import ParGaMDConfigGenerator
+
+HPC_SYSTEMS = ['expanse', 'tacc_frontera', 'hpc2_ucd']
+
+BASE_PARAMS = {
+    'protein_name': 'chignolin',
+    'account': 'abc123',
+    'email': 'user@example.org',
+    'nstlim': 50000,
+    'ntpr': 500,
+    'bin_target_counts': 4,
+    'max_total_iterations': 1000,
+    'enable_gpu_parallelization': True,
+    # HPC2 has no whole-node default for GPU detection
+    'gpus_per_node': 2,
+    'include_infinite_bounds': True,
+    'cv_list': [
+        {'type': 'rmsd', 'min': 0.0, 'max': 8.0, 'step': 0.2},
+        {'type': 'radius_gyration', 'min': 0.0, 'max': 8.0, 'step': 0.2},
+    ],
+}
+
+
+def time_calls(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    samples.sort()
+    return statistics.median(samples), samples[int(0.95 * (len(samples) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark generate_configs')
+    parser.add_argument('--repeat', type=int, default=100, help='calls per HPC system')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    generator = ParGaMDConfigGenerator()
+    print(f"first ParGaMDConfigGenerator():  {(time.perf_counter() - start) * 1000.0:8.2f} ms")
+    median, _ = time_calls(ParGaMDConfigGenerator, args.repeat)
+    print(f"later ParGaMDConfigGenerator():  {median:8.2f} ms (median)")
+    print()
+    print(f"{'hpc_system':<16} {'median ms':>10} {'p95 ms':>10}")
+    for hpc_system in HPC_SYSTEMS:
+        params = dict(BASE_PARAMS, hpc_system=hpc_system)
+        median, p95 = time_calls(lambda: generator.generate_configs(params), args.repeat)
+        print(f"{hpc_system:<16} {median:>10.3f} {p95:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
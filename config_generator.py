@@ -5,25 +5,363 @@ Extracted from Flask app for Streamlit use
 """
 
 import os
-from jinja2 import Template
-from typing import Dict, List, Any
+import re
+import math
+import time
+import bisect
+import hashlib
+import zipfile
+import tempfile
+import threading
+from jinja2 import DictLoader, Environment, FileSystemBytecodeCache, Template
+from typing import Dict, Iterable, Iterator, List, Any, Callable, Optional, Tuple, Union
+
+# HPC systems with their own env.sh / run_WE.sh; anything else gets Expanse's
+HPC_SYSTEMS = ('expanse', 'tacc_frontera', 'hpc2_ucd')
+DEFAULT_HPC_SYSTEM = 'expanse'
+
+
+def _bytecode_cache() -> Optional[FileSystemBytecodeCache]:
+    """Compiled template cache shared by all processes of this user"""
+    try:
+        return FileSystemBytecodeCache()
+    except (OSError, RuntimeError):
+        # No usable temp directory; templates are still compiled once per process
+        return None
+
+
+# Content of one bundle file: text, or raw binary passed through untouched
+BundleContent = Union[str, bytes, memoryview]
+
+
+def is_text(content: BundleContent) -> bool:
+    """Whether a bundle file can be shown and edited as text"""
+    return isinstance(content, str)
+
+
+def decode_text(data: bytes) -> BundleContent:
+    """UTF-8 text if data decodes cleanly, otherwise the bytes themselves"""
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data
+
+
+# Parameters each rendered file depends on (see ParGaMDConfigGenerator.dependency_map)
+WEST_CFG_PARAMS = ('cv_list', 'include_infinite_bounds', 'nstlim', 'ntpr',
+                   'bin_target_counts', 'max_total_iterations', 'bin_scheme',
+                   'mab_nbins', 'mab_direction', 'mab_bottleneck', 'bin_regions',
+                   'seg_log_mode', 'seg_debug')
+RUNSEG_PARAMS = ('protein_name', 'enable_gpu_parallelization', 'cv_list', 'nstlim', 'ntpr', 'ntwx', 'ntwr',
+                 'max_retries', 'retry_backoff', 'local_scratch', 'hpc_system', 'seg_log_mode',
+                 'watchdog', 'upload:pdb_file')
+GET_PCOORD_PARAMS = ('protein_name', 'cv_list', 'upload:pdb_file')
+# WE segment inputs whose step counts and output intervals follow params
+MD_IN_FILES = ('common_files/md_init.in', 'common_files/md.in')
+MD_IN_PARAMS = ('nstlim', 'ntpr', 'ntwx', 'ntwr')
+MD_IN_SETTING = re.compile(r'^(\s*)(nstlim|ntpr|ntwx|ntwr)(\s*=\s*)\d+', re.MULTILINE)
+# Failed pmemd runs retried per segment, and the first backoff in seconds (doubles per retry)
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 30
+# Node-local scratch per HPC system for runseg.sh staging ($WEST_LOCAL_SCRATCH overrides)
+LOCAL_SCRATCH = {
+    'expanse': '/scratch/$USER/job_${WEST_JOBID:-$SLURM_JOB_ID}',
+    'tacc_frontera': '/tmp',
+    'hpc2_ucd': '${TMPDIR:-/tmp}',
+}
+# Segment output in west.cfg: 'worker' appends to one log per worker and
+# iteration (seg_logs/NNNNNN/<host>-w<N>.log + index.tsv), 'segment' keeps
+# the old file per segment
+SEG_LOG_MODES = ('worker', 'segment')
+DEFAULT_SEG_LOG_MODE = 'worker'
+# westpa_scripts/watchdog.py started by run_WE.sh: 'alert' reports stalled and
+# straggling segments, 'kill' also kills stalled pmemd runs so runseg.sh retries
+# them. A segment is stalled after about one expected segment runtime without
+# pmemd output (at least WATCHDOG_MIN_STALL seconds).
+WATCHDOG_MODES = ('off', 'alert', 'kill')
+DEFAULT_WATCHDOG = 'alert'
+WATCHDOG_MIN_STALL = 300
+# GPUs per node of the partition run_WE.sh submits to. With multi-GPU
+# parallelization and gpus_per_node 0 (detect) the job requests this many
+# so detection sees the whole node; other systems need gpus_per_node set
+NODE_GPUS = {
+    'expanse': 4,           # gpu partition, 4x V100
+    'tacc_frontera': 4,     # rtx partition allocates whole nodes, 4x Quadro RTX 5000
+}
+# Segment files copied back to traj_segs from scratch (plus the CV outputs)
+STAGE_OUT_FILES = ['seg.rst', 'seg.nc', 'seg.log', 'gamd.log']
+RUN_WE_PARAMS = ('hpc_system', 'protein_name', 'account', 'email', 'nodes', 'master_workers', 'chain_jobs',
+                 'watchdog', 'enable_gpu_parallelization', 'gpus_per_node', 'segments_per_gpu')
+# env.sh sizes the ZMQ heartbeat / timeout from the expected segment runtime
+ENV_SH_PARAMS = ('hpc_system', 'nstlim', 'dt', 'ns_per_day', 'reference_atoms', 'segment_overhead_s',
+                 'packing_gain', 'enable_gpu_parallelization', 'segments_per_gpu',
+                 'n_atoms', 'zmq_timeout', 'protein_name', 'upload:prmtop_file', 'upload:pdb_file')
+
+
+BIN_SCHEMES = ('rectilinear', 'mab', 'nested')
+MAB_DEFAULT_NBINS = 10
+# MABBinMapper directions: 1 / -1 towards larger / smaller values, 0 both, 86 skip
+MAB_DIRECTIONS = (1, -1, 0, 86)
+
+
+# Rough per-system defaults for estimate_resources. ns_per_day is pmemd.cuda
+# throughput of one segment alone on a GPU for a system of reference_atoms
+# atoms (scaled linearly with size); replace it with the median from
+# seg_telemetry.py once a run exists. packing_gain is the total throughput
+# of segments_per_gpu segments sharing a GPU relative to one segment; the
+# default assumes no gain. Any entry can be overridden through params of
+# the same name.
+RESOURCE_CALIBRATION = {
+    'expanse': {
+        'ns_per_day': 1500.0, 'reference_atoms': 138, 'packing_gain': 1.0,
+        'max_job_hours': 48.0, 'segment_overhead_s': 10.0, 'storage_limit_gb': 500.0,
+    },
+    'tacc_frontera': {
+        'ns_per_day': 1200.0, 'reference_atoms': 138, 'packing_gain': 1.0,
+        'max_job_hours': 48.0, 'segment_overhead_s': 10.0, 'storage_limit_gb': 500.0,
+    },
+    'hpc2_ucd': {
+        'ns_per_day': 1200.0, 'reference_atoms': 138, 'packing_gain': 1.0,
+        'max_job_hours': 48.0, 'segment_overhead_s': 10.0, 'storage_limit_gb': 500.0,
+    },
+}
+# ZMQ worker timeout in segment runtimes (see zmq_timing), its floor in
+# seconds and the allowed heartbeat interval
+ZMQ_TIMEOUT_SEGMENTS = 2
+ZMQ_MIN_TIMEOUT = 600
+ZMQ_HEARTBEAT_RANGE = (10, 120)
+# Walkers per iteration above which the bin layout deserves a second look
+MAX_WALKERS_WARNING = 1000
+
+# Approximate on-disk sizes used by estimate_resources
+H5_SEGMENT_BYTES = 64                 # seg_index row + weight graph entry
+H5_ITERATION_BYTES = 32 * 1024        # group / dataset metadata per iteration
+NETCDF_HEADER_BYTES = 2048
+MDOUT_HEADER_BYTES = 12 * 1024
+MDOUT_BYTES_PER_PRINT = 1000
+GAMD_LOG_BYTES_PER_PRINT = 150
+CV_BYTES_PER_LINE = 20
+SEGMENT_MISC_BYTES = 16 * 1024        # md.in, symlinks, seg_logs entry
+
+
+def _per_cv(value, ndim: int, cast, name: str) -> list:
+    """Per-CV setting from a single value or a list with one value per CV"""
+    if isinstance(value, (list, tuple)):
+        if len(value) != ndim:
+            raise ValueError(f"{name} needs one value per CV ({ndim}), got {len(value)}")
+        return [cast(item) for item in value]
+    return [cast(value)] * ndim
+
+
+def _as_bytes(content: BundleContent, limit: Optional[int] = None) -> bytes:
+    if isinstance(content, str):
+        content = content[:limit].encode('utf-8') if limit else content.encode('utf-8')
+    return bytes(memoryview(content)[:limit])
+
+
+def _prmtop_atoms(content: BundleContent) -> Optional[int]:
+    """NATOM from the POINTERS section of an ASCII AMBER topology"""
+    head = _as_bytes(content, 16384)
+    start = head.find(b'%FLAG POINTERS')
+    if start < 0:
+        return None
+    lines = head[start:].split(b'\n')
+    for line in lines[1:4]:
+        if not line.startswith(b'%') and line.split():
+            return int(line.split()[0])
+    return None
+
+
+def _pdb_atoms(content: BundleContent) -> Optional[int]:
+    data = _as_bytes(content)
+    return sum(1 for line in data.split(b'\n') if line.startswith((b'ATOM', b'HETATM'))) or None
+
+
+def content_digest(content: BundleContent) -> str:
+    """SHA-1 of a bundle file's content"""
+    if isinstance(content, str):
+        content = content.encode('utf-8', errors='surrogatepass')
+    return hashlib.sha1(content).hexdigest()
+
+
+def _freeze(value):
+    """Hashable, comparable form of a parameter value (cv_list is a list of dicts)"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+# Static bundle files are resolved here, not against the working directory
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class AssetStore:
+    """Static files copied into every bundle, read once and shared process-wide
+    
+    Files that are valid UTF-8 are kept as str, anything else (NetCDF
+    restarts, binary topologies) as bytes. Each file is kept in memory
+    with the mtime and size it was read at. A file is stat'ed again only
+    when its last check is older than check_interval seconds, and reread
+    only if it changed. All Streamlit sessions share one store, so a warm
+    store does no disk I/O.
+    """
+    
+    def __init__(self, root: str = PACKAGE_DIR, check_interval: float = 2.0):
+        self.root = root
+        self.check_interval = check_interval
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, rel_path: str) -> Optional[BundleContent]:
+        """Content of a file below root, or None if it does not exist"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(rel_path)
+            if entry is not None and now - entry[0] < self.check_interval:
+                return entry[2]
+            path = os.path.join(self.root, rel_path)
+            try:
+                stat = os.stat(path)
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signature = None
+            if entry is not None and entry[1] == signature:
+                content = entry[2]
+            elif signature is None:
+                content = None
+            else:
+                try:
+                    with open(path, 'rb') as f:
+                        content = decode_text(f.read())
+                except OSError:
+                    signature, content = None, None
+            self._entries[rel_path] = (now, signature, content)
+            return content
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+ASSETS = AssetStore()
+
+# Bundles larger than this are spooled to a temporary file on disk
+SPOOL_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_COMPRESSLEVEL = 6
+# Entries are compressed in slices of this size, never as one buffer
+WRITE_CHUNK_BYTES = 1024 * 1024
+
+
+def write_bundle(entries: Iterable[Tuple[str, BundleContent]], fileobj=None,
+                 compresslevel: int = DEFAULT_COMPRESSLEVEL, spool_bytes: int = SPOOL_MAX_BYTES):
+    """Stream (path, content) entries into a ZIP archive
+    
+    Writes to fileobj (a seekable binary file) or, by default, to a
+    SpooledTemporaryFile that moves to disk once it exceeds spool_bytes.
+    compresslevel 0 stores entries uncompressed. Returns the archive file
+    positioned at its start.
+    """
+    if fileobj is None:
+        fileobj = tempfile.SpooledTemporaryFile(max_size=spool_bytes, suffix='.zip')
+    if compresslevel > 0:
+        compression = zipfile.ZIP_DEFLATED
+    else:
+        compression, compresslevel = zipfile.ZIP_STORED, None
+    with zipfile.ZipFile(fileobj, 'w', compression, compresslevel=compresslevel) as archive:
+        for path, content in entries:
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            data = memoryview(content).cast('B')
+            # Opened by name, the entry takes the archive's compression and level
+            with archive.open(path, 'w', force_zip64=data.nbytes >= zipfile.ZIP64_LIMIT) as entry:
+                for start in range(0, data.nbytes, WRITE_CHUNK_BYTES):
+                    entry.write(data[start:start + WRITE_CHUNK_BYTES])
+    fileobj.seek(0)
+    return fileobj
+
+
+def placeholder_content(file_path: str) -> str:
+    """Stand-in for a static file that is missing from the installation"""
+    if file_path.endswith('.py'):
+        return f"#!/usr/bin/env python3\n# {file_path}\nprint('Running {file_path}')\n"
+    if file_path.endswith('.sh'):
+        return f"#!/bin/bash\n# {file_path}\necho 'Running {file_path}'\n"
+    if file_path.endswith('.pdb'):
+        return "# Placeholder PDB file\n# Upload your protein structure here\n"
+    if file_path.endswith('.prmtop'):
+        return "# Placeholder PRMTOP file\n# Upload your topology file here\n"
+    if file_path.endswith('.rst'):
+        return "# Placeholder restart file\n"
+    return f"# Placeholder {file_path}\n"
+
 
 class ParGaMDConfigGenerator:
     """Generate configuration files for ParGaMD experiments"""
     
-    def __init__(self):
+    # Compiled templates, built on first use and shared by every instance
+    _registry: Optional[Dict[str, Template]] = None
+    
+    def __init__(self, assets: Optional[AssetStore] = None):
         self.templates = self._load_templates()
+        self.assets = assets or ASSETS
+        # Result of the previous generate_configs call, reused file by file
+        self.last_result: Dict[str, str] = {}
+        self.digests: Dict[str, str] = {}
+        self._keys: Dict[str, tuple] = {}
+        self._upload_digests: Dict[str, tuple] = {}
+        self._encoded_uploads: Dict[str, tuple] = {}
     
-    def _load_templates(self):
-        """Load Jinja2 templates for configuration files"""
-        return {
-            'west_cfg': self._get_west_cfg_template(),
-            'runseg_sh': self._get_runseg_sh_template(),
-            'run_cmd_sh': self._get_run_cmd_sh_template()
+    def _load_templates(self) -> Dict[str, Template]:
+        """Compile every template for every HPC system once per process"""
+        cls = type(self)
+        if cls._registry is None:
+            environment = Environment(
+                loader=DictLoader(self._template_sources()),
+                bytecode_cache=_bytecode_cache(),
+                auto_reload=False,
+                cache_size=-1
+            )
+            cls._registry = {name: environment.get_template(name)
+                             for name in environment.list_templates()}
+        return cls._registry
+    
+    def _template_sources(self) -> Dict[str, str]:
+        """Jinja2 source of every template, keyed by registry name"""
+        sources = {
+            'west_cfg': self._west_cfg_source(),
+            'runseg_sh': self._runseg_sh_source(),
+            'run_cmd_sh': self._run_cmd_sh_source(),
+            'get_pcoord_sh': self._get_pcoord_sh_source()
         }
+        # Shared bodies; each HPC system's env.sh / run_WE.sh adds its own
+        # #SBATCH header and module lines and includes them
+        sources['partials/env_sh'] = self._env_sh_partial_source()
+        sources['partials/run_we_sh'] = self._run_we_sh_partial_source()
+        for hpc_system in HPC_SYSTEMS:
+            sources[f'env_sh/{hpc_system}'] = self._env_sh_source(hpc_system)
+            sources[f'run_we_sh/{hpc_system}'] = self._run_we_sh_source(hpc_system)
+        return sources
+    
+    def _hpc_template(self, kind: str, hpc_system: str) -> Template:
+        if hpc_system not in HPC_SYSTEMS:
+            hpc_system = DEFAULT_HPC_SYSTEM
+        return self.templates[f'{kind}/{hpc_system}']
+    
+    def _get_env_sh_template(self, hpc_system="expanse"):
+        """Get environment setup template based on HPC system"""
+        return self._hpc_template('env_sh', hpc_system)
+    
+    def _get_run_we_sh_template(self, hpc_system="expanse"):
+        """Get run_WE.sh template based on HPC system"""
+        return self._hpc_template('run_we_sh', hpc_system)
+    
+    def _get_get_pcoord_sh_template(self):
+        return self.templates['get_pcoord_sh']
     
-    def _get_west_cfg_template(self):
-        return Template("""# The master WEST configuration file for a simulation.
+    def _west_cfg_source(self) -> str:
+        return """# The master WEST configuration file for a simulation.
 # vi: set filetype=yaml :
 ---
 west: 
@@ -38,14 +376,55 @@ west:
       # Data type for your progress coordinate 
       pcoord_dtype: !!python/name:numpy.float32
       bins:
+{%- if bin_scheme == 'mab' %}
+        # Minimal adaptive binning: bins follow the walkers' extent each iteration
+        type: RecursiveBinMapper
+        base:
+          type: RectilinearBinMapper
+          boundaries:
+{% for cv_bin in base_bins %}
+            - {{ cv_bin }}
+{% endfor %}
+        mappers:
+          - type: MABBinMapper
+            nbins: {{ mab_nbins }}
+            direction: {{ mab_direction }}
+            bottleneck: {{ 'true' if mab_bottleneck else 'false' }}
+            at: {{ mab_at }}
+{%- elif bin_scheme == 'nested' %}
+        # Coarse bins everywhere, finer bins inside the listed regions
+        type: RecursiveBinMapper
+        base:
+          type: RectilinearBinMapper
+          boundaries:
+{% for cv_bin in cv_bins %}
+            - {{ cv_bin }}
+{% endfor %}
+        mappers:
+{% for region in regions %}
+          - type: RectilinearBinMapper
+            boundaries:
+{% for cv_bin in region.boundaries %}
+              - {{ cv_bin }}
+{% endfor %}
+            at: {{ region.at }}
+{% endfor %}
+{%- else %}
         type: RectilinearBinMapper
         # The edges of the bins 
         boundaries:         
 {% for cv_bin in cv_bins %}
           - {{ cv_bin }}
 {% endfor %}
+{%- endif %}
       # Number walkers per bin
       bin_target_counts: {{ bin_target_counts }}
+{%- if bin_scheme == 'mab' %}
+  drivers:
+    # MAB recomputes its bin boundaries from each iteration's pcoords
+    we_driver:   westpa.core.binning.mab_driver.MABDriver
+    sim_manager: westpa.core.binning.mab_manager.MABSimManager
+{%- endif %}
   propagation:
     max_total_iterations: {{ max_total_iterations }}
     max_run_wallclock:    47:30:00
@@ -65,19 +444,28 @@ west:
       initial_state: $WEST_SIM_ROOT/istates/{initial_state.iter_created}/{initial_state.state_id}.rst
   plugins:
   executable:
+{%- if seg_debug %}
     environ:
       PROPAGATION_DEBUG: 1
+{%- endif %}
     datasets:
       - name:    coord
         enabled: false
     propagator:
       executable: $WEST_SIM_ROOT/westpa_scripts/runseg.sh
+{%- if seg_log_mode == 'segment' %}
       stdout:     $WEST_SIM_ROOT/seg_logs/{segment.n_iter:06d}/{segment.seg_id:06d}.log
+{%- else %}
+      # runseg.sh appends to seg_logs/NNNNNN/<host>-w<worker>.log itself
+      stdout:     /dev/null
+{%- endif %}
       stderr:     stdout
       stdin:      null
       cwd:        null
+{%- if seg_debug %}
       environ:
         SEG_DEBUG: 1
+{%- endif %}
     get_pcoord:
       executable: $WEST_SIM_ROOT/westpa_scripts/get_pcoord.sh
       stdout:     /dev/null 
@@ -94,12 +482,55 @@ west:
       enabled:    false
       executable: $WEST_SIM_ROOT/westpa_scripts/pre_iter.sh
       stderr:     stdout
-""")
+"""
     
-    def _get_env_sh_template(self, hpc_system="expanse"):
-        """Get environment setup template based on HPC system"""
+    def _env_sh_partial_source(self) -> str:
+        """env.sh lines shared by every HPC system: ZMQ timing, watchdog, tool paths"""
+        return """# ZMQ heartbeats sized to the expected segment runtime (~{{ segment_seconds }} s): a worker
+# silent for heartbeat x timeout factor seconds is dropped and its segment re-run elsewhere
+export WM_ZMQ_MASTER_HEARTBEAT={{ zmq_heartbeat }}
+export WM_ZMQ_WORKER_HEARTBEAT={{ zmq_heartbeat }}
+export WM_ZMQ_TIMEOUT_FACTOR={{ zmq_timeout_factor }}
+# westpa_scripts/watchdog.py: a segment without new pmemd output this long is stalled
+export WEST_WATCHDOG_STALL=${WEST_WATCHDOG_STALL:-{{ watchdog_stall }}}
+export BASH=$SWROOT/bin/bash
+export PERL=$SWROOT/usr/bin/perl
+export ZSH=$SWROOT/bin/zsh
+export IFCONFIG=$SWROOT/bin/ifconfig
+export CUT=$SWROOT/usr/bin/cut
+export TR=$SWROOT/usr/bin/tr
+export LN=$SWROOT/bin/ln
+export CP=$SWROOT/bin/cp
+export RM=$SWROOT/bin/rm
+export SED=$SWROOT/bin/sed
+export CAT=$SWROOT/bin/cat
+export HEAD=$SWROOT/bin/head
+export TAR=$SWROOT/bin/tar
+export AWK=$SWROOT/usr/bin/awk
+export PASTE=$SWROOT/usr/bin/paste
+export GREP=$SWROOT/bin/grep
+export SORT=$SWROOT/usr/bin/sort
+export UNIQ=$SWROOT/usr/bin/uniq
+export HEAD=$SWROOT/usr/bin/head
+export MKDIR=$SWROOT/bin/mkdir
+export ECHO=$SWROOT/bin/echo
+export DATE=$SWROOT/bin/date
+export SANDER=$AMBERHOME/bin/sander
+export PMEMD=$AMBERHOME/bin/pmemd.cuda
+export CPPTRAJ=$AMBERHOME/bin/cpptraj
+
+# CPU-only test runs: WEST_MOCK_ENGINE=1 replaces pmemd.cuda and cpptraj with
+# westpa_scripts/mock_engine.py (runtime and failures via WEST_MOCK_* variables)
+if [ -n "$WEST_MOCK_ENGINE" ]; then
+    export PMEMD="python3 $WEST_SIM_ROOT/westpa_scripts/mock_engine.py pmemd"
+    export CPPTRAJ="python3 $WEST_SIM_ROOT/westpa_scripts/mock_engine.py cpptraj"
+fi
+"""
+    
+    def _env_sh_source(self, hpc_system: str) -> str:
+        """Environment setup template source for one HPC system"""
         if hpc_system == "tacc_frontera":
-            return Template("""#!/bin/bash
+            return """#!/bin/bash
 
 source ~/.profile
 export MY_SPECTRUM_OPTIONS="--gpu"
@@ -133,38 +564,11 @@ export PATH=$AMBERHOME/bin:$PATH
 export NODELOC=/scratch1/10091/ssonti/ParGaMD
 export USE_LOCAL_SCRATCH=1
 
-export WM_ZMQ_MASTER_HEARTBEAT=100
-export WM_ZMQ_WORKER_HEARTBEAT=100
-export WM_ZMQ_TIMEOUT_FACTOR=300
-export BASH=$SWROOT/bin/bash
-export PERL=$SWROOT/usr/bin/perl
-export ZSH=$SWROOT/bin/zsh
-export IFCONFIG=$SWROOT/bin/ifconfig
-export CUT=$SWROOT/usr/bin/cut
-export TR=$SWROOT/usr/bin/tr
-export LN=$SWROOT/bin/ln
-export CP=$SWROOT/bin/cp
-export RM=$SWROOT/bin/rm
-export SED=$SWROOT/bin/sed
-export CAT=$SWROOT/bin/cat
-export HEAD=$SWROOT/bin/head
-export TAR=$SWROOT/bin/tar
-export AWK=$SWROOT/usr/bin/awk
-export PASTE=$SWROOT/usr/bin/paste
-export GREP=$SWROOT/bin/grep
-export SORT=$SWROOT/usr/bin/sort
-export UNIQ=$SWROOT/usr/bin/uniq
-export HEAD=$SWROOT/usr/bin/head
-export MKDIR=$SWROOT/bin/mkdir
-export ECHO=$SWROOT/bin/echo
-export DATE=$SWROOT/bin/date
-export SANDER=$AMBERHOME/bin/sander
-export PMEMD=$AMBERHOME/bin/pmemd.cuda
-export CPPTRAJ=$AMBERHOME/bin/cpptraj
-""")
+{% include 'partials/env_sh' %}
+"""
         elif hpc_system == "hpc2_ucd":
             # HPC2 (UCD) template - using actual HPC2 configuration
-            return Template("""#!/bin/bash
+            return """#!/bin/bash
 
 source ~/.bash_profile
 module load cuda/11.8.0
@@ -190,37 +594,10 @@ source $AMBERHOME/amber.sh
 export NODELOC=/home/sontisid/ParGaMD_MP/ParGaMD
 export USE_LOCAL_SCRATCH=1
 
-export WM_ZMQ_MASTER_HEARTBEAT=100
-export WM_ZMQ_WORKER_HEARTBEAT=100
-export WM_ZMQ_TIMEOUT_FACTOR=300
-export BASH=$SWROOT/bin/bash
-export PERL=$SWROOT/usr/bin/perl
-export ZSH=$SWROOT/bin/zsh
-export IFCONFIG=$SWROOT/bin/ifconfig
-export CUT=$SWROOT/usr/bin/cut
-export TR=$SWROOT/usr/bin/tr
-export LN=$SWROOT/bin/ln
-export CP=$SWROOT/bin/cp
-export RM=$SWROOT/bin/rm
-export SED=$SWROOT/bin/sed
-export CAT=$SWROOT/bin/cat
-export HEAD=$SWROOT/bin/head
-export TAR=$SWROOT/bin/tar
-export AWK=$SWROOT/usr/bin/awk
-export PASTE=$SWROOT/usr/bin/paste
-export GREP=$SWROOT/bin/grep
-export SORT=$SWROOT/usr/bin/sort
-export UNIQ=$SWROOT/usr/bin/uniq
-export HEAD=$SWROOT/usr/bin/head
-export MKDIR=$SWROOT/bin/mkdir
-export ECHO=$SWROOT/bin/echo
-export DATE=$SWROOT/bin/date
-export SANDER=$AMBERHOME/bin/sander
-export PMEMD=$AMBERHOME/bin/pmemd.cuda
-export CPPTRAJ=$AMBERHOME/bin/cpptraj
-""")
+{% include 'partials/env_sh' %}
+"""
         else:  # Default to Expanse
-            return Template("""#!/bin/bash
+            return """#!/bin/bash
 
 source ~/.bash_profile
 module purge
@@ -251,100 +628,255 @@ source $AMBERHOME/amber.sh
 export NODELOC="${WEST_SIM_ROOT:-$PWD}"
 export USE_LOCAL_SCRATCH=1
 
-export WM_ZMQ_MASTER_HEARTBEAT=100
-export WM_ZMQ_WORKER_HEARTBEAT=100
-export WM_ZMQ_TIMEOUT_FACTOR=300
-export BASH=$SWROOT/bin/bash
-export PERL=$SWROOT/usr/bin/perl
-export ZSH=$SWROOT/bin/zsh
-export IFCONFIG=$SWROOT/bin/ifconfig
-export CUT=$SWROOT/usr/bin/cut
-export TR=$SWROOT/usr/bin/tr
-export LN=$SWROOT/bin/ln
-export CP=$SWROOT/bin/cp
-export RM=$SWROOT/bin/rm
-export SED=$SWROOT/bin/sed
-export CAT=$SWROOT/bin/cat
-export HEAD=$SWROOT/bin/head
-export TAR=$SWROOT/bin/tar
-export AWK=$SWROOT/usr/bin/awk
-export PASTE=$SWROOT/usr/bin/paste
-export GREP=$SWROOT/bin/grep
-export SORT=$SWROOT/usr/bin/sort
-export UNIQ=$SWROOT/usr/bin/uniq
-export HEAD=$SWROOT/usr/bin/head
-export MKDIR=$SWROOT/bin/mkdir
-export ECHO=$SWROOT/bin/echo
-export DATE=$SWROOT/bin/date
-export SANDER=$AMBERHOME/bin/sander
-export PMEMD=$AMBERHOME/bin/pmemd.cuda
-export CPPTRAJ=$AMBERHOME/bin/cpptraj
-""")
+{% include 'partials/env_sh' %}
+"""
     
-    def _get_runseg_sh_template(self):
-        return Template("""#!/bin/bash
+    def _runseg_sh_source(self) -> str:
+        return """#!/bin/bash
+{%- if worker_logs %}
+
+# One log per worker and iteration instead of a file per segment: each
+# segment appends a record framed by SEGMENT / END lines and index.tsv
+# holds its offset and length (python3 seg_log.py N_ITER SEG_ID)
+SEG_LOG_DIR=$WEST_SIM_ROOT/seg_logs/$(printf %06d $WEST_CURRENT_ITER)
+SEG_LOG=$SEG_LOG_DIR/$(hostname -s)-w${WM_PROCESS_INDEX:-0}.log
+SEG_START=$(date +%s)
+mkdir -p $SEG_LOG_DIR
+touch $SEG_LOG
+SEG_LOG_OFFSET=$(stat -c %s $SEG_LOG)
+exec >> $SEG_LOG 2>&1
+echo "=== SEGMENT n_iter=$WEST_CURRENT_ITER seg_id=$WEST_CURRENT_SEG_ID host=$(hostname) worker=${WM_PROCESS_INDEX:-0} start=$(date -Iseconds -d @$SEG_START) ==="
+
+close_seg_log() {
+  echo "=== END n_iter=$WEST_CURRENT_ITER seg_id=$WEST_CURRENT_SEG_ID status=$1 seconds=$(($(date +%s) - SEG_START)) ==="
+  SEG_LOG_LENGTH=$(($(stat -c %s $SEG_LOG) - SEG_LOG_OFFSET))
+  # One short append per segment; index.tsv is shared by all workers
+  printf '%s\\t%s\\t%s\\t%s\\t%s\\t%s\\t%s\\t%s\\n' $WEST_CURRENT_ITER $WEST_CURRENT_SEG_ID $(basename $SEG_LOG) \\
+    $SEG_LOG_OFFSET $SEG_LOG_LENGTH $SEG_START $(date +%s) $1 >> $SEG_LOG_DIR/index.tsv
+}
+{%- endif %}
 
 if [ -n "$SEG_DEBUG" ] ; then
   set -x
   env | sort
 fi
 
+{%- if local_scratch %}
+
+# Run in node-local scratch: read-only inputs come from a per-node cache
+# filled once per job, and only the outputs below are copied back to
+# $WEST_CURRENT_SEG_DATA_REF when the script exits.
+SCRATCH_ROOT=${WEST_LOCAL_SCRATCH:-{{ scratch_root }}}
+INPUTS=$SCRATCH_ROOT/pargamd_inputs_${WEST_JOBID:-$SLURM_JOB_ID}
+SCRIPTS=$INPUTS
+SEG_SCRATCH=$SCRATCH_ROOT/pargamd_seg_${WEST_CURRENT_ITER}_${WEST_CURRENT_SEG_ID}_$$
+
+mkdir -p $INPUTS
+if [ ! -e $INPUTS/.complete ]; then
+  (
+    flock 9
+    if [ ! -e $INPUTS/.complete ]; then
+      cp $WEST_SIM_ROOT/common_files/{{ protein_name }}.prmtop $WEST_SIM_ROOT/common_files/gamd-restart.dat \\
+         $WEST_SIM_ROOT/common_files/md.in $WEST_SIM_ROOT/common_files/md_init.in \\
+         $WEST_SIM_ROOT/common_files/{{ protein_name }}.{{ reference_ext }} \\
+         $WEST_SIM_ROOT/westpa_scripts/pcoord_return.py $INPUTS/ && touch $INPUTS/.complete
+    fi
+  ) 9> $INPUTS/.lock
+fi
+
+stage_out() {
+  mkdir -p $WEST_CURRENT_SEG_DATA_REF
+  if [ $1 -eq 0 ]; then
+    cp -p $(ls {{ stage_out_files | join(' ') }} 2> /dev/null) $WEST_CURRENT_SEG_DATA_REF/
+  else
+    # Failed segment: keep only the log for inspection
+    cp -p seg.log $WEST_CURRENT_SEG_DATA_REF/ 2> /dev/null
+  fi
+  cd $WEST_SIM_ROOT
+  rm -rf $SEG_SCRATCH
+}
+
+mkdir -p $SEG_SCRATCH
+cd $SEG_SCRATCH
+{%- else %}
+
+INPUTS=$WEST_SIM_ROOT/common_files
+SCRIPTS=$WEST_SIM_ROOT/westpa_scripts
+
 cd $WEST_SIM_ROOT
 mkdir -pv $WEST_CURRENT_SEG_DATA_REF
 cd $WEST_CURRENT_SEG_DATA_REF
-
-ln -sv $WEST_SIM_ROOT/common_files/{{ protein_name }}.prmtop .
-ln -sv $WEST_SIM_ROOT/common_files/gamd-restart.dat .
+{%- endif %}
+{%- if local_scratch or worker_logs or watchdog %}
+
+on_exit() {
+  STATUS=$?
+{%- if local_scratch %}
+  stage_out $STATUS
+{%- endif %}
+{%- if worker_logs %}
+  close_seg_log $STATUS
+{%- endif %}
+{%- if watchdog %}
+  kill $SEG_REPORTER 2> /dev/null
+  rm -f $SEG_RECORD $SEG_RECORD.tmp
+{%- endif %}
+}
+trap on_exit EXIT
+{%- endif %}
+{%- if watchdog %}
+
+# Running-segment record for westpa_scripts/watchdog.py, refreshed in the
+# background with the PID of the running pmemd attempt and the time it
+# last wrote output (the current time while no attempt runs)
+SEG_RECORD=$WEST_SIM_ROOT/watchdog/running/$(printf %06d-%06d $WEST_CURRENT_ITER $WEST_CURRENT_SEG_ID)
+SEG_RECORD_START=$(date +%s)
+mkdir -p $(dirname $SEG_RECORD)
+rm -f pmemd.pid
+(
+  while true; do
+    if [ -e pmemd.pid ]; then
+      PMEMD_PID=$(cat pmemd.pid)
+      PROGRESS=$(stat -c %Y pmemd.pid seg_part*.nc seg_part*.log 2> /dev/null | sort -n | tail -1)
+    else
+      PMEMD_PID=
+      PROGRESS=$(date +%s)
+    fi
+    echo "n_iter=$WEST_CURRENT_ITER seg_id=$WEST_CURRENT_SEG_ID host=$(hostname -s) worker=${WM_PROCESS_INDEX:-0}" \\
+         "start=$SEG_RECORD_START progress=$PROGRESS pmemd=$PMEMD_PID" > $SEG_RECORD.tmp
+    mv $SEG_RECORD.tmp $SEG_RECORD
+    sleep ${WEST_WATCHDOG_INTERVAL:-30}
+  done
+) &
+SEG_REPORTER=$!
+{%- endif %}
+
+ln -sv $INPUTS/{{ protein_name }}.prmtop .
+ln -sv $INPUTS/gamd-restart.dat .
 
 if [ "$WEST_CURRENT_SEG_INITPOINT_TYPE" = "SEG_INITPOINT_CONTINUES" ]; then
-  sed "s/RAND/$WEST_RAND16/g" $WEST_SIM_ROOT/common_files/md.in > md.in
+  MDIN=$INPUTS/md.in
+{%- if local_scratch %}
+  cp $WEST_PARENT_DATA_REF/seg.rst ./parent.rst
+{%- else %}
   ln -sv $WEST_PARENT_DATA_REF/seg.rst ./parent.rst
+{%- endif %}
 elif [ "$WEST_CURRENT_SEG_INITPOINT_TYPE" = "SEG_INITPOINT_NEWTRAJ" ]; then
-  sed "s/RAND/$WEST_RAND16/g" $WEST_SIM_ROOT/common_files/md_init.in > md.in
+  MDIN=$INPUTS/md_init.in
+{%- if local_scratch %}
+  cp $WEST_PARENT_DATA_REF ./parent.rst
+{%- else %}
   ln -sv $WEST_PARENT_DATA_REF ./parent.rst
+{%- endif %}
 fi
+sed "s/RAND/$WEST_RAND16/g" $MDIN > md.in
 
 {% if enable_gpu_parallelization %}
 export CUDA_DEVICES=(`echo $CUDA_VISIBLE_DEVICES_ALLOCATED | tr , ' '`)
-export CUDA_VISIBLE_DEVICES=${CUDA_DEVICES[$WM_PROCESS_INDEX]}
+# Workers beyond the device count share GPUs round-robin (segments_per_gpu > 1)
+NUM_DEVICES=$(echo $CUDA_VISIBLE_DEVICES_ALLOCATED | tr , ' ' | wc -w)
+export CUDA_VISIBLE_DEVICES=${CUDA_DEVICES[$((WM_PROCESS_INDEX % NUM_DEVICES))]}
 
 echo "RUNSEG.SH: CUDA_VISIBLE_DEVICES_ALLOCATED = " $CUDA_VISIBLE_DEVICES_ALLOCATED
 echo "RUNSEG.SH: WM_PROCESS_INDEX = " $WM_PROCESS_INDEX
 echo "RUNSEG.SH: CUDA_VISIBLE_DEVICES = " $CUDA_VISIBLE_DEVICES
 {% endif %}
 
-while ! grep -q "Final Performance Info" seg.log; do
-	$PMEMD -O -i md.in   -p {{ protein_name }}.prmtop  -c parent.rst \\
-          -r seg.rst -x seg.nc      -o seg.log    -inf seg.nfo -gamd gamd.log
+# Propagate with at most {{ max_retries }} retries. A retry waits with exponential
+# backoff, draws a new ig and, when the failed attempt left a restart, keeps
+# its frames and continues from that restart instead of step 0. Resuming
+# relies on ntwr = ntwx in md.in (checked by the generator) so seg.rst
+# matches the last trajectory frame.
+NSTLIM={{ nstlim }}
+NTWX={{ ntwx }}
+RETRIES=0
+LOST_SECONDS=0
+DONE_FRAMES=0
+START_RST=parent.rst
+KEPT_PARTS=()
+while true; do
+  ATTEMPT_START=$(date +%s)
+  $PMEMD -O -i md.in   -p {{ protein_name }}.prmtop  -c $START_RST \\
+         -r seg.rst -x seg_part$RETRIES.nc -o seg_part$RETRIES.log -inf seg.nfo -gamd gamd_part$RETRIES.log{% if watchdog %} &
+  # The watchdog kills a stalled attempt by this PID, which ends in a retry
+  echo $! > pmemd.pid
+  wait $!
+  rm -f pmemd.pid{% endif %}
+  if grep -q "Final Performance Info" seg_part$RETRIES.log; then
+    KEPT_PARTS+=($RETRIES)
+    break
+  fi
+
+  LOST_SECONDS=$((LOST_SECONDS + $(date +%s) - ATTEMPT_START))
+  FRAMES=0
+  if [ -s seg.rst ] && [ $(stat -c %Y seg.rst) -ge $ATTEMPT_START ]; then
+    FRAMES=$($CPPTRAJ -p {{ protein_name }}.prmtop -y seg_part$RETRIES.nc -tl 2>/dev/null | awk '/Frames:/ {print $2}')
+  fi
+  if [ "${FRAMES:-0}" -gt 0 ] && [ $(((DONE_FRAMES + FRAMES) * NTWX)) -lt $NSTLIM ]; then
+    KEPT_PARTS+=("$RETRIES 1 $FRAMES")
+    DONE_FRAMES=$((DONE_FRAMES + FRAMES))
+    START_RST=resume_$RETRIES.rst
+    mv seg.rst $START_RST
+  fi
+  echo "RUNSEG.SH: attempt $RETRIES failed after $(($(date +%s) - ATTEMPT_START)) s, resuming at step $((DONE_FRAMES * NTWX))"
+
+  RETRIES=$((RETRIES + 1))
+  if [ $RETRIES -gt {{ max_retries }} ]; then
+    echo "RUNSEG.SH: RETRIES = " $((RETRIES - 1))
+    echo "RUNSEG.SH: LOST_SECONDS = " $LOST_SECONDS
+    echo "RUNSEG.SH: FAILED after {{ max_retries }} retries"
+    cat seg_part*.log > seg.log
+    exit 1
+  fi
+  sleep $(({{ retry_backoff }} * 2 ** (RETRIES - 1)))
+  sed -e "s/RAND/$RANDOM$RANDOM/g" -e "s/nstlim *= *[0-9]*/nstlim = $((NSTLIM - DONE_FRAMES * NTWX))/" $MDIN > md.in
 done
 
+# Join the kept attempts into seg.nc / seg.log / gamd.log
+if [ $RETRIES -eq 0 ]; then
+  mv seg_part0.nc seg.nc
+  mv seg_part0.log seg.log
+  mv gamd_part0.log gamd.log
+else
+  JOIN="parm {{ protein_name }}.prmtop\\n"
+  rm -f seg.log gamd.log
+  for PART in "${KEPT_PARTS[@]}"; do
+    set -- $PART
+    JOIN="${JOIN} trajin seg_part$1.nc $2 $3\\n"
+    cat seg_part$1.log >> seg.log
+    cat gamd_part$1.log >> gamd.log
+  done
+  echo -e "${JOIN} trajout seg.nc netcdf\\n go\\n" | $CPPTRAJ
+  rm -f seg_part*.nc seg_part*.log gamd_part*.log resume_*.rst
+fi
+echo "RUNSEG.SH: RETRIES = " $RETRIES
+echo "RUNSEG.SH: LOST_SECONDS = " $LOST_SECONDS
+
+# Keep host, device and timings in the segment log for seg_telemetry.py
+echo "RUNSEG.SH: HOSTNAME = " $(hostname)
+grep -E "^\\|.*(Hostname|CUDA_VISIBLE_DEVICES|CUDA Device)" seg.log
+sed -n '/Final Performance Info/,$p' seg.log
+
 # Progress Coordinate Calculation
 COMMAND="         parm {{ protein_name }}.prmtop\\n"
-COMMAND="${COMMAND} trajin $WEST_CURRENT_SEG_DATA_REF/parent.rst\\n"
-COMMAND="${COMMAND} trajin $WEST_CURRENT_SEG_DATA_REF/seg.nc\\n"
-{% if has_pdb_file %}
-COMMAND="${COMMAND} reference $WEST_SIM_ROOT/common_files/{{ protein_name }}.pdb\\n"
-{% else %}
-COMMAND="${COMMAND} reference $WEST_SIM_ROOT/common_files/{{ protein_name }}.inpcrd\\n"
-{% endif %}
+COMMAND="${COMMAND} trajin $PWD/parent.rst\\n"
+COMMAND="${COMMAND} trajin $PWD/seg.nc\\n"
+COMMAND="${COMMAND} reference $INPUTS/{{ protein_name }}.{{ reference_ext }}\\n"
 {{ cv_commands }}
 COMMAND="${COMMAND} go\\n"
 
 echo -e $COMMAND | $CPPTRAJ
 
-# Extract progress coordinate values
-{% if cv_count == 1 %}
-cat {{ cv_output_files[0] }} | tail -n +2 | awk {'print $2'} > $WEST_PCOORD_RETURN
-{% else %}
-paste {% for output_file in cv_output_files %}<(cat {{ output_file }} | tail -n +2 | awk {'print $2'}) {% endfor %}>$WEST_PCOORD_RETURN
-{% endif %}
+# Extract progress coordinate values (one process, checks pcoord_len)
+python3 $SCRIPTS/pcoord_return.py --length {{ pcoord_len }} -o $WEST_PCOORD_RETURN \\
+    {{ cv_output_files | join(' ') }} || exit 1
 
 # Clean up
 rm -f md.in seg.nfo seg.pdb
-""")
+"""
     
-    def _get_run_cmd_sh_template(self):
-        return Template("""#!/bin/bash
+    def _run_cmd_sh_source(self) -> str:
+        return """#!/bin/bash
 #SBATCH --job-name="{{ protein_name }}_GaMD"
 #SBATCH --output="job.out"
 #SBATCH --partition=gpu-shared
@@ -370,18 +902,171 @@ export PATH=$PATH:$HOME/bin
 export LD_LIBRARY_PATH=$LD_LIBRARY_PATH
 source $AMBERHOME/amber.sh
 pmemd.cuda -O -i md.in -o md.out -p {{ protein_name }}.prmtop -c {{ protein_name }}.rst -r md_cmd.rst -x md.nc
-""")
+"""
     
-    def _get_run_we_sh_template(self, hpc_system="expanse"):
-        """Get run_WE.sh template based on HPC system"""
+    def _run_we_sh_partial_source(self) -> str:
+        """run_WE.sh from env.sh on, shared by every HPC system
+        
+        Resume, job chaining, the launch plan with per-node GPU detection,
+        the ZMQ server readiness check and the watchdog. copy_cmd_restarts
+        (set by the TACC template) copies the cMD restart files before init.
+        """
+        return """source env.sh || exit 1
+env | sort
+SERVER_INFO=$WEST_SIM_ROOT/west_zmq_info.json
+
+# Continue the run in west.h5; only a missing west.h5 is initialized
+RESUME=$(python3 resume_run.py) || exit 1
+read RESUME_ACTION RESUME_ITER <<< "$RESUME"
+echo "resume: $RESUME"
+case $RESUME_ACTION in
+init)
+{%- if copy_cmd_restarts %}
+    cp cMD/gamd-restart.dat common_files/gamd-restart.dat
+    cp cMD/md.rst bstates/bstate.rst
+    echo "Files copied"
+{%- endif %}
+    ./init.sh || exit 1
+    echo "init.sh ran"
+    ;;
+truncate)
+    # Only a corrupt iteration is truncated: w_run re-runs just the unfinished
+    # segments of an interrupted one, so its completed segments are kept
+    ITER_DIR=$(printf %06d $RESUME_ITER)
+    w_truncate -n $RESUME_ITER || exit 1
+    rm -rf traj_segs/$ITER_DIR seg_logs/$ITER_DIR seg_logs/$ITER_DIR-*.log
+    ;;
+done)
+    echo "all iterations are complete"
+    exit 0
+    ;;
+esac
+{%- if chain_jobs %}
+
+# Queue the next job of the chain now, so it also starts when this one hits the wall time
+CHAIN_DEPTH=${WEST_CHAIN_DEPTH:-0}
+if [ $CHAIN_DEPTH -lt {{ chain_jobs }} ]; then
+    # Nodes in unhealthy_nodes.txt (written by the watchdog) stay out of the chain
+    EXCLUDE=
+    [ -s unhealthy_nodes.txt ] && EXCLUDE=--exclude=$(sort -u unhealthy_nodes.txt | paste -sd, -)
+    NEXT_JOB=$(sbatch --parsable --dependency=afterany:$SLURM_JOB_ID --export=ALL,WEST_CHAIN_DEPTH=$((CHAIN_DEPTH + 1)) $EXCLUDE run_WE.sh)
+    echo "chain: queued job $NEXT_JOB ($((CHAIN_DEPTH + 1)) of {{ chain_jobs }})"
+fi
+{%- endif %}
+
+# Launch plan: every node runs (its GPUs x segments per GPU) workers
+rm -rf nodefilelist.txt
+scontrol show hostname $SLURM_JOB_NODELIST > nodefilelist.txt
+segments_per_gpu={{ segments_per_gpu }}
+{%- if enable_gpu_parallelization and not gpus_per_node %}
+
+# GPUs SLURM assigned on each node ("Nodes=exp-1-[01-04] ... GRES=gpu:4(IDX:0-3)").
+# Only the count is used: with device cgroups (ConstrainDevices) CUDA numbers
+# the visible GPUs from 0, so physical IDX:2 is device 0 inside the job
+count_idx() {
+    for range in $(echo $1 | tr , ' '); do
+        seq ${range%-*} ${range#*-}
+    done | wc -l
+}
+declare -A NODE_DEVICES
+while read -r nodes idx; do
+    for node in $(scontrol show hostname $nodes); do
+        NODE_DEVICES[$node]=$(seq -s, 0 $(($(count_idx $idx) - 1)))
+    done
+done < <(scontrol show job -d $SLURM_JOB_ID | sed -n 's/.* Nodes=\\([^ ]*\\) .*IDX:\\([^)]*\\)).*/\\1 \\2/p')
+
+# Nodes SLURM lists no indices for get as many GPUs as this node sees
+if [ -n "$CUDA_VISIBLE_DEVICES" ]; then
+    num_gpu=$(echo $CUDA_VISIBLE_DEVICES | tr , ' ' | wc -w)
+else
+    num_gpu=${SLURM_GPUS_ON_NODE:-$(nvidia-smi -L 2>/dev/null | wc -l)}
+fi
+[ "$num_gpu" -ge 1 ] 2>/dev/null || num_gpu=1
+default_devices=$(seq -s, 0 $((num_gpu - 1)))
+node_devices() {
+    echo ${NODE_DEVICES[$1]:-$default_devices}
+}
+{%- else %}
+node_devices() {
+    seq -s, 0 {{ (gpus_per_node or 1) - 1 }}
+}
+{%- endif %}
+node_workers() {
+    echo $(($(node_devices $1 | tr , ' ' | wc -w) * segments_per_gpu))
+}
+
+MASTER_NODE=$(hostname -s)
+total_workers=0
+for node in $(cat nodefilelist.txt); do
+    echo "launch plan: $node devices $(node_devices $node), $(node_workers $node) workers"
+    total_workers=$((total_workers + $(node_workers $node)))
+done
+echo "launch plan: $(wc -l < nodefilelist.txt) nodes, $total_workers workers, master on $MASTER_NODE"
+
+# Start the server
+rm -f $SERVER_INFO
+{%- if master_workers %}
+# The master node's workers run inside the server process instead of a separate client
+bash $PWD/node.sh $SLURM_SUBMIT_DIR $SLURM_JOBID $MASTER_NODE $(node_devices $MASTER_NODE) $segments_per_gpu --work-manager=zmq --n-workers=$(node_workers $MASTER_NODE) --zmq-mode=master --zmq-write-host-info=$SERVER_INFO --zmq-comm-mode=tcp &
+{%- else %}
+w_run --work-manager=zmq --n-workers=0 --zmq-mode=master --zmq-write-host-info=$SERVER_INFO --zmq-comm-mode=tcp &> west-$SLURM_JOBID-local.log &
+{%- endif %}
+MASTER_PID=$!
+
+# Wait until the server has written a complete host info file, not just created it
+STARTUP_DEADLINE=$((SECONDS + ${WEST_ZMQ_STARTUP_TIMEOUT:-300}))
+until python3 -c "import json, sys; info = json.load(open(sys.argv[1])); sys.exit(not any(str(v).startswith('tcp://') for v in info.values()))" $SERVER_INFO 2> /dev/null; do
+    if ! kill -0 $MASTER_PID 2> /dev/null; then
+        echo 'server exited before writing its host info'
+        exit 1
+    fi
+    if [ $SECONDS -ge $STARTUP_DEADLINE ]; then
+        echo 'server failed to start'
+        exit 1
+    fi
+    sleep 0.5
+done
+echo "== server info file $SERVER_INFO =="
+cat $SERVER_INFO
+{%- if watchdog != 'off' %}
+
+# Watch running segments for stalls and stragglers (watchdog/alerts.log);
+# it exits with the master
+mkdir -p watchdog/running
+rm -f watchdog/running/*
+python3 westpa_scripts/watchdog.py --mode {{ watchdog }} --master-pid $MASTER_PID ${NEXT_JOB:+--next-job $NEXT_JOB} &> watchdog/watchdog-$SLURM_JOBID.log &
+{%- endif %}
+
+for node in $(cat nodefilelist.txt); do
+{%- if master_workers %}
+    [ "${node%%.*}" = "$MASTER_NODE" ] && continue
+{%- endif %}
+    ssh -o StrictHostKeyChecking=no $node $PWD/node.sh $SLURM_SUBMIT_DIR $SLURM_JOBID $node $(node_devices $node) $segments_per_gpu --work-manager=zmq --n-workers=$(node_workers $node) --zmq-mode=client --zmq-read-host-info=$SERVER_INFO --zmq-comm-mode=tcp &
+done
+wait
+{%- if chain_jobs %}
+
+# The queued job is not needed once the run is complete or this job made no progress
+if [ -n "$NEXT_JOB" ]; then
+    read RESUME_ACTION LAST_ITER <<< "$(python3 resume_run.py)"
+    if [ "$RESUME_ACTION" = done ] || [ "${LAST_ITER:-0}" -le "$RESUME_ITER" ]; then
+        echo "chain: cancelling job $NEXT_JOB (state: $RESUME_ACTION $LAST_ITER)"
+        scancel $NEXT_JOB
+    fi
+fi
+{%- endif %}
+"""
+    
+    def _run_we_sh_source(self, hpc_system: str) -> str:
+        """run_WE.sh template source for one HPC system"""
         if hpc_system == "tacc_frontera":
-            return Template("""#!/bin/bash
+            return """#!/bin/bash
 #SBATCH -J {{ protein_name }}_WE_run
 #SBATCH -o job.out
 #SBATCH -e job.err
 #SBATCH -p rtx
-#SBATCH -N 1
-#SBATCH -n 1
+#SBATCH -N {{ nodes }}
+#SBATCH -n {{ nodes }}
 #SBATCH -t 48:00:00
 #SBATCH -A {{ account }}
 
@@ -411,55 +1096,18 @@ export WEST_SIM_ROOT=$SLURM_SUBMIT_DIR
 cd $WEST_SIM_ROOT
 export PYTHONPATH=/home1/10091/ssonti/miniconda3/envs/westpa-2.0/bin/python:/scratch1/projects/tacc/csa/benchpro/apps/csa-amaro/amber/amber22_rtx/lib/python3.7/site-packages
 
-cp cMD/gamd-restart.dat common_files/gamd-restart.dat
-cp cMD/md.rst bstates/bstate.rst
-echo "Files copied"
-
-./init.sh
-echo "init.sh ran"
-source env.sh || exit 1
-env | sort
-SERVER_INFO=$WEST_SIM_ROOT/west_zmq_info.json
-
-#TODO: set num_gpu_per_node
-num_gpu_per_node=1
-rm -rf nodefilelist.txt
-scontrol show hostname $SLURM_JOB_NODELIST > nodefilelist.txt
-
-# start server
-w_run --work-manager=zmq --n-workers=0 --zmq-mode=master --zmq-write-host-info=$SERVER_INFO --zmq-comm-mode=tcp &> west-$SLURM_JOBID-local.log &
-
-# wait on host info file up to 1 min
-for ((n=0; n<60; n++)); do
-    if [ -e $SERVER_INFO ] ; then
-        echo "== server info file $SERVER_INFO =="
-        cat $SERVER_INFO
-        break
-    fi
-    sleep 1
-done
-
-# exit if host info file doesn't appear in one minute
-if ! [ -e $SERVER_INFO ] ; then
-    echo 'server failed to start'
-    exit 1
-fi
-export CUDA_VISIBLE_DEVICES=0
-echo $CUDA_VISIBLE_DEVICES
-for node in $(cat nodefilelist.txt); do
-    ssh -o StrictHostKeyChecking=no $node $PWD/node.sh $SLURM_SUBMIT_DIR $SLURM_JOBID $node $CUDA_VISIBLE_DEVICES --work-manager=zmq --n-workers=$num_gpu_per_node --zmq-mode=client --zmq-read-host-info=$SERVER_INFO --zmq-comm-mode=tcp &
-done
-wait
-""")
+{% set copy_cmd_restarts = true -%}
+{% include 'partials/run_we_sh' %}
+"""
         elif hpc_system == "hpc2_ucd":
             # HPC2 (UCD) template - using actual HPC2 configuration
-            return Template("""#!/bin/bash
+            return """#!/bin/bash
 #SBATCH --job-name="{{ protein_name }}_WE_run"
 #SBATCH --account={{ account }}
 #SBATCH --partition=gpu-ahn
-#SBATCH --nodes=1
+#SBATCH --nodes={{ nodes }}
 #SBATCH --ntasks-per-node=1
-#SBATCH --gres=gpu:1
+#SBATCH --gres=gpu:{{ node_gpus }}
 #SBATCH --time=48:00:00
 #SBATCH --output=job.out
 #SBATCH --error=job.err
@@ -477,49 +1125,15 @@ export LD_LIBRARY_PATH=$LD_LIBRARY_PATH
 export WEST_SIM_ROOT=$SLURM_SUBMIT_DIR
 cd $WEST_SIM_ROOT
 
-./init.sh
-echo "init.sh ran"
-source env.sh || exit 1
-env | sort
-SERVER_INFO=$WEST_SIM_ROOT/west_zmq_info.json
-
-#TODO: set num_gpu_per_node
-num_gpu_per_node=1
-rm -rf nodefilelist.txt
-scontrol show hostname $SLURM_JOB_NODELIST > nodefilelist.txt
-
-# start server
-w_run --work-manager=zmq --n-workers=0 --zmq-mode=master --zmq-write-host-info=$SERVER_INFO --zmq-comm-mode=tcp &> west-$SLURM_JOBID-local.log &
-
-# wait on host info file up to 1 min
-for ((n=0; n<60; n++)); do
-    if [ -e $SERVER_INFO ] ; then
-        echo "== server info file $SERVER_INFO =="
-        cat $SERVER_INFO
-        break
-    fi
-    sleep 1
-done
-
-# exit if host info file doesn't appear in one minute
-if ! [ -e $SERVER_INFO ] ; then
-    echo 'server failed to start'
-    exit 1
-fi
-export CUDA_VISIBLE_DEVICES=0
-echo $CUDA_VISIBLE_DEVICES
-for node in $(cat nodefilelist.txt); do
-    bash $PWD/node.sh $SLURM_SUBMIT_DIR $SLURM_JOBID $node $CUDA_VISIBLE_DEVICES --work-manager=zmq --n-workers=$num_gpu_per_node --zmq-mode=client --zmq-read-host-info=$SERVER_INFO --zmq-comm-mode=tcp &
-done
-wait
-""")
+{% include 'partials/run_we_sh' %}
+"""
         else:  # Default to Expanse
-            return Template("""#!/bin/bash
+            return """#!/bin/bash
 #SBATCH --job-name="{{ protein_name }}_WE_run"
 #SBATCH --output="job.out"
-#SBATCH --partition=gpu-shared
-#SBATCH --nodes=1
-#SBATCH --gpus=1
+#SBATCH --partition={{ 'gpu' if nodes > 1 or not gpus_per_node else 'gpu-shared' }}
+#SBATCH --nodes={{ nodes }}
+#SBATCH --gpus-per-node={{ node_gpus }}
 #SBATCH --ntasks-per-node=1
 #SBATCH --mem=50G
 #SBATCH --account={{ account }}
@@ -545,42 +1159,8 @@ export WEST_SIM_ROOT=$SLURM_SUBMIT_DIR
 cd $WEST_SIM_ROOT
 export PYTHONPATH=$HOME/miniconda3/envs/westpa-2.0/bin/python
 
-./init.sh
-echo "init.sh ran"
-source env.sh || exit 1
-env | sort
-SERVER_INFO=$WEST_SIM_ROOT/west_zmq_info.json
-
-#TODO: set num_gpu_per_node
-num_gpu_per_node=1
-rm -rf nodefilelist.txt
-scontrol show hostname $SLURM_JOB_NODELIST > nodefilelist.txt
-
-# start server
-w_run --work-manager=zmq --n-workers=0 --zmq-mode=master --zmq-write-host-info=$SERVER_INFO --zmq-comm-mode=tcp &> west-$SLURM_JOBID-local.log &
-
-# wait on host info file up to 1 min
-for ((n=0; n<60; n++)); do
-    if [ -e $SERVER_INFO ] ; then
-        echo "== server info file $SERVER_INFO =="
-        cat $SERVER_INFO
-        break
-    fi
-    sleep 1
-done
-
-# exit if host info file doesn't appear in one minute
-if ! [ -e $SERVER_INFO ] ; then
-    echo 'server failed to start'
-    exit 1
-fi
-export CUDA_VISIBLE_DEVICES=0
-echo $CUDA_VISIBLE_DEVICES
-for node in $(cat nodefilelist.txt); do
-    ssh -o StrictHostKeyChecking=no $node $PWD/node.sh $SLURM_SUBMIT_DIR $SLURM_JOBID $node $CUDA_VISIBLE_DEVICES --work-manager=zmq --n-workers=$num_gpu_per_node --zmq-mode=client --zmq-read-host-info=$SERVER_INFO --zmq-comm-mode=tcp &
-done
-wait
-""")
+{% include 'partials/run_we_sh' %}
+"""
     
     def generate_bin_boundaries(self, min_val: float, max_val: float, step_size: float, include_infinite_bounds: bool = True) -> List:
         """Generate bin boundaries for progress coordinates"""
@@ -601,6 +1181,249 @@ wait
             boundaries.append('inf')
         return boundaries
     
+    def bin_layout(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Bin mapper settings for west.cfg and the number of bins they create
+        
+        bin_scheme selects the mapper:
+        - 'rectilinear' (default): the full grid of every CV's min/max/step
+        - 'mab': a MABBinMapper with mab_nbins bins per CV, placed over the
+          whole pcoord space; mab_direction per CV is 1 / -1 to push
+          towards larger / smaller values, 0 for both, 86 to skip the CV
+        - 'nested': the rectilinear grid, with each of bin_regions
+          ({'at': point, 'step': finer step per CV}) replacing the coarse
+          bin that contains its point by a finer grid
+        Per-CV settings accept a single value for all CVs.
+        """
+        include_inf = bool(params.get('include_infinite_bounds', True))
+        cv_list, _, _ = self._cv_setup(params)
+        ndim = len(cv_list)
+        
+        # Generate bin boundaries for each CV
+        cv_bins = []
+        for cv in cv_list:
+            cv_bins.append(self.generate_bin_boundaries(
+                cv['min'], cv['max'], cv['step'], include_inf
+            ))
+        
+        scheme = params.get('bin_scheme', 'rectilinear')
+        layout = {'bin_scheme': scheme, 'cv_bins': cv_bins}
+        grid_bins = math.prod(len(boundaries) - 1 for boundaries in cv_bins)
+        
+        if scheme == 'rectilinear':
+            layout['n_bins'] = grid_bins
+        elif scheme == 'mab':
+            nbins = _per_cv(params.get('mab_nbins', MAB_DEFAULT_NBINS), ndim, int, 'mab_nbins')
+            direction = _per_cv(params.get('mab_direction', 0), ndim, int, 'mab_direction')
+            if any(d not in MAB_DIRECTIONS for d in direction):
+                raise ValueError(f"mab_direction values must be one of {MAB_DIRECTIONS}")
+            bottleneck = bool(params.get('mab_bottleneck', True))
+            layout.update(
+                base_bins=[['-inf', 'inf']] * ndim,
+                mab_nbins=nbins,
+                mab_direction=direction,
+                mab_bottleneck=bottleneck,
+                mab_at=[float(f"{(float(cv['min']) + float(cv['max'])) / 2:.6g}") for cv in cv_list]
+            )
+            # Regular MAB grid plus the leading (and bottleneck) walker bins
+            # MABBinMapper adds per tracked direction of each CV
+            extra = sum((0 if d == 86 else 2 if d == 0 else 1) * (2 if bottleneck else 1) for d in direction)
+            layout['n_bins'] = math.prod(nbins) + extra
+        elif scheme == 'nested':
+            regions = [self._nested_region(region, cv_bins) for region in params.get('bin_regions', [])]
+            seen = set()
+            for region in regions:
+                if region['base_bin'] in seen:
+                    raise ValueError(f"Refined regions at {region['at']} share a coarse bin with another region")
+                seen.add(region['base_bin'])
+            layout['regions'] = regions
+            layout['n_bins'] = grid_bins - len(regions) + sum(region['n_bins'] for region in regions)
+        else:
+            raise ValueError(f"Unknown bin_scheme '{scheme}'; expected one of {', '.join(BIN_SCHEMES)}")
+        return layout
+    
+    def _nested_region(self, region: Dict[str, Any], cv_bins: List[List]) -> Dict[str, Any]:
+        """Finer boundaries for the coarse bin containing region['at']"""
+        ndim = len(cv_bins)
+        at = _per_cv(region['at'], ndim, float, 'at')
+        steps = _per_cv(region['step'], ndim, float, 'step')
+        boundaries = []
+        base_bin = []
+        n_bins = 1
+        for value, step, edges in zip(at, steps, cv_bins):
+            finite = [edge for edge in edges if not isinstance(edge, str)]
+            index = bisect.bisect_right(finite, value)
+            if index == 0 or index == len(finite):
+                raise ValueError(f"Refined region at {at} lies outside the CV min/max range")
+            low, high = finite[index - 1], finite[index]
+            inner = [edge for edge in self.generate_bin_boundaries(low, high, step, False) if low < edge < high]
+            # Open outer edges: the parent bin decides what reaches this mapper
+            boundaries.append(['-inf'] + inner + ['inf'])
+            base_bin.append(index)
+            n_bins *= len(inner) + 1
+        return {'at': at, 'boundaries': boundaries, 'n_bins': n_bins, 'base_bin': tuple(base_bin)}
+    
+    def estimate_max_walkers(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Upper bound on walkers per iteration (bins x bin_target_counts)
+        
+        Every bin can hold bin_target_counts walkers, so this is also the
+        most segments, and GPU jobs, one WE iteration can launch.
+        """
+        layout = self.bin_layout(params)
+        target = int(params.get('bin_target_counts', 4))
+        return {
+            'bin_scheme': layout['bin_scheme'],
+            'n_bins': layout['n_bins'],
+            'bin_target_counts': target,
+            'max_walkers': layout['n_bins'] * target
+        }
+    
+    def estimate_resources(self, params: Dict[str, Any], uploaded_files: Dict[str, Dict] = None) -> Dict[str, Any]:
+        """Predict walkers, storage and GPU time of a run before it is submitted
+        
+        All figures assume every bin is filled (max_walkers), so they are
+        upper bounds. Returns the estimates, the calibration used and a
+        list of warnings for settings that exceed per-job limits.
+        """
+        calibration = self._calibration(params)
+        walkers = self.estimate_max_walkers(params)
+        max_walkers = walkers['max_walkers']
+        ndim = len(self._cv_setup(params)[0])
+        nstlim = int(params['nstlim'])
+        ntpr = max(int(params['ntpr']), 1)
+        ntwx = max(int(params.get('ntwx', ntpr)), 1)
+        pcoord_len = self._pcoord_len(params)
+        iterations = int(params['max_total_iterations'])
+        n_atoms = self._count_atoms(params, uploaded_files) or int(calibration['reference_atoms'])
+        
+        # west.h5: float32 pcoord plus per-segment bookkeeping
+        pcoord_bytes = max_walkers * pcoord_len * ndim * 4
+        h5_iteration_bytes = pcoord_bytes + max_walkers * H5_SEGMENT_BYTES + H5_ITERATION_BYTES
+        
+        # traj_segs: NetCDF restart (coordinates + velocities) and trajectory, logs, CV files
+        segment_bytes = (
+            NETCDF_HEADER_BYTES + n_atoms * 3 * 8 * 2 +
+            NETCDF_HEADER_BYTES + (nstlim // ntwx) * (n_atoms * 3 * 4 + 4) +
+            MDOUT_HEADER_BYTES + (nstlim // ntpr) * (MDOUT_BYTES_PER_PRINT + GAMD_LOG_BYTES_PER_PRINT) +
+            pcoord_len * ndim * CV_BYTES_PER_LINE + SEGMENT_MISC_BYTES
+        )
+        
+        # GPU time: per-segment pmemd throughput scaled to this system and
+        # shared with the segments packed on its GPU, plus fixed per-segment work
+        ns_per_day = self._segment_ns_per_day(params, calibration, n_atoms)
+        segment_ns = nstlim * float(params.get('dt', 0.002)) / 1000.0
+        segment_hours = self._segment_seconds(params, calibration, n_atoms) / 3600.0
+        # Segments run side by side as run_WE.sh lays out its workers
+        segments_per_gpu = self.worker_layout(params)[1]
+        gpus = self.node_gpus(params) * max(int(params.get('nodes') or 1), 1)
+        concurrent = gpus * segments_per_gpu
+        iteration_hours = math.ceil(max_walkers / concurrent) * segment_hours
+        total_hours = iteration_hours * iterations
+        
+        estimates = {
+            'n_atoms': n_atoms,
+            'n_bins': walkers['n_bins'],
+            'max_walkers': max_walkers,
+            'pcoord_len': pcoord_len,
+            'pcoord_bytes_per_iteration': pcoord_bytes,
+            'west_h5_bytes': h5_iteration_bytes * iterations,
+            'traj_segs_bytes': segment_bytes * max_walkers * iterations,
+            'segment_ns': segment_ns,
+            'ns_per_day': ns_per_day,
+            'segment_hours': segment_hours,
+            'concurrent_gpus': gpus,
+            'concurrent_segments': concurrent,
+            'iteration_hours': iteration_hours,
+            'wall_hours': total_hours,
+            'gpu_hours': total_hours * gpus,
+            'allocations': math.ceil(total_hours / calibration['max_job_hours']),
+        }
+        
+        warnings = []
+        limit = calibration['max_job_hours']
+        if segment_hours > limit:
+            warnings.append(f"One segment takes {segment_hours:.1f} h, longer than the {limit:g} h job limit; "
+                            f"reduce nstlim")
+        elif iteration_hours > limit:
+            warnings.append(f"One WE iteration takes up to {iteration_hours:.1f} h on {gpus} GPU(s) "
+                            f"running {concurrent} segments at a time, "
+                            f"longer than the {limit:g} h job limit; reduce walkers or add GPUs")
+        if max_walkers > MAX_WALKERS_WARNING:
+            warnings.append(f"Up to {max_walkers} walkers per iteration ({walkers['n_bins']} bins x "
+                            f"{walkers['bin_target_counts']}); consider coarser bins or adaptive (MAB) binning")
+        storage_gb = (estimates['west_h5_bytes'] + estimates['traj_segs_bytes']) / 1e9
+        if storage_gb > calibration['storage_limit_gb']:
+            warnings.append(f"west.h5 and traj_segs may reach {storage_gb:,.0f} GB, above the "
+                            f"{calibration['storage_limit_gb']:g} GB storage limit")
+        return {'estimates': estimates, 'calibration': calibration, 'warnings': warnings}
+    
+    def _calibration(self, params: Dict[str, Any]) -> Dict[str, float]:
+        """RESOURCE_CALIBRATION entry of the HPC system with params overrides"""
+        hpc_system = params.get('hpc_system', DEFAULT_HPC_SYSTEM)
+        calibration = dict(RESOURCE_CALIBRATION.get(hpc_system, RESOURCE_CALIBRATION[DEFAULT_HPC_SYSTEM]))
+        for key in calibration:
+            if params.get(key):
+                calibration[key] = float(params[key])
+        return calibration
+    
+    def _segment_ns_per_day(self, params: Dict[str, Any], calibration: Dict[str, float], n_atoms: int) -> float:
+        """pmemd throughput of one segment, scaled to n_atoms
+        
+        The calibration rate is for one segment alone on a GPU, so with
+        segments_per_gpu > 1 it is split between the packed segments (times
+        packing_gain). A measured ns_per_day from params already includes
+        the sharing and is only scaled.
+        """
+        ns_per_day = calibration['ns_per_day'] * calibration['reference_atoms'] / n_atoms
+        if not params.get('ns_per_day'):
+            segments_per_gpu = self.worker_layout(params)[1]
+            ns_per_day *= min(calibration['packing_gain'], segments_per_gpu) / segments_per_gpu
+        return ns_per_day
+    
+    def _segment_seconds(self, params: Dict[str, Any], calibration: Dict[str, float], n_atoms: int) -> float:
+        """Expected wall time of one segment: scaled pmemd throughput plus overhead"""
+        ns_per_day = self._segment_ns_per_day(params, calibration, n_atoms)
+        segment_ns = int(params['nstlim']) * float(params.get('dt', 0.002)) / 1000.0
+        return segment_ns / ns_per_day * 86400.0 + calibration['segment_overhead_s']
+    
+    def zmq_timing(self, params: Dict[str, Any], uploaded_files: Dict[str, Dict] = None) -> Dict[str, int]:
+        """ZMQ heartbeat interval and timeout factor for env.sh
+        
+        A worker silent for heartbeat * timeout_factor seconds is dropped
+        and its segment handed to another worker. The timeout is about two
+        segment runtimes (zmq_timeout overrides, at least ZMQ_MIN_TIMEOUT),
+        so a dead node costs at most a couple of segments instead of hours.
+        """
+        calibration = self._calibration(params)
+        n_atoms = self._count_atoms(params, uploaded_files) or int(calibration['reference_atoms'])
+        segment_seconds = self._segment_seconds(params, calibration, n_atoms)
+        timeout = int(params.get('zmq_timeout') or 0) or ZMQ_TIMEOUT_SEGMENTS * segment_seconds
+        timeout = max(timeout, ZMQ_MIN_TIMEOUT)
+        heartbeat = int(min(max(timeout / 30.0, ZMQ_HEARTBEAT_RANGE[0]), ZMQ_HEARTBEAT_RANGE[1]))
+        return {
+            'heartbeat': heartbeat,
+            'timeout_factor': math.ceil(timeout / heartbeat),
+            'segment_seconds': int(round(segment_seconds)),
+        }
+    
+    def _count_atoms(self, params: Dict[str, Any], uploaded_files: Optional[Dict[str, Dict]]) -> Optional[int]:
+        """Atom count from params, the uploaded or bundled topology, or the PDB"""
+        if params.get('n_atoms'):
+            return int(params['n_atoms'])
+        uploaded_files = uploaded_files or {}
+        protein_name = params.get('protein_name', 'chignolin')
+        sources = [
+            (uploaded_files.get('prmtop_file', {}).get('content'), _prmtop_atoms),
+            (uploaded_files.get('pdb_file', {}).get('content'), _pdb_atoms),
+            (self.assets.get(f'common_files/{protein_name}.prmtop'), _prmtop_atoms),
+            (self.assets.get(f'common_files/{protein_name}.pdb'), _pdb_atoms),
+        ]
+        for content, count in sources:
+            if content is not None:
+                n_atoms = count(content)
+                if n_atoms:
+                    return n_atoms
+        return None
+    
     def _get_cpptraj_command(self, cv_type: str, output_file: str, cv_name: str) -> str:
         """Generate CPPTRAJ command for specific CV type"""
         commands = {
@@ -616,201 +1439,145 @@ wait
         }
         return commands.get(cv_type, commands["rmsd"])  # Default to RMSD
     
-    def generate_configs(self, params: Dict[str, Any], uploaded_files: Dict[str, Dict] = None) -> Dict[str, str]:
-        """Generate all configuration files based on user parameters"""
-        configs = {}
-        
-        # Handle uploaded files if provided
-        if uploaded_files:
-            protein_name = params.get('protein_name', 'chignolin')
-            
-            # Handle structure files (PDB or INPCRD)
-            if 'pdb_file' in uploaded_files:
-                pdb_content = uploaded_files['pdb_file']['content']
-                # PDB files are text files, so decode as UTF-8
-                if isinstance(pdb_content, bytes):
-                    try:
-                        pdb_content = pdb_content.decode('utf-8')
-                    except UnicodeDecodeError:
-                        # Try with latin-1 if UTF-8 fails
-                        pdb_content = pdb_content.decode('latin-1')
-                configs[f'common_files/{protein_name}.pdb'] = pdb_content
-                configs[f'cMD/{protein_name}.pdb'] = pdb_content
-            
-            if 'inpcrd_file' in uploaded_files:
-                inpcrd_content = uploaded_files['inpcrd_file']['content']
-                # INPCRD files are binary, store as base64 encoded string
-                if isinstance(inpcrd_content, bytes):
-                    import base64
-                    inpcrd_content = base64.b64encode(inpcrd_content).decode('ascii')
-                configs[f'common_files/{protein_name}.inpcrd'] = inpcrd_content
-                configs[f'cMD/{protein_name}.inpcrd'] = inpcrd_content
-            
-            # Handle PRMTOP file
-            if 'prmtop_file' in uploaded_files:
-                prmtop_content = uploaded_files['prmtop_file']['content']
-                # PRMTOP files are binary, store as base64 encoded string
-                if isinstance(prmtop_content, bytes):
-                    import base64
-                    prmtop_content = base64.b64encode(prmtop_content).decode('ascii')
-                configs[f'common_files/{protein_name}.prmtop'] = prmtop_content
-                configs[f'cMD/{protein_name}.prmtop'] = prmtop_content
-            
-            # Handle optional RST file
-            if 'rst_file' in uploaded_files:
-                rst_content = uploaded_files['rst_file']['content']
-                rst_as_bstate = params.get('rst_as_bstate', False)
-                
-                # RST files are binary, store as base64 encoded string
-                if isinstance(rst_content, bytes):
-                    import base64
-                    rst_content = base64.b64encode(rst_content).decode('ascii')
-                
-                if rst_as_bstate:
-                    # Place as bstate.rst in bstates folder for ParGaMD simulation
-                    configs['bstates/bstate.rst'] = rst_content
-                else:
-                    # Place in cMD folder for conventional MD
-                    configs[f'cMD/{protein_name}.rst'] = rst_content
+    def generate_configs(self, params: Dict[str, Any], uploaded_files: Dict[str, Dict] = None) -> Dict[str, BundleContent]:
+        """Generate all configuration files based on user parameters
         
-        include_inf = bool(params.get('include_infinite_bounds', True))
+        Text files are str. Uploaded INPCRD / PRMTOP / RST files and binary
+        static files are bytes or memoryview and are never re-encoded.
         
-        # Get CV list from parameters
-        cv_list = params.get('cv_list', [{'type': 'rmsd', 'min': 0.0, 'max': 8.0, 'step': 0.2}])
+        Files whose parameters and uploads (see dependency_map) are unchanged
+        since the previous call are taken from last_result instead of being
+        rendered again. A re-rendered file keeps the previous string object
+        if its content hash is unchanged.
+        """
+        # Callers edit the returned dict in place; last_result stays pristine
+        return dict(self.iter_bundle_entries(params, uploaded_files))
+    
+    def iter_bundle_entries(self, params: Dict[str, Any], uploaded_files: Dict[str, Dict] = None
+                            ) -> Iterator[Tuple[str, BundleContent]]:
+        """Yield (path, content) of every bundle file in order, rendering each on demand
         
-        # Calculate pcoord_len based on nstlim and ntpr
-        nstlim = int(params['nstlim'])
-        ntpr = int(params['ntpr'])
-        if ntpr <= 0:
-            ntpr = 1
-        pcoord_len = (nstlim // ntpr) + 1
+        Feed this to write_bundle to build an archive without a dict of the
+        whole bundle. The cache behind generate_configs is updated once the
+        iteration completes.
+        """
+        self.output_intervals(params)
+        configs = {}
+        keys = {}
+        digests = {}
+        for path, deps, render in self._bundle_plan(params, uploaded_files):
+            content = None
+            if deps is not None:
+                keys[path] = self._dependency_key(deps, params, uploaded_files)
+                if self._keys.get(path) == keys[path]:
+                    content = self.last_result[path]
+            if content is None:
+                content = render()
+            previous = self.last_result.get(path)
+            if previous is content:
+                digests[path] = self.digests[path]
+            else:
+                digests[path] = content_digest(content)
+                if self.digests.get(path) == digests[path]:
+                    content = previous
+            configs[path] = content
+            yield path, content
         
-        # Generate bin boundaries for each CV
-        cv_bins = []
-        for cv in cv_list:
-            cv_bins.append(self.generate_bin_boundaries(
-                cv['min'], cv['max'], cv['step'], include_inf
-            ))
+        self.last_result = configs
+        self.digests = digests
+        self._keys = keys
+    
+    def render_file(self, path: str, params: Dict[str, Any], uploaded_files: Dict[str, Dict] = None) -> BundleContent:
+        """Original content of one output file, rendering nothing else"""
+        for plan_path, deps, render in self._bundle_plan(params, uploaded_files):
+            if plan_path != path:
+                continue
+            if deps is not None and path in self.last_result and \
+                    self._keys.get(path) == self._dependency_key(deps, params, uploaded_files):
+                return self.last_result[path]
+            return render()
+        raise KeyError(f"{path} is not part of the bundle for these parameters")
+    
+    def dependency_map(self, params: Dict[str, Any], uploaded_files: Dict[str, Dict] = None) -> Dict[str, Tuple[str, ...]]:
+        """Parameter keys and uploads ('upload:<key>') each output file depends on
         
-        # Generate west.cfg
-        configs['west.cfg'] = self.templates['west_cfg'].render(
-            pcoord_len=pcoord_len,
-            pcoord_ndim=len(cv_list),
-            cv_bins=cv_bins,
-            bin_target_counts=int(params['bin_target_counts']),
-            max_total_iterations=int(params['max_total_iterations'])
-        )
+        Static files map to an empty tuple. protein_name, rst_as_bstate and
+        the set of uploads also decide which files are in the bundle.
+        """
+        return {path: deps or () for path, deps, _ in self._bundle_plan(params, uploaded_files)}
+    
+    def affected_outputs(self, changed: List[str], params: Dict[str, Any],
+                         uploaded_files: Dict[str, Dict] = None) -> List[str]:
+        """Output files that depend on any of the changed parameter / upload keys"""
+        changed = set(changed)
+        return [path for path, deps in self.dependency_map(params, uploaded_files).items()
+                if changed.intersection(deps)]
+    
+    def _bundle_plan(self, params: Dict[str, Any], uploaded_files: Optional[Dict[str, Dict]]
+                     ) -> List[Tuple[str, Optional[Tuple[str, ...]], Callable[[], BundleContent]]]:
+        """(path, dependencies, renderer) of every bundle file, in bundle order
         
-        # Generate env.sh based on HPC system
-        hpc_system = params.get('hpc_system', 'expanse')
-        configs['env.sh'] = self._get_env_sh_template(hpc_system).render()
+        Static files have dependencies None; AssetStore keeps those current.
+        """
+        uploaded_files = uploaded_files or {}
+        plan = []
         
-        # Generate commands for each CV
-        cv_commands = []
-        cv_output_files = []
+        # Handle uploaded files if provided
+        protein_name = params.get('protein_name', 'chignolin')
         
-        for i, cv in enumerate(cv_list):
-            cv_type = cv['type']
-            
-            # Use custom name if available, otherwise default naming
-            if cv_type == 'custom' and 'name' in cv:
-                cv_name = cv['name']
-                output_file = f"custom_{i+1}.dat"
-            else:
-                cv_name = f"CV{i+1}"
-                output_file = f"{cv_type}_{i+1}.dat"
-            
-            cv_commands.append(self._get_cpptraj_command(cv_type, output_file, cv_name))
-            cv_output_files.append(output_file)
+        def upload(key):
+            return lambda: self._encoded_upload(key, uploaded_files[key]['content'])
         
-        # Determine if PDB file is available
-        has_pdb_file = uploaded_files and 'pdb_file' in uploaded_files if uploaded_files else False
+        # Handle structure files (PDB or INPCRD)
+        for key, extension in (('pdb_file', 'pdb'), ('inpcrd_file', 'inpcrd'), ('prmtop_file', 'prmtop')):
+            if key in uploaded_files:
+                deps = ('protein_name', 'upload:' + key)
+                plan.append((f'common_files/{protein_name}.{extension}', deps, upload(key)))
+                plan.append((f'cMD/{protein_name}.{extension}', deps, upload(key)))
         
-        # Generate runseg.sh
-        configs['westpa_scripts/runseg.sh'] = self.templates['runseg_sh'].render(
-            protein_name=params['protein_name'],
-            enable_gpu_parallelization=params['enable_gpu_parallelization'],
-            cv_commands='\n'.join(cv_commands),
-            cv_output_files=cv_output_files,
-            cv_count=len(cv_list),
-            has_pdb_file=has_pdb_file
-        )
-        
-        # Generate run_cmd.sh
-        configs['cMD/run_cmd.sh'] = self.templates['run_cmd_sh'].render(
-            protein_name=params['protein_name'],
-            account=params['account'],
-            email=params['email']
-        )
-        
-        # Generate run_WE.sh based on HPC system
-        configs['run_WE.sh'] = self._get_run_we_sh_template(hpc_system).render(
-            protein_name=params['protein_name'],
-            account=params['account'],
-            email=params['email']
-        )
+        # Handle optional RST file
+        if 'rst_file' in uploaded_files:
+            if params.get('rst_as_bstate', False):
+                # Place as bstate.rst in bstates folder for ParGaMD simulation
+                rst_path = 'bstates/bstate.rst'
+            else:
+                # Place in cMD folder for conventional MD
+                rst_path = f'cMD/{protein_name}.rst'
+            plan.append((rst_path, ('protein_name', 'rst_as_bstate', 'upload:rst_file'), upload('rst_file')))
         
-        # Generate get_pcoord.sh (for initial state analysis)
-        configs['westpa_scripts/get_pcoord.sh'] = self._get_get_pcoord_sh_template().render(
-            protein_name=params['protein_name'],
-            cv_commands='\n'.join(cv_commands),
-            cv_output_files=cv_output_files,
-            cv_count=len(cv_list),
-            has_pdb_file=has_pdb_file
-        )
+        # Generated files
+        plan.append(('west.cfg', WEST_CFG_PARAMS, lambda: self._render_west_cfg(params)))
+        plan.append(('env.sh', ENV_SH_PARAMS, lambda: self._render_env_sh(params, uploaded_files)))
+        plan.append(('westpa_scripts/runseg.sh', RUNSEG_PARAMS,
+                     lambda: self._render_runseg_sh(params, uploaded_files)))
+        plan.append(('cMD/run_cmd.sh', ('protein_name', 'account', 'email'),
+                     lambda: self._render_run_cmd_sh(params)))
+        plan.append(('run_WE.sh', RUN_WE_PARAMS,
+                     lambda: self._render_run_we_sh(params)))
+        plan.append(('westpa_scripts/get_pcoord.sh', GET_PCOORD_PARAMS,
+                     lambda: self._render_get_pcoord_sh(params, uploaded_files)))
+        for md_in in MD_IN_FILES:
+            plan.append((md_in, MD_IN_PARAMS, lambda md_in=md_in: self._render_md_in(md_in, params)))
         
         # Add all main folder .sh files
         main_sh_files = ['run_data.sh', 'run.sh', 'reweight-2d.sh', 'node.sh', 'init.sh']
-        for sh_file in main_sh_files:
-            try:
-                with open(sh_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    configs[sh_file] = f.read()
-            except FileNotFoundError:
-                # Create a basic template if file doesn't exist
-                configs[sh_file] = f"#!/bin/bash\n# {sh_file}\necho 'Running {sh_file}'\n"
         
         # Add Python scripts
-        python_scripts = ['simtime.py', 'data_extract.py']
-        for py_file in python_scripts:
-            try:
-                with open(py_file, 'r', encoding='utf-8', errors='ignore') as f:
-                    configs[py_file] = f.read()
-            except FileNotFoundError:
-                # Create a basic template if file doesn't exist
-                configs[py_file] = f"#!/usr/bin/env python3\n# {py_file}\nprint('Running {py_file}')\n"
+        python_scripts = ['simtime.py', 'data_extract.py', 'west_reader.py', 'seg_telemetry.py',
+                          'seg_log.py', 'lineage_index.py', 'resume_run.py']
         
         # Add common_files folder contents (only if not already provided by uploaded files)
-        protein_name = params.get('protein_name', 'chignolin')
         common_files = [
-            'common_files/gamd-restart.dat',
-            'common_files/md_init.in',
-            'common_files/md.in'
+            'common_files/gamd-restart.dat'
         ]
         
         # Only add default structure/topology files if not provided by uploads
-        if not (uploaded_files and ('pdb_file' in uploaded_files or 'inpcrd_file' in uploaded_files)):
+        if not ('pdb_file' in uploaded_files or 'inpcrd_file' in uploaded_files):
             common_files.append(f'common_files/{protein_name}.pdb')
         
-        if not (uploaded_files and 'prmtop_file' in uploaded_files):
+        if 'prmtop_file' not in uploaded_files:
             common_files.append(f'common_files/{protein_name}.prmtop')
         
-        for file_path in common_files:
-            # Skip if already in configs (from uploaded files)
-            if file_path in configs:
-                continue
-                
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    configs[file_path] = f.read()
-            except FileNotFoundError:
-                # Create placeholder content for missing files
-                if file_path.endswith('.pdb'):
-                    configs[file_path] = "# Placeholder PDB file\n# Upload your protein structure here\n"
-                elif file_path.endswith('.prmtop'):
-                    configs[file_path] = "# Placeholder PRMTOP file\n# Upload your topology file here\n"
-                else:
-                    configs[file_path] = f"# Placeholder {file_path}\n"
-        
         # Add bstates folder contents (only if not already provided by uploaded files)
         bstates_files = [
             'bstates/bstate_cpptraj.rst',
@@ -819,24 +1586,9 @@ wait
         ]
         
         # Only add default bstate.rst if not provided by uploads as bstate
-        if not (uploaded_files and 'rst_file' in uploaded_files and params.get('rst_as_bstate', False)):
+        if not ('rst_file' in uploaded_files and params.get('rst_as_bstate', False)):
             bstates_files.append('bstates/bstate.rst')
         
-        for file_path in bstates_files:
-            # Skip if already in configs (from uploaded files)
-            if file_path in configs:
-                continue
-                
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    configs[file_path] = f.read()
-            except FileNotFoundError:
-                # Create placeholder content for missing files
-                if file_path.endswith('.rst'):
-                    configs[file_path] = "# Placeholder restart file\n"
-                else:
-                    configs[file_path] = f"# Placeholder {file_path}\n"
-        
         # Add additional cMD folder contents (only if not already provided by uploaded files)
         cmd_additional_files = [
             'cMD/md.in',
@@ -844,52 +1596,27 @@ wait
         ]
         
         # Only add default structure/topology files if not provided by uploads
-        if not (uploaded_files and ('pdb_file' in uploaded_files or 'inpcrd_file' in uploaded_files)):
+        if not ('pdb_file' in uploaded_files or 'inpcrd_file' in uploaded_files):
             cmd_additional_files.append(f'cMD/{protein_name}.pdb')
         
-        if not (uploaded_files and 'prmtop_file' in uploaded_files):
+        if 'prmtop_file' not in uploaded_files:
             cmd_additional_files.append(f'cMD/{protein_name}.prmtop')
         
         # Only add default RST file if not provided by uploads or if RST is not being used as bstate
-        if not (uploaded_files and 'rst_file' in uploaded_files):
+        if 'rst_file' not in uploaded_files:
             cmd_additional_files.append(f'cMD/{protein_name}.rst')
         
-        for file_path in cmd_additional_files:
-            # Skip if already in configs (from uploaded files)
-            if file_path in configs:
-                continue
-                
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    configs[file_path] = f.read()
-            except FileNotFoundError:
-                # Create placeholder content for missing files
-                if file_path.endswith('.pdb'):
-                    configs[file_path] = "# Placeholder PDB file\n# Upload your protein structure here\n"
-                elif file_path.endswith('.prmtop'):
-                    configs[file_path] = "# Placeholder PRMTOP file\n# Upload your topology file here\n"
-                elif file_path.endswith('.rst'):
-                    configs[file_path] = "# Placeholder restart file\n"
-                else:
-                    configs[file_path] = f"# Placeholder {file_path}\n"
-        
         # Add additional westpa_scripts
         westpa_additional_files = [
+            'westpa_scripts/archive_iters.py',
             'westpa_scripts/cat_trajectory.py',
             'westpa_scripts/gen_istate.sh',
+            'westpa_scripts/mock_engine.py',
+            'westpa_scripts/pcoord_return.py',
             'westpa_scripts/post_iter.sh',
-            'westpa_scripts/tar_segs.sh'
+            'westpa_scripts/tar_segs.sh',
+            'westpa_scripts/watchdog.py'
         ]
-        for file_path in westpa_additional_files:
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    configs[file_path] = f.read()
-            except FileNotFoundError:
-                # Create placeholder content for missing files
-                if file_path.endswith('.py'):
-                    configs[file_path] = f"#!/usr/bin/env python3\n# {file_path}\nprint('Running {file_path}')\n"
-                else:
-                    configs[file_path] = f"#!/bin/bash\n# {file_path}\necho 'Running {file_path}'\n"
         
         # Add documentation and utility files
         doc_files = [
@@ -901,21 +1628,245 @@ wait
             'nodefilelist.txt',
             'tstate.file'
         ]
-        for file_path in doc_files:
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    configs[file_path] = f.read()
-            except FileNotFoundError:
-                # Create placeholder content for missing files
-                if file_path.endswith('.py'):
-                    configs[file_path] = f"#!/usr/bin/env python3\n# {file_path}\nprint('Running {file_path}')\n"
-                else:
-                    configs[file_path] = f"# Placeholder {file_path}\n"
         
-        return configs
+        planned = {path for path, _, _ in plan}
+        for file_path in (main_sh_files + python_scripts + common_files + bstates_files +
+                          cmd_additional_files + westpa_additional_files + doc_files):
+            # Keep files already provided by uploads
+            if file_path not in planned:
+                planned.add(file_path)
+                plan.append((file_path, None, lambda file_path=file_path: self._asset(file_path)))
+        return plan
     
-    def _get_get_pcoord_sh_template(self):
-        return Template("""#!/bin/bash
+    def _dependency_key(self, deps: Tuple[str, ...], params: Dict[str, Any],
+                        uploaded_files: Optional[Dict[str, Dict]]) -> tuple:
+        uploaded_files = uploaded_files or {}
+        key = []
+        for dep in deps:
+            if dep.startswith('upload:'):
+                upload = uploaded_files.get(dep[7:])
+                key.append(self._upload_digest(dep[7:], upload['content']) if upload else None)
+            else:
+                key.append(_freeze(params.get(dep)))
+        return tuple(key)
+    
+    def _upload_digest(self, key: str, content) -> str:
+        """Content hash of an upload, computed once per uploaded object"""
+        memo = self._upload_digests.get(key)
+        if memo is None or memo[0] is not content:
+            memo = self._upload_digests[key] = (content, content_digest(content))
+        return memo[1]
+    
+    def _encoded_upload(self, key: str, content) -> BundleContent:
+        """Uploaded file as bundle content, decoded once per distinct content"""
+        digest = self._upload_digest(key, content)
+        memo = self._encoded_uploads.get(key)
+        if memo is not None and memo[0] == digest:
+            return memo[1]
+        if isinstance(content, bytes):
+            if key == 'pdb_file':
+                # PDB files are text files, so decode as UTF-8
+                try:
+                    content = content.decode('utf-8')
+                except UnicodeDecodeError:
+                    # Try with latin-1 if UTF-8 fails
+                    content = content.decode('latin-1')
+            else:
+                # INPCRD, PRMTOP and RST files are passed through as binary without a copy
+                content = memoryview(content)
+        self._encoded_uploads[key] = (digest, content)
+        return content
+    
+    def _cv_setup(self, params: Dict[str, Any]):
+        """CV list with the CPPTRAJ commands and output files that compute it"""
+        # Get CV list from parameters
+        cv_list = params.get('cv_list', [{'type': 'rmsd', 'min': 0.0, 'max': 8.0, 'step': 0.2}])
+        
+        # Generate commands for each CV
+        cv_commands = []
+        cv_output_files = []
+        
+        for i, cv in enumerate(cv_list):
+            cv_type = cv['type']
+            
+            # Use custom name if available, otherwise default naming
+            if cv_type == 'custom' and 'name' in cv:
+                cv_name = cv['name']
+                output_file = f"custom_{i+1}.dat"
+            else:
+                cv_name = f"CV{i+1}"
+                output_file = f"{cv_type}_{i+1}.dat"
+            
+            cv_commands.append(self._get_cpptraj_command(cv_type, output_file, cv_name))
+            cv_output_files.append(output_file)
+        return cv_list, cv_commands, cv_output_files
+    
+    def _pcoord_len(self, params: Dict[str, Any]) -> int:
+        """Frames per segment: the parent's last frame plus one every ntpr steps"""
+        nstlim = int(params['nstlim'])
+        ntpr = int(params['ntpr'])
+        if ntpr <= 0:
+            ntpr = 1
+        return (nstlim // ntpr) + 1
+    
+    def output_intervals(self, params: Dict[str, Any]) -> Dict[str, int]:
+        """nstlim, ntpr, ntwx and ntwr written to the WE md.in files
+        
+        ntwx and ntwr default to ntpr. pcoord_len counts one trajectory
+        frame every ntpr steps, and runseg.sh resumes a failed attempt from
+        its last restart, which only matches the last frame when ntwr equals
+        ntwx; other combinations raise ValueError.
+        """
+        nstlim = int(params['nstlim'])
+        ntpr = max(int(params['ntpr']), 1)
+        ntwx = int(params.get('ntwx') or ntpr)
+        ntwr = int(params.get('ntwr') or ntwx)
+        if ntwx != ntpr:
+            raise ValueError(f"ntwx ({ntwx}) must equal ntpr ({ntpr}): the progress coordinate has one "
+                             f"trajectory frame every ntpr steps")
+        if ntwr != ntwx:
+            raise ValueError(f"ntwr ({ntwr}) must equal ntwx ({ntwx}) so a failed segment resumes from a "
+                             f"restart at its last trajectory frame")
+        return {'nstlim': nstlim, 'ntpr': ntpr, 'ntwx': ntwx, 'ntwr': ntwr}
+    
+    def _render_md_in(self, path: str, params: Dict[str, Any]) -> BundleContent:
+        """Bundled md.in / md_init.in with nstlim and the output intervals from params"""
+        content = self._asset(path)
+        if not is_text(content):
+            return content
+        intervals = self.output_intervals(params)
+        return MD_IN_SETTING.sub(lambda m: f"{m.group(1)}{m.group(2)}{m.group(3)}{intervals[m.group(2)]}", content)
+    
+    def _render_west_cfg(self, params: Dict[str, Any]) -> str:
+        cv_list, _, _ = self._cv_setup(params)
+        
+        # Bin boundaries / mappers for the selected binning scheme
+        layout = self.bin_layout(params)
+        del layout['n_bins']
+        
+        return self.templates['west_cfg'].render(
+            pcoord_len=self._pcoord_len(params),
+            pcoord_ndim=len(cv_list),
+            bin_target_counts=int(params['bin_target_counts']),
+            max_total_iterations=int(params['max_total_iterations']),
+            seg_log_mode=self._seg_log_mode(params),
+            seg_debug=params.get('seg_debug', False),
+            **layout
+        )
+    
+    def _render_env_sh(self, params: Dict[str, Any], uploaded_files: Dict[str, Dict] = None) -> str:
+        timing = self.zmq_timing(params, uploaded_files)
+        return self._get_env_sh_template(params.get('hpc_system', 'expanse')).render(
+            zmq_heartbeat=timing['heartbeat'],
+            zmq_timeout_factor=timing['timeout_factor'],
+            segment_seconds=timing['segment_seconds'],
+            watchdog_stall=max(timing['segment_seconds'], WATCHDOG_MIN_STALL)
+        )
+    
+    def _render_runseg_sh(self, params: Dict[str, Any], uploaded_files: Dict[str, Dict]) -> str:
+        cv_list, cv_commands, cv_output_files = self._cv_setup(params)
+        hpc_system = params.get('hpc_system', DEFAULT_HPC_SYSTEM)
+        return self.templates['runseg_sh'].render(
+            protein_name=params['protein_name'],
+            enable_gpu_parallelization=params['enable_gpu_parallelization'],
+            cv_commands='\n'.join(cv_commands),
+            cv_output_files=cv_output_files,
+            pcoord_len=self._pcoord_len(params),
+            nstlim=int(params['nstlim']),
+            ntwx=self.output_intervals(params)['ntwx'],
+            local_scratch=params.get('local_scratch', False),
+            scratch_root=LOCAL_SCRATCH.get(hpc_system, LOCAL_SCRATCH[DEFAULT_HPC_SYSTEM]),
+            stage_out_files=STAGE_OUT_FILES + cv_output_files,
+            reference_ext='pdb' if 'pdb_file' in uploaded_files else 'inpcrd',
+            max_retries=int(params.get('max_retries', DEFAULT_MAX_RETRIES)),
+            retry_backoff=int(params.get('retry_backoff', DEFAULT_RETRY_BACKOFF)),
+            worker_logs=self._seg_log_mode(params) == 'worker',
+            watchdog=self._watchdog_mode(params) != 'off',
+        )
+    
+    def _render_run_cmd_sh(self, params: Dict[str, Any]) -> str:
+        return self.templates['run_cmd_sh'].render(
+            protein_name=params['protein_name'],
+            account=params['account'],
+            email=params['email']
+        )
+    
+    def _render_run_we_sh(self, params: Dict[str, Any]) -> str:
+        gpus_per_node, segments_per_gpu = self.worker_layout(params)
+        return self._get_run_we_sh_template(params.get('hpc_system', 'expanse')).render(
+            protein_name=params['protein_name'],
+            account=params['account'],
+            email=params['email'],
+            enable_gpu_parallelization=params.get('enable_gpu_parallelization', False),
+            gpus_per_node=gpus_per_node,
+            node_gpus=self.node_gpus(params),
+            segments_per_gpu=segments_per_gpu,
+            nodes=max(int(params.get('nodes') or 1), 1),
+            master_workers=params.get('master_workers', False),
+            chain_jobs=max(int(params.get('chain_jobs') or 0), 0),
+            watchdog=self._watchdog_mode(params)
+        )
+    
+    def _seg_log_mode(self, params: Dict[str, Any]) -> str:
+        mode = params.get('seg_log_mode') or DEFAULT_SEG_LOG_MODE
+        if mode not in SEG_LOG_MODES:
+            raise ValueError(f"Unknown seg_log_mode '{mode}'; expected one of {', '.join(SEG_LOG_MODES)}")
+        return mode
+    
+    def _watchdog_mode(self, params: Dict[str, Any]) -> str:
+        mode = params.get('watchdog') or DEFAULT_WATCHDOG
+        if mode not in WATCHDOG_MODES:
+            raise ValueError(f"Unknown watchdog mode '{mode}'; expected one of {', '.join(WATCHDOG_MODES)}")
+        return mode
+    
+    def worker_layout(self, params: Dict[str, Any]) -> Tuple[int, int]:
+        """(gpus_per_node, segments_per_gpu) for run_WE.sh
+        
+        gpus_per_node 0 means detect at job start (SLURM_GPUS_ON_NODE,
+        CUDA_VISIBLE_DEVICES, nvidia-smi); without GPU parallelization it
+        is always 1. Each node runs gpus_per_node * segments_per_gpu workers.
+        """
+        gpus_per_node = int(params.get('gpus_per_node') or 0)
+        segments_per_gpu = int(params.get('segments_per_gpu') or 1)
+        if gpus_per_node < 0:
+            raise ValueError(f"gpus_per_node must be 0 (detect) or positive, got {gpus_per_node}")
+        if segments_per_gpu < 1:
+            raise ValueError(f"segments_per_gpu must be at least 1, got {segments_per_gpu}")
+        if not params.get('enable_gpu_parallelization', False):
+            gpus_per_node = 1
+        return gpus_per_node, segments_per_gpu
+    
+    def node_gpus(self, params: Dict[str, Any]) -> int:
+        """GPUs per node that run_WE.sh requests from SLURM
+        
+        The configured gpus_per_node, or in detect mode the whole node
+        (NODE_GPUS) so every GPU of it is there to be detected.
+        """
+        gpus_per_node = self.worker_layout(params)[0]
+        if gpus_per_node:
+            return gpus_per_node
+        hpc_system = params.get('hpc_system', DEFAULT_HPC_SYSTEM)
+        if hpc_system not in NODE_GPUS:
+            raise ValueError(f"gpus_per_node must be set for multi-GPU runs on {hpc_system}; detection "
+                             f"requests whole nodes and the GPU count of its nodes is not known")
+        return NODE_GPUS[hpc_system]
+    
+    def _render_get_pcoord_sh(self, params: Dict[str, Any], uploaded_files: Dict[str, Dict]) -> str:
+        # Generate get_pcoord.sh (for initial state analysis)
+        cv_list, cv_commands, cv_output_files = self._cv_setup(params)
+        return self._get_get_pcoord_sh_template().render(
+            protein_name=params['protein_name'],
+            cv_commands='\n'.join(cv_commands),
+            cv_output_files=cv_output_files,
+            has_pdb_file='pdb_file' in uploaded_files
+        )
+    
+    def _asset(self, file_path: str) -> BundleContent:
+        content = self.assets.get(file_path)
+        return content if content is not None else placeholder_content(file_path)
+    
+    def _get_pcoord_sh_source(self) -> str:
+        return """#!/bin/bash
 
 if [ -n "$SEG_DEBUG" ] ; then
   set -x
@@ -936,15 +1887,12 @@ COMMAND="${COMMAND} go"
 
 echo -e "${COMMAND}" | $CPPTRAJ
 
-# Extract progress coordinate values
-{% if cv_count == 1 %}
-cat {{ cv_output_files[0] }} | tail -n 1 | awk {'print $2'} > $WEST_PCOORD_RETURN
-{% else %}
-paste {% for output_file in cv_output_files %}<(cat {{ output_file }} | tail -n 1 | awk {'print $2'}) {% endfor %}>$WEST_PCOORD_RETURN
-{% endif %}
+# Extract progress coordinate values (final frame of each CV file)
+python3 $WEST_SIM_ROOT/westpa_scripts/pcoord_return.py --last -o $WEST_PCOORD_RETURN \\
+    {{ cv_output_files | join(' ') }} || exit 1
 
 if [ -n "$SEG_DEBUG" ] ; then
   head -v $WEST_PCOORD_RETURN
 fi
-""")
+"""
 
@@ -1,64 +1,313 @@
-import os 
+import os
+import sys
+import fcntl
+import hashlib
+import argparse
+from contextlib import contextmanager
 import numpy as np
 
 
 path='/expanse/lustre/scratch/ssonti/temp_project/amber_learn/chignolin_tutorial/westpa_tutorials/tutorial7.3-chignolin/ParGaMD_finer'
-os.chdir(path)
 
-iters=len(next(os.walk('traj_segs'))[1])
-iter_iters=[]
-print(iters)
-os.chdir('traj_segs')
+# Output file names for each progress coordinate dimension, in pcoord order
+CV_FILES=['rmsd.dat','rg.dat']
 
-for i in range(iters):
+# Consolidated per-iteration store filled by the post_iteration hook
+STORE_FILE='analysis.h5'
 
-    #os.chdir('C:\\Users\\svdnr\\Desktop\\test1\\traj_segs')
+# westpa.core.segment.Segment.SEG_STATUS_COMPLETE
+SEG_STATUS_COMPLETE=2
 
-    iters_sub=len(next(os.walk('0000{:02d}'.format(i+1)))[1])
 
-    iter_iters.append(iters_sub)
-print(iter_iters)
-gamd_all=[]
-rmsd_all=[]
-rg_all=[]
-#os.chdir(path)
+def cv_file_names(ndim):
+    """Output file name for every pcoord dimension"""
+    names=list(CV_FILES[:ndim])
+    for k in range(len(names),ndim):
+        names.append('pcoord_{:d}.dat'.format(k+1))
+    return names
 
-for i in range(iters):
-    os.chdir(path)
-    os.chdir('traj_segs/00{:04d}'.format(i+1))
 
-    for j in range(iter_iters[i]):
+def count_segments(path):
+    """Number of iterations and segments per iteration found under traj_segs"""
+    iters=len(next(os.walk(os.path.join(path,'traj_segs')))[1])
+    iter_iters=[]
+    for i in range(iters):
+        iters_sub=len(next(os.walk(os.path.join(path,'traj_segs','{:06d}'.format(i+1))))[1])
+        iter_iters.append(iters_sub)
+    return iters,iter_iters
 
-        try:
-            os.chdir(path)
-            os.chdir('traj_segs/00{:04d}/00{:04d}'.format(i+1,j))
 
-            gamd=np.genfromtxt('gamd.log')
-            rmsd=np.genfromtxt('rmsd.dat')
-            rg=np.genfromtxt('rg.dat')
+def extract_from_segments(path):
+    """Read gamd.log, rmsd.dat and rg.dat from every segment directory"""
+    iters,iter_iters=count_segments(path)
+    print(iters)
+    print(iter_iters)
+    gamd_all=[]
+    cv_all=[[],[]]
+
+    for i in range(iters):
+        for j in range(iter_iters[i]):
+            seg_dir=os.path.join(path,'traj_segs','{:06d}'.format(i+1),'{:06d}'.format(j))
+            try:
+                gamd=np.genfromtxt(os.path.join(seg_dir,'gamd.log'))
+                rmsd=np.genfromtxt(os.path.join(seg_dir,'rmsd.dat'))
+                rg=np.genfromtxt(os.path.join(seg_dir,'rg.dat'))
+            except (OSError,ValueError):
+                continue
             gamd_all.append(gamd)
-            rmsd_all.append(np.delete(rmsd,0,0))
-            rg_all.append(np.delete(rg,0,0))
-            #os.chdir(path)
+            # Row 0 is the parent.rst frame, already counted in the parent segment
+            cv_all[0].append(np.delete(rmsd,0,0))
+            cv_all[1].append(np.delete(rg,0,0))
+            print(j,i)
 
-            print(j)
+    return gamd_all,cv_all
+
+
+def read_iter_pcoord(west,n_iter):
+    """Whole-iteration hyperslab read of pcoord, without the parent frame"""
+    return west.pcoord(n_iter)[:,1:,:]
+
+
+def load_gamd_log(path,n_iter,seg_id):
+    """Load the gamd.log of one segment, or None if it has not been written"""
+    log=os.path.join(path,'traj_segs','{:06d}'.format(n_iter),'{:06d}'.format(seg_id),'gamd.log')
+    try:
+        return np.genfromtxt(log)
+    except (OSError,ValueError):
+        return None
+
+
+def frame_columns(values):
+    """Pair CV values with cpptraj frame numbers (frame 1 is the parent)"""
+    frames=np.broadcast_to(np.arange(2,values.shape[-1]+2),values.shape)
+    return np.stack((frames,values),axis=-1)
+
+
+def matching_shape(gamd,seg_ids):
+    """Keep the gamd.log arrays with the iteration's common shape
+
+    A gamd.log that is still being written, or was cut short, has fewer
+    rows than the others and cannot be stacked with them.
+    """
+    shapes=[np.shape(values) for values in gamd]
+    common=max(set(shapes),key=shapes.count)
+    keep=[i for i,shape in enumerate(shapes) if shape==common]
+    return [gamd[i] for i in keep],[seg_ids[i] for i in keep],keep
 
-            print(j,i)
 
-        except:
+def iteration_digest(west,n_iter):
+    """Identify one run of an iteration by its segment weights, parents and pcoords
 
+    A run repeated after w_truncate has the same weights and parents, so
+    the pcoord it produced is what tells the two runs apart.
+    """
+    digest=hashlib.sha1()
+    digest.update(np.ascontiguousarray(west.seg_index(n_iter,'weight')).tobytes())
+    digest.update(np.ascontiguousarray(west.seg_index(n_iter,'parent_id')).tobytes())
+    digest.update(np.ascontiguousarray(west.pcoord(n_iter)).tobytes())
+    return digest.hexdigest()
+
+
+def collect_iteration(path,west,n_iter):
+    """GaMD boost and CV frames of every finished segment of one iteration
+
+    Only segments that seg_index marks complete are read: the pcoord rows
+    of running ones are not written yet and their gamd.log is partial.
+    Returns the gamd.log arrays, the matching pcoord rows, their seg_ids
+    and whether every segment of the iteration has completed.
+    """
+    pcoord=read_iter_pcoord(west,n_iter)
+    status=west.seg_index(n_iter,'status')
+
+    gamd_all=[]
+    seg_ids=[]
+    for seg_id in np.flatnonzero(status==SEG_STATUS_COMPLETE):
+        gamd=load_gamd_log(path,n_iter,seg_id)
+        if gamd is None:
             continue
+        gamd_all.append(gamd)
+        seg_ids.append(int(seg_id))
+
+    complete=len(seg_ids)==pcoord.shape[0]
+    return gamd_all,pcoord[seg_ids],seg_ids,complete
+
+
+def extract_from_h5(path,west_file='west.h5'):
+    """Read CV values from west.h5 and only gamd.log from each segment"""
+    from west_reader import WestReader
+
+    gamd_all=[]
+    cv_all=None
+
+    with WestReader(os.path.join(path,west_file)) as west:
+        for n_iter in west.iter_numbers():
+            gamd,pcoord,seg_ids,complete=collect_iteration(path,west,n_iter)
+            print(n_iter,len(seg_ids))
+            if not seg_ids:
+                continue
+            if cv_all is None:
+                cv_all=[[] for k in range(pcoord.shape[2])]
+            gamd_all.extend(gamd)
+            for k in range(pcoord.shape[2]):
+                cv_all[k].extend(frame_columns(pcoord[:,:,k]))
+
+    return gamd_all,cv_all or []
+
+
+@contextmanager
+def store_lock(path,store_file=STORE_FILE):
+    """Serialize writers of the analysis store (post_iteration hooks may overlap)"""
+    with open(os.path.join(path,store_file+'.lock'),'w') as lock:
+        fcntl.flock(lock,fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock,fcntl.LOCK_UN)
+
+
+def aggregate_iterations(path,upto=None,west_file='west.h5',store_file=STORE_FILE):
+    """Append finished iterations to the consolidated analysis store
+
+    An iteration is (re)written unless the store already holds a complete
+    copy of the same run of it, so the hook can be repeated safely and
+    iterations re-run after w_truncate replace their stale copies. The
+    store remembers up to which iteration everything is complete
+    ('last_complete'); only later iterations and upto itself are checked.
+    """
+    import h5py
+    from west_reader import WestReader
+
+    written=[]
+    with store_lock(path,store_file):
+        with WestReader(os.path.join(path,west_file)) as west, \
+             h5py.File(os.path.join(path,store_file),'a') as store:
+            available=west.iter_numbers()
+            stored=store.require_group('iterations')
+            last=int(store.attrs.get('last_complete',0))
+
+            # Drop iterations that were truncated away from west.h5
+            for key in list(stored):
+                if int(key[5:]) not in available:
+                    del stored[key]
+                    last=min(last,int(key[5:])-1)
+
+            # The iteration the hook was called for may be a re-run of a stored one
+            start=last+1 if upto is None else min(last+1,upto)
+            for n_iter in available:
+                if n_iter<start:
+                    continue
+                if upto is not None and n_iter>upto:
+                    break
+                key='iter_{:08d}'.format(n_iter)
+                digest=iteration_digest(west,n_iter)
+                if key in stored and stored[key].attrs.get('complete',False) \
+                        and stored[key].attrs.get('digest')==digest:
+                    continue
+
+                gamd,pcoord,seg_ids,complete=collect_iteration(path,west,n_iter)
+                if key in stored:
+                    del stored[key]
+                if not complete:
+                    last=min(last,n_iter-1)
+                if not seg_ids:
+                    continue
+                gamd,seg_ids,keep=matching_shape(gamd,seg_ids)
+                if len(keep)<pcoord.shape[0]:
+                    print('iteration {:d}: skipped {:d} gamd.log files of another shape'.format(
+                        n_iter,pcoord.shape[0]-len(keep)))
+                    pcoord=pcoord[keep]
+                    if complete:
+                        complete=False
+                        last=min(last,n_iter-1)
+
+                group=stored.create_group(key)
+                group['seg_id']=np.asarray(seg_ids,dtype=np.int64)
+                group['gamd']=np.stack(gamd)
+                group['pcoord']=pcoord
+                group.attrs['digest']=digest
+                # Written last so an interrupted hook leaves the group marked stale
+                group.attrs['complete']=complete
+                written.append(n_iter)
+
+            while stored.get('iter_{:08d}'.format(last+1)) is not None \
+                    and stored['iter_{:08d}'.format(last+1)].attrs.get('complete',False):
+                last+=1
+            store.attrs['last_complete']=last
+
+    return written
+
+
+def extract_from_store(path,west_file='west.h5',store_file=STORE_FILE):
+    """Bring the analysis store up to date and read everything from it"""
+    import h5py
+
+    aggregate_iterations(path,west_file=west_file,store_file=store_file)
+
+    gamd_all=[]
+    cv_all=None
+    with h5py.File(os.path.join(path,store_file),'r') as store:
+        stored=store['iterations']
+        for key in sorted(stored):
+            pcoord=stored[key]['pcoord'][...]
+            if cv_all is None:
+                cv_all=[[] for k in range(pcoord.shape[2])]
+            gamd_all.append(stored[key]['gamd'][...])
+            for k in range(pcoord.shape[2]):
+                cv_all[k].append(frame_columns(pcoord[:,:,k]))
+
+    if not gamd_all:
+        return [],[]
+    return np.concatenate(gamd_all),[np.concatenate(values) for values in cv_all]
+
+
+def write_outputs(path,gamd_all,cv_all):
+    """Flatten per-segment arrays and write gamd.log plus one file per CV"""
+    dims1=np.shape(gamd_all)
+    print(dims1)
+    gamd_write=np.reshape(gamd_all,(dims1[0]*dims1[1],dims1[2]))
+    np.savetxt(os.path.join(path,'gamd.log'),gamd_write)
+
+    for name,values in zip(cv_file_names(len(cv_all)),cv_all):
+        dims=np.shape(values)
+        cv_write=np.reshape(values,(dims[0]*dims[1],dims[2]))
+        np.savetxt(os.path.join(path,name),cv_write)
+
+
+def main():
+    parser=argparse.ArgumentParser(description='Collect GaMD boost and CV frames from a ParGaMD run')
+    parser.add_argument('--path',default=path,help='WESTPA simulation root')
+    parser.add_argument('--source',choices=['segments','h5','store'],default='segments',
+                        help='read CVs from per-segment rmsd.dat/rg.dat, from west.h5 pcoord, '
+                             'or from the analysis store kept by the post_iteration hook')
+    parser.add_argument('--west-file',default='west.h5',help='WESTPA data file (h5 and store sources)')
+    parser.add_argument('--store-file',default=STORE_FILE,help='consolidated analysis store')
+    parser.add_argument('--aggregate-iter',type=int,metavar='N_ITER',
+                        help='only append iterations up to N_ITER to the analysis store and exit')
+    args=parser.parse_args()
+
+    if args.aggregate_iter is not None:
+        try:
+            written=aggregate_iterations(args.path,args.aggregate_iter,args.west_file,args.store_file)
+        except (OSError,KeyError) as e:
+            # w_run may be flushing west.h5; the next hook picks the iteration up
+            print('cannot aggregate iteration {:d} yet: {}'.format(args.aggregate_iter,e))
+            sys.exit(1)
+        print('aggregated iterations: '+' '.join(str(n) for n in written))
+        return
+
+    if args.source=='store':
+        gamd_all,cv_all=extract_from_store(args.path,args.west_file,args.store_file)
+    elif args.source=='h5':
+        gamd_all,cv_all=extract_from_h5(args.path,args.west_file)
+    else:
+        gamd_all,cv_all=extract_from_segments(args.path)
+
+    if len(gamd_all)==0:
+        print('no completed segments found under '+os.path.join(args.path,'traj_segs'))
+        sys.exit(1)
 
-dims1=np.shape(gamd_all)
-print(dims1)
-dims2=np.shape(rmsd_all)
-dims3=np.shape(rg_all)
+    write_outputs(args.path,gamd_all,cv_all)
 
-gamd_write=np.reshape(gamd_all,(dims1[0]*dims1[1],dims1[2]))
-rmsd_write=np.reshape(rmsd_all,(dims2[0]*dims2[1],dims2[2]))
-rg_write=np.reshape(rg_all,(dims3[0]*dims3[1],dims3[2]))
 
-os.chdir(path)
-log_gamd=np.savetxt('gamd.log',gamd_write)
-log_rmsd=np.savetxt('rmsd.dat',rmsd_write)
-log_rg=np.savetxt('rg.dat',rg_write)
+if __name__=='__main__':
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Walker lineage index for ParGaMD / WESTPA runs
+
+Keeps every iteration's seg_index['parent_id'] in one contiguous array in
+a small sidecar file (lineage.h5), so tracing a walker no longer needs one
+west.h5 read per iteration. Optional jump pointers (ancestor 2**k
+iterations back) make "ancestor at iteration m" lookups logarithmic.
+
+    python lineage_index.py build                  # create / update lineage.h5
+    python lineage_index.py trace 120 4            # write traj_120_4_trace.txt
+    python lineage_index.py descendants 40 7       # surviving descendants of (40, 7)
+
+Trace files keep the (n_iter, seg_id) column layout expected by
+westpa_scripts/cat_trajectory.py.
+"""
+
+import sys
+import hashlib
+import argparse
+from typing import Dict, List, Optional
+
+import h5py
+import numpy as np
+
+from west_reader import WestReader
+
+INDEX_FILE = 'lineage.h5'
+
+
+def parent_digest(parent_ids: np.ndarray) -> bytes:
+    """Identify one run of an iteration; changes when it is re-run after w_truncate"""
+    return hashlib.sha1(np.ascontiguousarray(parent_ids, dtype=np.int64).tobytes()).hexdigest().encode('ascii')
+
+
+def _appendable(group, name, dtype, shape=(0,)):
+    if name in group:
+        return group[name]
+    return group.create_dataset(name, shape=shape, maxshape=(None,) + shape[1:], dtype=dtype,
+                                chunks=True)
+
+
+def _append(dataset, values):
+    start = dataset.shape[0]
+    dataset.resize(start + len(values), axis=0)
+    dataset[start:] = values
+
+
+def build_index(west_file: str = 'west.h5', index_file: str = INDEX_FILE,
+                jump_levels: Optional[int] = None) -> List[int]:
+    """Append iterations of west.h5 that are not in the index yet
+
+    Iterations whose parents changed (w_truncate followed by a re-run) are
+    dropped from the index together with everything after them.
+    Returns the iteration numbers that were (re)indexed.
+    """
+    added = []
+    with WestReader(west_file) as west, h5py.File(index_file, 'a') as index:
+        parents = _appendable(index, 'parents', np.int64)
+        offsets = _appendable(index, 'offsets', np.int64)
+        digests = _appendable(index, 'digests', 'S40')
+        if offsets.shape[0] == 0:
+            _append(offsets, [0])
+
+        stored_levels = int(index.attrs.get('jump_levels', 0))
+        if jump_levels is None:
+            jump_levels = stored_levels
+        if stored_levels != jump_levels:
+            # Rebuild the jump tables from scratch at the new depth
+            for level in range(stored_levels):
+                del index['jump_%d' % level]
+            index.attrs['jump_levels'] = jump_levels
+        # Jump tables are cheap to derive from the flat parent array, so they
+        # are recomputed whole rather than patched
+        jumps = [_appendable(index, 'jump_%d' % level, np.int64) for level in range(jump_levels)]
+        for jump in jumps:
+            jump.resize(0, axis=0)
+
+        n_iters = west.iter_numbers()
+
+        # Keep the stored prefix that still matches west.h5
+        n_stored = digests.shape[0]
+        keep = 0
+        while keep < n_stored and keep < len(n_iters) and n_iters[keep] == keep + 1:
+            if parent_digest(west.seg_index(keep + 1, 'parent_id')) != digests[keep]:
+                break
+            keep += 1
+        if keep < n_stored:
+            digests.resize(keep, axis=0)
+            offsets.resize(keep + 1, axis=0)
+            parents.resize(int(offsets[keep]), axis=0)
+
+        for n_iter in n_iters[keep:]:
+            if n_iter != digests.shape[0] + 1:
+                break
+            parent_ids = west.seg_index(n_iter, 'parent_id')
+            _append(parents, parent_ids)
+            _append(offsets, [offsets[-1] + len(parent_ids)])
+            _append(digests, [parent_digest(parent_ids)])
+            added.append(n_iter)
+
+        if jumps:
+            table = global_parents(parents[...], offsets[...])
+            for jump in jumps:
+                _append(jump, table)
+                table = np.where(table >= 0, table[np.maximum(table, 0)], -1)
+    return added
+
+
+def global_parents(parents: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Parent of every segment as a position in the flat array (-1 for initial states)"""
+    n_segs = np.diff(offsets)
+    iteration = np.repeat(np.arange(len(n_segs)), n_segs)
+    table = np.full(len(parents), -1, dtype=np.int64)
+    has_parent = (parents >= 0) & (iteration > 0)
+    table[has_parent] = offsets[iteration[has_parent] - 1] + parents[has_parent]
+    return table
+
+
+class LineageIndex:
+    """In-memory view of lineage.h5"""
+
+    def __init__(self, index_file: str = INDEX_FILE):
+        with h5py.File(index_file, 'r') as index:
+            self.parents = index['parents'][...]
+            self.offsets = index['offsets'][...]
+            self.jumps = [index['jump_%d' % level][...]
+                          for level in range(int(index.attrs.get('jump_levels', 0)))]
+
+    @property
+    def n_iters(self) -> int:
+        return len(self.offsets) - 1
+
+    def segments(self, n_iter: int) -> np.ndarray:
+        """parent_id of every segment of one iteration"""
+        return self.parents[self.offsets[n_iter - 1]:self.offsets[n_iter]]
+
+    def ancestry(self, n_iter: int, seg_ids) -> np.ndarray:
+        """seg_id of each walker's ancestor in iterations 1..n_iter
+
+        Row r of the result belongs to seg_ids[r]; column m holds the
+        ancestor in iteration m+1. Use initial_states() on column 0 for
+        the istate each lineage started from.
+        """
+        seg_ids = np.atleast_1d(np.asarray(seg_ids, dtype=np.int64))
+        history = np.empty((len(seg_ids), n_iter), dtype=np.int64)
+        current = seg_ids
+        for m in range(n_iter, 0, -1):
+            history[:, m - 1] = current
+            if m > 1:
+                current = self.segments(m)[current]
+        return history
+
+    def initial_states(self, seg_ids) -> np.ndarray:
+        """istate_id each iteration-1 segment started from"""
+        return -self.segments(1)[np.asarray(seg_ids)] - 1
+
+    def ancestor(self, n_iter: int, seg_id: int, target_iter: int) -> int:
+        """seg_id of the ancestor of (n_iter, seg_id) in target_iter"""
+        if not 1 <= target_iter <= n_iter:
+            raise ValueError(f"target iteration {target_iter} is not in 1..{n_iter}")
+        position = self.offsets[n_iter - 1] + seg_id
+        back = n_iter - target_iter
+        level = 0
+        while back:
+            if back & 1:
+                if level < len(self.jumps):
+                    position = self.jumps[level][position]
+                else:
+                    # No table this deep: walk the remaining steps one at a time
+                    for _ in range(back << level):
+                        position = self._step(position)
+                    break
+            back >>= 1
+            level += 1
+        return int(position - self.offsets[target_iter - 1])
+
+    def _step(self, position: int) -> int:
+        n_iter = int(np.searchsorted(self.offsets, position, side='right'))
+        return int(self.offsets[n_iter - 2] + self.parents[position])
+
+    def descendants(self, n_iter: int, seg_id: int, last_iter: Optional[int] = None) -> Dict[int, np.ndarray]:
+        """seg_ids descended from (n_iter, seg_id) in every later iteration
+
+        Stops early once the lineage has died out; the entry for the last
+        iteration lists the surviving descendants.
+        """
+        last_iter = min(last_iter or self.n_iters, self.n_iters)
+        alive = np.zeros(len(self.segments(n_iter)), dtype=bool)
+        alive[seg_id] = True
+        result = {n_iter: np.array([seg_id])}
+        for m in range(n_iter + 1, last_iter + 1):
+            parents = self.segments(m)
+            alive = alive[np.maximum(parents, 0)] & (parents >= 0)
+            result[m] = np.flatnonzero(alive)
+            if not alive.any():
+                break
+        return result
+
+
+def write_trace(path: str, index: LineageIndex, n_iter: int, seg_id: int):
+    """w_trace-style text file: initial state row, then one row per iteration"""
+    history = index.ancestry(n_iter, [seg_id])[0]
+    istate = index.initial_states(history[:1])[0]
+    rows = np.column_stack((np.arange(0, n_iter + 1), np.concatenate(([istate], history))))
+    np.savetxt(path, rows, fmt='%8d', header='n_iter seg_id (row 0: initial state id)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Walker lineage index for WESTPA runs')
+    parser.add_argument('--west', default='west.h5', help='WESTPA data file')
+    parser.add_argument('--index', default=INDEX_FILE, help='lineage sidecar file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='create or update the index from west.h5')
+    build.add_argument('--jump-levels', type=int,
+                       help='store ancestors 1, 2, 4, ... 2**(N-1) iterations back '
+                            '(default: keep the current setting, initially 0)')
+
+    trace = commands.add_parser('trace', help='write the ancestry of one walker as a trace file')
+    trace.add_argument('n_iter', type=int)
+    trace.add_argument('seg_id', type=int)
+    trace.add_argument('-o', '--output', help='trace file (default: traj_ITER_SEG_trace.txt)')
+
+    desc = commands.add_parser('descendants', help='list the surviving descendants of one walker')
+    desc.add_argument('n_iter', type=int)
+    desc.add_argument('seg_id', type=int)
+    desc.add_argument('--last-iter', type=int, help='stop at this iteration')
+    desc.add_argument('--all', action='store_true', help='print descendants in every iteration')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        added = build_index(args.west, args.index, args.jump_levels)
+        print(f"indexed {len(added)} iterations" + (f" ({added[0]}-{added[-1]})" if added else ''))
+        return
+
+    index = LineageIndex(args.index)
+    if not 1 <= args.n_iter <= index.n_iters:
+        sys.exit(f"iteration {args.n_iter} is not in the index (1-{index.n_iters}); run 'build' first")
+
+    if args.command == 'trace':
+        output = args.output or f"traj_{args.n_iter}_{args.seg_id}_trace.txt"
+        write_trace(output, index, args.n_iter, args.seg_id)
+        print(f"wrote {output}")
+    else:
+        result = index.descendants(args.n_iter, args.seg_id, args.last_iter)
+        shown = result.items() if args.all else [max(result.items())]
+        for n_iter, seg_ids in shown:
+            print(f"iter {n_iter}: {len(seg_ids)} descendants: {' '.join(map(str, seg_ids))}")
+
+
+if __name__ == '__main__':
+    main()
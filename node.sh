@@ -10,11 +10,27 @@ source env.sh
 export WEST_JOBID=$1; shift
 export SLURM_NODENAME=$1; shift
 export CUDA_VISIBLE_DEVICES_ALLOCATED=$1; shift
+export WEST_SEGMENTS_PER_GPU=$1; shift
 echo "starting WEST client processes on: "; hostname
 echo "current directory is $PWD"
 echo "environment is: "
 env | sort
 
+# Devices run_WE.sh planned for this node (runseg.sh picks one per worker)
+export CUDA_VISIBLE_DEVICES=${CUDA_VISIBLE_DEVICES:-$CUDA_VISIBLE_DEVICES_ALLOCATED}
 echo "CUDA_VISIBLE_DEVICES = " $CUDA_VISIBLE_DEVICES
+
+# Several segments per GPU: run them under MPS so their kernels share the device
+if [ "$WEST_SEGMENTS_PER_GPU" -gt 1 ] 2>/dev/null && command -v nvidia-cuda-mps-control > /dev/null; then
+  export CUDA_MPS_PIPE_DIRECTORY=/tmp/mps-pipe-$WEST_JOBID-$SLURM_NODENAME
+  export CUDA_MPS_LOG_DIRECTORY=/tmp/mps-log-$WEST_JOBID-$SLURM_NODENAME
+  mkdir -p $CUDA_MPS_PIPE_DIRECTORY $CUDA_MPS_LOG_DIRECTORY
+  CUDA_VISIBLE_DEVICES=$CUDA_VISIBLE_DEVICES_ALLOCATED nvidia-cuda-mps-control -d && MPS_STARTED=1
+fi
+
 w_run "$@" &> west-$SLURM_NODENAME-node.log
+
+if [ -n "$MPS_STARTED" ]; then
+  echo quit | nvidia-cuda-mps-control
+fi
 echo "Shutting down.  Hopefully this was on purpose?"
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Decide how run_WE.sh continues a WESTPA run from west.h5
+
+Prints one line "<action> <n_iter>" for the launcher:
+
+    init      west.h5 is missing: run init.sh
+    run       continue with w_run; it re-runs only the segments of the
+              current iteration that are not complete yet
+    truncate  the current iteration is corrupt (seg_index or pcoord
+              missing, unreadable or inconsistent): w_truncate -n <n_iter>,
+              drop its traj_segs / seg_logs, then w_run
+    done      max_total_iterations are complete: nothing to submit
+
+    python3 resume_run.py
+    python3 resume_run.py --west-h5 west.h5 --max-iterations 1000
+
+max_total_iterations is read from west.cfg unless given. A west.h5 that
+cannot be read is never replaced: the script exits with an error so the
+run can be inspected instead of re-initialized.
+"""
+
+import os
+import re
+import sys
+import argparse
+
+from west_reader import WestReader
+
+MAX_ITERATIONS = re.compile(r'^\s*max_total_iterations:\s*(\d+)', re.MULTILINE)
+
+
+def max_total_iterations(west_cfg: str) -> int:
+    with open(west_cfg) as f:
+        match = MAX_ITERATIONS.search(f.read())
+    if match is None:
+        raise ValueError(f"{west_cfg} sets no max_total_iterations")
+    return int(match.group(1))
+
+
+def resume_action(west_h5: str, max_iterations: int):
+    """(action, n_iter) for the run state stored in west_h5"""
+    if not os.path.exists(west_h5):
+        return 'init', 0
+
+    with WestReader(west_h5) as reader:
+        n_iter = reader.current_iteration
+        # After the last WE step w_run leaves iteration max + 1 prepared
+        if n_iter > max_iterations:
+            return 'done', n_iter
+        if not reader.has_iteration(n_iter):
+            return 'run', n_iter
+        if not iteration_readable(reader, n_iter):
+            return 'truncate', n_iter
+    return 'run', n_iter
+
+
+def iteration_readable(reader: WestReader, n_iter: int) -> bool:
+    """Whether seg_index and pcoord of an iteration can be read and agree"""
+    try:
+        n_segs = len(reader.seg_index(n_iter))
+        pcoord = reader.pcoord(n_iter)
+    except (KeyError, OSError, ValueError):
+        return False
+    return pcoord.ndim == 3 and pcoord.shape[0] == n_segs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report how to continue the WESTPA run in west.h5')
+    parser.add_argument('--west-h5', default='west.h5', help='WESTPA data file (default: west.h5)')
+    parser.add_argument('--west-cfg', default='west.cfg', help='read max_total_iterations from here (default: west.cfg)')
+    parser.add_argument('--max-iterations', type=int, help='override max_total_iterations')
+    args = parser.parse_args()
+
+    try:
+        max_iterations = args.max_iterations or max_total_iterations(args.west_cfg)
+        action, n_iter = resume_action(args.west_h5, max_iterations)
+    except (OSError, KeyError, ValueError) as e:
+        sys.exit(f"resume_run.py: cannot read the run state: {e}")
+    print(action, n_iter)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Per-worker segment logs written by runseg.sh
+
+With seg_log_mode 'worker' (the default) every WESTPA worker appends the
+output of its segments to one log per iteration instead of creating a file
+per segment:
+
+    seg_logs/NNNNNN/<host>-w<worker>.log   records framed by the lines
+        === SEGMENT n_iter=.. seg_id=.. host=.. worker=.. start=.. ===
+        === END n_iter=.. seg_id=.. status=.. seconds=.. ===
+    seg_logs/NNNNNN/index.tsv              n_iter, seg_id, file, offset,
+                                           length, start, end, status
+
+Print the log of one segment, from the iteration directory or from the
+seg_logs/NNNNNN.tar.gz archive written by archive_iters.py:
+
+    python3 seg_log.py 120 37
+    python3 seg_log.py 120 37 --sim-root /path/to/run
+
+Records of segments killed before their END line have no index entry;
+they are found by scanning the worker logs of the iteration. Per-segment
+logs (seg_log_mode 'segment') are printed as they are.
+"""
+
+import os
+import re
+import sys
+import glob
+import tarfile
+import argparse
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+INDEX_FILE = 'index.tsv'
+INDEX_FIELDS = ('n_iter', 'seg_id', 'file', 'offset', 'length', 'start', 'end', 'status')
+RECORD_START = re.compile(r'^=== SEGMENT n_iter=(\d+) seg_id=(\d+)\b')
+RECORD_END = re.compile(r'^=== END n_iter=(\d+) seg_id=(\d+) status=(\S+)')
+# seg_logs/NNNNNN/<host>-w<N>.log, also as a member of seg_logs/NNNNNN.tar*
+WORKER_LOG = re.compile(r'(^|/)\d{6}/[^/]+-w\d+\.log$')
+
+IndexEntry = Dict[str, object]
+
+
+def is_worker_log(name: str) -> bool:
+    return WORKER_LOG.search(name.replace(os.sep, '/')) is not None
+
+
+def iter_records(lines: Iterable[str]) -> Iterator[Tuple[int, int, List[str]]]:
+    """(n_iter, seg_id, lines) of every record in a worker log, framing lines included
+
+    A record without END (segment killed) runs up to the next SEGMENT line.
+    """
+    key, record = None, []
+    for line in lines:
+        match = RECORD_START.match(line)
+        if match:
+            if key is not None:
+                yield key[0], key[1], record
+            key, record = (int(match.group(1)), int(match.group(2))), [line]
+            continue
+        if key is None:
+            continue
+        record.append(line)
+        if RECORD_END.match(line):
+            yield key[0], key[1], record
+            key, record = None, []
+    if key is not None:
+        yield key[0], key[1], record
+
+
+def parse_index(lines: Iterable[str]) -> Dict[Tuple[int, int], IndexEntry]:
+    """index.tsv entries by (n_iter, seg_id); a segment run again keeps its last entry"""
+    entries: Dict[Tuple[int, int], IndexEntry] = {}
+    for line in lines:
+        values = line.rstrip('\n').split('\t')
+        if len(values) != len(INDEX_FIELDS):
+            continue
+        try:
+            entry = dict(zip(INDEX_FIELDS, values))
+            for name in ('n_iter', 'seg_id', 'offset', 'length', 'start', 'end'):
+                entry[name] = int(entry[name])
+        except ValueError:
+            continue
+        entries[(entry['n_iter'], entry['seg_id'])] = entry
+    return entries
+
+
+def _decode(data: bytes) -> str:
+    return data.decode('utf-8', errors='replace')
+
+
+def _scan(logs: Iterable[Tuple[str, bytes]], n_iter: int, seg_id: int) -> Optional[str]:
+    """Last record of the segment in any of the (name, content) worker logs"""
+    found = None
+    for _, content in logs:
+        for rec_iter, rec_seg, record in iter_records(_decode(content).splitlines(keepends=True)):
+            if (rec_iter, rec_seg) == (n_iter, seg_id):
+                found = ''.join(record)
+    return found
+
+
+def _from_directory(iter_dir: str, n_iter: int, seg_id: int) -> Optional[str]:
+    single = os.path.join(iter_dir, '%06d.log' % seg_id)
+    if os.path.exists(single):
+        with open(single, 'rb') as f:
+            return _decode(f.read())
+
+    entries = {}
+    if os.path.exists(os.path.join(iter_dir, INDEX_FILE)):
+        with open(os.path.join(iter_dir, INDEX_FILE)) as f:
+            entries = parse_index(f)
+    entry = entries.get((n_iter, seg_id))
+    if entry is not None:
+        with open(os.path.join(iter_dir, entry['file']), 'rb') as f:
+            f.seek(entry['offset'])
+            return _decode(f.read(entry['length']))
+
+    def logs():
+        for path in sorted(glob.glob(os.path.join(iter_dir, '*-w*.log'))):
+            with open(path, 'rb') as f:
+                yield path, f.read()
+    return _scan(logs(), n_iter, seg_id)
+
+
+def _from_archive(archive: str, n_iter: int, seg_id: int) -> Optional[str]:
+    prefix = '%06d/' % n_iter
+    with tarfile.open(archive, 'r:*') as tar:
+        names = set(tar.getnames())
+        for name in (prefix + '%06d.log' % seg_id, '%06d-%06d.log' % (n_iter, seg_id)):
+            if name in names:
+                return _decode(tar.extractfile(name).read())
+
+        entries = {}
+        if prefix + INDEX_FILE in names:
+            entries = parse_index(_decode(tar.extractfile(prefix + INDEX_FILE).read()).splitlines())
+        entry = entries.get((n_iter, seg_id))
+        if entry is not None and prefix + entry['file'] in names:
+            content = tar.extractfile(prefix + entry['file']).read()
+            return _decode(content[entry['offset']:entry['offset'] + entry['length']])
+
+        return _scan(((name, tar.extractfile(name).read()) for name in sorted(names) if is_worker_log(name)),
+                     n_iter, seg_id)
+
+
+def find_record(sim_root: str, n_iter: int, seg_id: int) -> Optional[str]:
+    """Log text of one segment, or None if no log holds it"""
+    logs_dir = os.path.join(sim_root, 'seg_logs')
+    iter_dir = os.path.join(logs_dir, '%06d' % n_iter)
+    if os.path.isdir(iter_dir):
+        text = _from_directory(iter_dir, n_iter, seg_id)
+        if text is not None:
+            return text
+    loose = os.path.join(logs_dir, '%06d-%06d.log' % (n_iter, seg_id))
+    if os.path.exists(loose):
+        with open(loose, 'rb') as f:
+            return _decode(f.read())
+    for archive in sorted(glob.glob(os.path.join(logs_dir, '%06d.tar*' % n_iter))):
+        if archive.endswith('.part'):
+            continue
+        text = _from_archive(archive, n_iter, seg_id)
+        if text is not None:
+            return text
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print the log of one WESTPA segment')
+    parser.add_argument('n_iter', type=int, help='iteration')
+    parser.add_argument('seg_id', type=int, help='segment ID')
+    parser.add_argument('--sim-root', default=os.environ.get('WEST_SIM_ROOT', '.'),
+                        help='WESTPA simulation root (default: $WEST_SIM_ROOT or .)')
+    args = parser.parse_args()
+
+    try:
+        text = find_record(args.sim_root, args.n_iter, args.seg_id)
+    except (OSError, tarfile.TarError) as e:
+        sys.exit(f"seg_log.py: {e}")
+    if text is None:
+        sys.exit(f"No log for iteration {args.n_iter} segment {args.seg_id} under {args.sim_root}/seg_logs")
+    sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Per-segment GPU performance telemetry for ParGaMD runs
+
+Streams through the pmemd output of every segment (traj_segs/*/*/seg.log),
+the segment logs (per-worker seg_logs/NNNNNN/<host>-w<N>.log records, see
+seg_log.py, or one file per segment) and the per-iteration
+seg_logs/NNNNNN.tar archives, extracts ns/day, wall time, host and CUDA
+device, and aggregates them by node and by iteration. Segments that run
+much longer than the rest of their iteration hold the whole WE iteration
+back, so they and the nodes they ran on are reported as stragglers.
+"""
+
+import os
+import re
+import csv
+import sys
+import glob
+import tarfile
+import argparse
+from dataclasses import dataclass, fields
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from seg_log import is_worker_log, iter_records
+
+# (n_iter, seg_id) from traj_segs/NNNNNN/NNNNNN/seg.log or seg_logs/NNNNNN-NNNNNN.log
+SEG_PATH_PATTERNS = [
+    re.compile(r'(\d{6})/(\d{6})/seg\.log$'),
+    re.compile(r'(\d{6})[-/](\d{6})\.log$'),
+]
+
+FINAL_PERFORMANCE = 'Final Performance Info'
+ALL_STEPS = 'Average timings for all steps'
+NS_PER_DAY = re.compile(r'ns/day\s*=\s*([0-9.]+)')
+ELAPSED = re.compile(r'Elapsed\(s\)\s*=\s*([0-9.]+)')
+TOTAL_WALL = re.compile(r'Master Total wall time:\s*([0-9.]+)\s*seconds')
+HOSTNAME = [
+    re.compile(r'^\|\s*Hostname:\s*(\S+)'),
+    re.compile(r'^RUNSEG\.SH: HOSTNAME =\s*(\S+)'),
+    re.compile(r'^=== SEGMENT .* host=(\S+)'),
+    re.compile(r'^SLURM_NODENAME=(\S+)'),
+    re.compile(r'^HOSTNAME=(\S+)'),
+]
+# Physical device first; "Device ID in use" is relative to CUDA_VISIBLE_DEVICES
+DEVICE = [
+    re.compile(r'^RUNSEG\.SH: CUDA_VISIBLE_DEVICES =\s*(\S+)'),
+    re.compile(r'^\|\s*CUDA_VISIBLE_DEVICES:\s*(\S+)'),
+    re.compile(r'^\|\s*CUDA Device ID in use:\s*(\S+)'),
+]
+DEVICE_NAME = re.compile(r'^\|\s*CUDA Device Name:\s*(.+?)\s*$')
+# Bounded pmemd retries in runseg.sh
+RETRIES = re.compile(r'^RUNSEG\.SH: RETRIES =\s*(\d+)')
+LOST_SECONDS = re.compile(r'^RUNSEG\.SH: LOST_SECONDS =\s*([0-9.]+)')
+SEGMENT_FAILED = 'RUNSEG.SH: FAILED'
+
+
+@dataclass
+class SegmentTelemetry:
+    """Performance figures of one propagated segment"""
+    n_iter: int
+    seg_id: int
+    ns_per_day: Optional[float] = None
+    wall_time: Optional[float] = None
+    host: Optional[str] = None
+    device: Optional[str] = None
+    device_name: Optional[str] = None
+    retries: Optional[int] = None
+    lost_time: Optional[float] = None
+    completed: bool = False
+    failed: bool = False
+
+    def merge(self, other: 'SegmentTelemetry'):
+        """Fill fields still missing here from another source of the same segment"""
+        for field in fields(self):
+            if getattr(self, field.name) is None:
+                setattr(self, field.name, getattr(other, field.name))
+        self.completed = self.completed or other.completed
+        self.failed = self.failed or other.failed
+
+
+def segment_key(name: str) -> Optional[Tuple[int, int]]:
+    """(n_iter, seg_id) encoded in a log path, or None"""
+    name = name.replace(os.sep, '/')
+    for pattern in SEG_PATH_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+    return None
+
+
+def first_match(patterns, line: str) -> Optional[str]:
+    for pattern in patterns:
+        match = pattern.search(line)
+        if match:
+            return match.group(1)
+    return None
+
+
+def parse_log(lines: Iterable[str], n_iter: int, seg_id: int) -> SegmentTelemetry:
+    """Extract telemetry from the lines of a pmemd mdout or a segment log"""
+    record = SegmentTelemetry(n_iter, seg_id)
+    in_final = False
+    all_steps = False
+    elapsed = None
+    for line in lines:
+        if FINAL_PERFORMANCE in line:
+            in_final = True
+            all_steps = False
+            record.completed = True
+            continue
+        if in_final:
+            # The block opens with "Average timings for last N steps", a
+            # window at the end of the run; the whole run follows it
+            if ALL_STEPS in line:
+                all_steps = True
+                continue
+            match = NS_PER_DAY.search(line)
+            if match and (all_steps or record.ns_per_day is None):
+                record.ns_per_day = float(match.group(1))
+            match = ELAPSED.search(line)
+            if match and (all_steps or elapsed is None):
+                elapsed = float(match.group(1))
+            match = TOTAL_WALL.search(line)
+            if match:
+                record.wall_time = float(match.group(1))
+            continue
+        if line.startswith('RUNSEG.SH:'):
+            match = RETRIES.search(line)
+            if match:
+                record.retries = int(match.group(1))
+            match = LOST_SECONDS.search(line)
+            if match:
+                record.lost_time = float(match.group(1))
+            if SEGMENT_FAILED in line:
+                record.failed = True
+        if record.host is None:
+            host = first_match(HOSTNAME, line)
+            # pmemd prints "Hostname: Unknown" when it cannot resolve it
+            if host != 'Unknown':
+                record.host = host
+        if record.device is None:
+            record.device = first_match(DEVICE, line)
+        if record.device_name is None:
+            match = DEVICE_NAME.search(line)
+            if match:
+                record.device_name = match.group(1)
+    if record.wall_time is None:
+        record.wall_time = elapsed
+    return record
+
+
+def decoded_lines(stream) -> Iterator[str]:
+    for raw in stream:
+        yield raw.decode('utf-8', errors='replace').rstrip('\n')
+
+
+def parse_worker_log(lines: Iterable[str]) -> Iterator[SegmentTelemetry]:
+    """One record per segment of a per-worker log"""
+    for n_iter, seg_id, record in iter_records(lines):
+        yield parse_log(record, n_iter, seg_id)
+
+
+def iter_archive(path: str) -> Iterator[SegmentTelemetry]:
+    """Stream the segment logs stored in one seg_logs tar archive"""
+    try:
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                key = segment_key(member.name)
+                if key is None and not is_worker_log(member.name):
+                    continue
+                stream = archive.extractfile(member)
+                if stream is None:
+                    continue
+                if key is None:
+                    yield from parse_worker_log(decoded_lines(stream))
+                else:
+                    yield parse_log(decoded_lines(stream), *key)
+    except (tarfile.TarError, OSError) as e:
+        print(f"warning: skipping {path}: {e}", file=sys.stderr)
+
+
+def iter_files(paths: Iterable[str]) -> Iterator[SegmentTelemetry]:
+    for path in paths:
+        key = segment_key(path)
+        if key is None and not is_worker_log(path):
+            continue
+        try:
+            with open(path, 'rb') as f:
+                if key is None:
+                    yield from parse_worker_log(decoded_lines(f))
+                else:
+                    yield parse_log(decoded_lines(f), *key)
+        except OSError as e:
+            print(f"warning: skipping {path}: {e}", file=sys.stderr)
+
+
+def collect(sim_root: str) -> Dict[Tuple[int, int], SegmentTelemetry]:
+    """Telemetry for every segment found under a simulation root"""
+    sources = [
+        iter_files(sorted(glob.glob(os.path.join(sim_root, 'traj_segs', '[0-9]*', '[0-9]*', 'seg.log')))),
+        iter_files(sorted(glob.glob(os.path.join(sim_root, 'seg_logs', '*.log')))),
+        iter_files(sorted(glob.glob(os.path.join(sim_root, 'seg_logs', '[0-9]*', '*.log')))),
+    ]
+    for archive in sorted(glob.glob(os.path.join(sim_root, 'seg_logs', '[0-9]*.tar*'))):
+        sources.append(iter_archive(archive))
+
+    records: Dict[Tuple[int, int], SegmentTelemetry] = {}
+    for source in sources:
+        for record in source:
+            key = (record.n_iter, record.seg_id)
+            if key in records:
+                records[key].merge(record)
+            else:
+                records[key] = record
+    return records
+
+
+def by_node(records: List[SegmentTelemetry]) -> Dict[str, Dict[str, float]]:
+    """ns/day statistics per host and device"""
+    groups: Dict[str, List[SegmentTelemetry]] = {}
+    for record in records:
+        if record.ns_per_day is None:
+            continue
+        node = f"{record.host or 'unknown'}:{record.device if record.device is not None else '?'}"
+        groups.setdefault(node, []).append(record)
+
+    stats = {}
+    for node, group in sorted(groups.items()):
+        speed = np.array([r.ns_per_day for r in group])
+        stats[node] = {
+            'segments': len(group),
+            'median_ns_per_day': float(np.median(speed)),
+            'min_ns_per_day': float(np.min(speed)),
+            'max_ns_per_day': float(np.max(speed)),
+        }
+    return stats
+
+
+def by_iteration(records: List[SegmentTelemetry]) -> Dict[int, Dict[str, float]]:
+    """Wall time spread per WE iteration; the slowest segment sets the pace"""
+    groups: Dict[int, List[SegmentTelemetry]] = {}
+    for record in records:
+        if record.wall_time is not None:
+            groups.setdefault(record.n_iter, []).append(record)
+
+    stats = {}
+    for n_iter, group in sorted(groups.items()):
+        wall = np.array([r.wall_time for r in group])
+        slowest = group[int(np.argmax(wall))]
+        stats[n_iter] = {
+            'segments': len(group),
+            'median_wall_time': float(np.median(wall)),
+            'max_wall_time': float(np.max(wall)),
+            'slowest_seg_id': slowest.seg_id,
+            'slowest_host': slowest.host or 'unknown',
+        }
+    return stats
+
+
+def find_stragglers(records: List[SegmentTelemetry], node_stats: Dict[str, Dict[str, float]],
+                    iter_stats: Dict[int, Dict[str, float]], factor: float = 1.5):
+    """Segments slower than factor x their iteration median, and nodes slower than
+    the overall median ns/day by the same factor"""
+    slow_segments = [
+        r for r in records
+        if r.wall_time is not None and r.n_iter in iter_stats
+        and r.wall_time > factor * iter_stats[r.n_iter]['median_wall_time']
+    ]
+    speeds = [r.ns_per_day for r in records if r.ns_per_day is not None]
+    slow_nodes = {}
+    if speeds:
+        overall = float(np.median(speeds))
+        slow_nodes = {
+            node: stats for node, stats in node_stats.items()
+            if stats['median_ns_per_day'] * factor < overall
+        }
+    return slow_segments, slow_nodes
+
+
+def write_csv(path: str, records: List[SegmentTelemetry]):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([field.name for field in fields(SegmentTelemetry)])
+        for record in records:
+            writer.writerow([getattr(record, field.name) for field in fields(SegmentTelemetry)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-segment GPU performance telemetry for ParGaMD')
+    parser.add_argument('sim_root', nargs='?', default=os.environ.get('WEST_SIM_ROOT', '.'),
+                        help='WESTPA simulation root (default: $WEST_SIM_ROOT or .)')
+    parser.add_argument('--factor', type=float, default=1.5,
+                        help='straggler threshold as a multiple of the median (default: 1.5)')
+    parser.add_argument('--csv', help='also write per-segment records to this CSV file')
+    parser.add_argument('--iterations', action='store_true', help='print the per-iteration table')
+    args = parser.parse_args()
+
+    records = sorted(collect(args.sim_root).values(), key=lambda r: (r.n_iter, r.seg_id))
+    if not records:
+        print(f"No segment logs found under {args.sim_root}")
+        sys.exit(1)
+
+    node_stats = by_node(records)
+    iter_stats = by_iteration(records)
+    slow_segments, slow_nodes = find_stragglers(records, node_stats, iter_stats, args.factor)
+
+    print(f"{len(records)} segments, {sum(r.completed for r in records)} with Final Performance Info")
+    print()
+    print(f"{'node:device':<32} {'segs':>6} {'median':>10} {'min':>10} {'max':>10}  ns/day")
+    for node, stats in node_stats.items():
+        flag = '  <- slow' if node in slow_nodes else ''
+        print(f"{node:<32} {stats['segments']:>6} {stats['median_ns_per_day']:>10.2f} "
+              f"{stats['min_ns_per_day']:>10.2f} {stats['max_ns_per_day']:>10.2f}{flag}")
+
+    if args.iterations:
+        print()
+        print(f"{'iter':>6} {'segs':>6} {'median s':>10} {'max s':>10}  slowest")
+        for n_iter, stats in iter_stats.items():
+            print(f"{n_iter:>6} {stats['segments']:>6} {stats['median_wall_time']:>10.1f} "
+                  f"{stats['max_wall_time']:>10.1f}  seg {stats['slowest_seg_id']} on {stats['slowest_host']}")
+
+    if iter_stats:
+        lost = sum(s['max_wall_time'] - s['median_wall_time'] for s in iter_stats.values())
+        print()
+        print(f"Time spent waiting on the slowest segment: {lost / 3600.0:.2f} hours "
+              f"over {len(iter_stats)} iterations")
+
+    retried = [r for r in records if r.retries]
+    if retried:
+        hosts: Dict[str, int] = {}
+        for r in retried:
+            hosts[r.host or 'unknown'] = hosts.get(r.host or 'unknown', 0) + r.retries
+        lost = sum(r.lost_time or 0.0 for r in retried)
+        print()
+        print(f"{len(retried)} segments needed pmemd retries ({sum(r.retries for r in retried)} in total, "
+              f"{lost / 3600.0:.2f} hours lost), {sum(r.failed for r in records)} failed after the retry cap")
+        for host, count in sorted(hosts.items(), key=lambda item: -item[1]):
+            print(f"  {host:<30} {count:>6} retries")
+
+    if slow_segments:
+        print()
+        print(f"Straggler segments (> {args.factor:g}x iteration median wall time):")
+        for r in slow_segments:
+            print(f"  iter {r.n_iter} seg {r.seg_id}: {r.wall_time:.0f} s "
+                  f"(median {iter_stats[r.n_iter]['median_wall_time']:.0f} s) on "
+                  f"{r.host or 'unknown'} device {r.device if r.device is not None else '?'}")
+
+    if args.csv:
+        write_csv(args.csv, records)
+        print(f"\nWrote {len(records)} records to {args.csv}")
+
+
+if __name__ == '__main__':
+    main()
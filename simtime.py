@@ -1,24 +1,147 @@
-import h5py
+import re
+import sys
+import time
+import argparse
 
 import numpy as np
 
+from west_reader import open_west
 
 
-simtime = 0.1 # in ns
 
-f = h5py.File('west_now.h5','r')
+def read_namelist_value(path,name,default=None):
+    """Read one numeric setting (e.g. nstlim) from an AMBER md.in namelist"""
+    try:
+        with open(path) as f:
+            text=f.read()
+    except OSError:
+        return default
+    match=re.search(r'\b'+name+r'\s*=\s*([-+0-9.eEdD]+)',text)
+    if not match:
+        return default
+    return float(match.group(1).replace('d','e').replace('D','e'))
 
-total_simtime = np.sum(f['summary']['n_particles'])*simtime
 
-total_walltime = np.sum(f['summary']['walltime'])/3600.0 # in hours
+def segment_simtime(md_in):
+    """Simulation length of one segment in ns, from nstlim and dt (ps)"""
+    nstlim=read_namelist_value(md_in,'nstlim')
+    dt=read_namelist_value(md_in,'dt',0.001)
+    if nstlim is None:
+        return 0.1
+    return nstlim*dt/1000.0
 
-speed=total_simtime/total_walltime
 
-print('total simtime = '+str(total_simtime)+' nanoseconds')
+def max_total_iterations(west_cfg):
+    """max_total_iterations from west.cfg, or None if it cannot be found"""
+    try:
+        with open(west_cfg) as f:
+            match=re.search(r'max_total_iterations:\s*(\d+)',f.read())
+    except OSError:
+        return None
+    return int(match.group(1)) if match else None
 
-print('total walltime = '+str(total_walltime)+' hours')
 
-print('Speed = %.2f ns/hr = %.2f ns/day'%(speed,speed*24))
+def completed_summary(west):
+    """Summary rows of all fully propagated iterations"""
+    summary=west.summary()
+    # The row of the iteration in progress has no walltime yet
+    n_complete=len(summary)
+    while n_complete and summary['walltime'][n_complete-1]<=0:
+        n_complete-=1
+    return summary[:n_complete]
 
-print(f['summary']['walltime'])
-print(f['summary']['n_particles'])
+
+def format_hours(seconds):
+    return '%.2f h'%(seconds/3600.0)
+
+
+class ThroughputMonitor:
+    """Per-iteration and rolling ns/day from the WESTPA summary table"""
+
+    def __init__(self,simtime,window=10,max_iters=None):
+        self.simtime=simtime
+        self.window=window
+        self.max_iters=max_iters
+        self.n_particles=np.zeros(0)
+        self.walltime=np.zeros(0)
+
+    def update(self,summary):
+        """Take the summary rows seen so far; return the newly completed iterations"""
+        first=len(self.walltime)
+        self.n_particles=np.asarray(summary['n_particles'],dtype=float)
+        self.walltime=np.asarray(summary['walltime'],dtype=float)
+        return range(first,len(self.walltime))
+
+    def ns_per_day(self,start,stop):
+        walltime=np.sum(self.walltime[start:stop])
+        if walltime<=0:
+            return 0.0
+        return np.sum(self.n_particles[start:stop])*self.simtime/walltime*86400.0
+
+    def report(self,i):
+        walkers=self.n_particles[i]
+        walltime=self.walltime[i]
+        start=max(0,i+1-self.window)
+        sec_per_seg=walltime/walkers if walkers else 0.0
+        print('iter %6d  walkers %5d  walltime %9.1f s  %8.2f s/segment  %8.2f ns/day  (last %d: %8.2f ns/day)'%(
+            i+1,walkers,walltime,sec_per_seg,self.ns_per_day(i,i+1),i+1-start,self.ns_per_day(start,i+1)))
+
+    def projection(self):
+        """Wall time left until max_total_iterations at the rolling-window pace"""
+        done=len(self.walltime)
+        if self.max_iters is None or done==0:
+            return None
+        remaining=max(0,self.max_iters-done)
+        return remaining*np.mean(self.walltime[max(0,done-self.window):done])
+
+    def summary(self):
+        total_simtime=np.sum(self.n_particles)*self.simtime
+        total_walltime=np.sum(self.walltime)/3600.0 # in hours
+        speed=total_simtime/total_walltime if total_walltime>0 else 0.0
+
+        print('total simtime = '+str(total_simtime)+' nanoseconds')
+
+        print('total walltime = '+str(total_walltime)+' hours')
+
+        print('Speed = %.2f ns/hr = %.2f ns/day'%(speed,speed*24))
+
+        left=self.projection()
+        if left is not None:
+            print('%d of %d iterations done, about %s left at the current pace'%(
+                len(self.walltime),self.max_iters,format_hours(left)))
+
+
+def main():
+    parser=argparse.ArgumentParser(description='WESTPA throughput monitor')
+    parser.add_argument('west_file',nargs='?',default='west.h5',help='WESTPA data file')
+    parser.add_argument('--md-in',default='common_files/md.in',help='segment md.in (nstlim, dt)')
+    parser.add_argument('--west-cfg',default='west.cfg',help='west.cfg (max_total_iterations)')
+    parser.add_argument('--window',type=int,default=10,help='iterations in the rolling average')
+    parser.add_argument('--follow',action='store_true',help='keep polling for new iterations')
+    parser.add_argument('--interval',type=float,default=60.0,help='seconds between polls with --follow')
+    args=parser.parse_args()
+
+    simtime=segment_simtime(args.md_in) # in ns
+    print('segment length = %g ns (from %s)'%(simtime,args.md_in))
+    monitor=ThroughputMonitor(simtime,args.window,max_total_iterations(args.west_cfg))
+
+    west=open_west(args.west_file)
+    try:
+        while True:
+            for i in monitor.update(completed_summary(west)):
+                monitor.report(i)
+            if not args.follow or (monitor.max_iters and len(monitor.walltime)>=monitor.max_iters):
+                break
+            sys.stdout.flush()
+            time.sleep(args.interval)
+            west.refresh()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        west.close()
+
+    monitor.summary()
+
+
+if __name__=='__main__':
+    main()
@@ -5,10 +5,18 @@ Web-based interface for configuring ParGaMD simulations
 """
 
 import streamlit as st
-import zipfile
-import io
+import os
 from datetime import datetime
-from config_generator import ParGaMDConfigGenerator
+from config_generator import ParGaMDConfigGenerator, is_text, write_bundle, DEFAULT_COMPRESSLEVEL, RESOURCE_CALIBRATION
+
+# Structure / trajectory data: not shown in the editor even when stored as text
+DATA_EXTENSIONS = ('.prmtop', '.inpcrd', '.rst', '.nc', '.dcd', '.trr', '.xtc')
+
+
+def text_file_paths(configs):
+    """Bundle files that can be viewed and edited as text"""
+    return [path for path, content in configs.items()
+            if is_text(content) and not path.endswith(DATA_EXTENSIONS)]
 
 # Try to import code editor with correct syntax
 try:
@@ -464,6 +472,82 @@ def render_we_parameters():
                 value=st.session_state.form_data.get('include_infinite_bounds', True),
                 help="Prevents simulation errors with proper boundary handling"
             )
+            
+            bin_schemes = {
+                "rectilinear": "Rectilinear grid (all CV bins)",
+                "mab": "Minimal adaptive binning (MAB)",
+                "nested": "Rectilinear with refined regions"
+            }
+            st.session_state.form_data['bin_scheme'] = st.selectbox(
+                "Binning Scheme",
+                options=list(bin_schemes.keys()),
+                format_func=lambda x: bin_schemes[x],
+                index=list(bin_schemes.keys()).index(st.session_state.form_data.get('bin_scheme', 'rectilinear')),
+                help="MAB places a fixed number of bins over the region the walkers actually reach; "
+                     "refined regions keep the CV grid coarse except around the listed points"
+            )
+            
+            if st.session_state.form_data['bin_scheme'] == 'mab':
+                st.session_state.form_data['mab_nbins'] = st.number_input(
+                    "MAB Bins per CV",
+                    min_value=1,
+                    max_value=100,
+                    value=st.session_state.form_data.get('mab_nbins', 10),
+                    help="Adaptive bins along each CV"
+                )
+                mab_directions = {0: "Both directions", 1: "Towards larger values", -1: "Towards smaller values"}
+                st.session_state.form_data['mab_direction'] = st.selectbox(
+                    "MAB Direction",
+                    options=list(mab_directions.keys()),
+                    format_func=lambda x: mab_directions[x],
+                    index=list(mab_directions.keys()).index(st.session_state.form_data.get('mab_direction', 0)),
+                    help="Which end of the walker distribution gets extra leading-walker bins"
+                )
+            elif st.session_state.form_data['bin_scheme'] == 'nested':
+                regions_text = st.text_area(
+                    "Refined Regions",
+                    value=st.session_state.form_data.get('bin_regions_text', ''),
+                    help="One region per line: a point inside it, then the finer step per CV, "
+                         "e.g. '2.1, 3.3 ; 0.05' (one step applies to all CVs)"
+                )
+                st.session_state.form_data['bin_regions_text'] = regions_text
+                try:
+                    st.session_state.form_data['bin_regions'] = parse_bin_regions(regions_text)
+                except ValueError:
+                    st.error("Each region line needs 'point ; step', e.g. '2.1, 3.3 ; 0.05'")
+            
+            st.session_state.form_data['max_retries'] = st.number_input(
+                "pmemd Retries per Segment",
+                min_value=0,
+                max_value=10,
+                value=st.session_state.form_data.get('max_retries', 3),
+                help="A segment that still crashes after this many retries fails the WESTPA run "
+                     "instead of looping for the rest of the allocation"
+            )
+            st.session_state.form_data['retry_backoff'] = st.number_input(
+                "First Retry Delay (s)",
+                min_value=0,
+                max_value=600,
+                value=st.session_state.form_data.get('retry_backoff', 30),
+                help="Wait before the first retry; doubles for every further retry"
+            )
+            seg_log_modes = {
+                'worker': "One log per worker and iteration",
+                'segment': "One log file per segment"
+            }
+            st.session_state.form_data['seg_log_mode'] = st.selectbox(
+                "Segment Logs",
+                options=list(seg_log_modes.keys()),
+                format_func=lambda x: seg_log_modes[x],
+                index=list(seg_log_modes.keys()).index(st.session_state.form_data.get('seg_log_mode', 'worker')),
+                help="Per-worker logs append every segment as an indexed record (print one with "
+                     "seg_log.py N_ITER SEG_ID) instead of creating thousands of small files"
+            )
+            st.session_state.form_data['seg_debug'] = st.checkbox(
+                "Debug Segment Logs",
+                value=st.session_state.form_data.get('seg_debug', False),
+                help="Trace runseg.sh (set -x) and dump the environment of every segment into its log"
+            )
         
         col1, col2 = st.columns([1, 4])
         with col1:
@@ -478,6 +562,20 @@ def render_we_parameters():
             st.session_state.current_step = 4
             st.rerun()
 
+def parse_bin_regions(text):
+    """Refined regions from 'at values ; step values' lines"""
+    regions = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        at, step = line.split(';')
+        steps = [float(value) for value in step.split(',')]
+        regions.append({
+            'at': [float(value) for value in at.split(',')],
+            'step': steps[0] if len(steps) == 1 else steps
+        })
+    return regions
+
 def render_gpu_options():
     """Render GPU options step"""
     st.markdown('<div class="step-header"><h2>🖥️ GPU Parallelization Options</h2></div>', unsafe_allow_html=True)
@@ -494,6 +592,69 @@ def render_gpu_options():
         else:
             st.info("ℹ️ Single-GPU mode will be used (GPU parallelization code commented out)")
         
+        col1, col2 = st.columns(2)
+        with col1:
+            st.session_state.form_data['gpus_per_node'] = st.number_input(
+                "GPUs per node (0 = detect)",
+                min_value=0, max_value=16,
+                value=int(st.session_state.form_data.get('gpus_per_node', 0)),
+                help="0 requests whole nodes (4 GPUs on Expanse and Frontera) and detects the GPUs of every node at job start from the SLURM allocation (falling back to SLURM_GPUS_ON_NODE, CUDA_VISIBLE_DEVICES or nvidia-smi), so nodes with different GPU counts get matching worker counts. HPC2 needs a fixed count. A fixed count is requested as is in the #SBATCH header. Ignored (1 GPU) without multi-GPU parallelization."
+            )
+        with col2:
+            st.session_state.form_data['segments_per_gpu'] = st.number_input(
+                "Concurrent segments per GPU",
+                min_value=1, max_value=16,
+                value=int(st.session_state.form_data.get('segments_per_gpu', 1)),
+                help="Run several pmemd segments on each GPU at once (under CUDA MPS when available). Small systems such as chignolin leave a GPU mostly idle with one segment. Workers per node = GPUs per node x segments per GPU."
+            )
+        
+        st.session_state.form_data['local_scratch'] = st.checkbox(
+            "Stage segments in node-local scratch",
+            value=st.session_state.form_data.get('local_scratch', False),
+            help="Each segment runs in node-local scratch with inputs from a per-node cache; only seg.rst, seg.nc, seg.log, gamd.log and the CV files are copied back to traj_segs. Set WEST_LOCAL_SCRATCH in env.sh to override the scratch directory."
+        )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.session_state.form_data['nodes'] = st.number_input(
+                "Nodes",
+                min_value=1, max_value=64,
+                value=int(st.session_state.form_data.get('nodes', 1)),
+                help="Nodes requested in run_WE.sh. Each node runs one ZMQ client with its own GPUs x segments per GPU workers."
+            )
+        with col2:
+            st.session_state.form_data['zmq_timeout'] = st.number_input(
+                "Worker timeout in seconds (0 = auto)",
+                min_value=0, max_value=86400,
+                value=int(st.session_state.form_data.get('zmq_timeout', 0)),
+                help="A ZMQ worker silent this long is dropped and its segment re-run elsewhere. Auto uses about two expected segment runtimes (at least 10 minutes) and sets the heartbeat in env.sh to match."
+            )
+        st.session_state.form_data['master_workers'] = st.checkbox(
+            "Run workers inside the ZMQ master",
+            value=st.session_state.form_data.get('master_workers', False),
+            help="The first node's workers run in the master process instead of a separate client; saves one w_run process and an ssh hop, useful for single-node jobs."
+        )
+        st.session_state.form_data['chain_jobs'] = st.number_input(
+            "Follow-up jobs to chain",
+            min_value=0, max_value=100,
+            value=int(st.session_state.form_data.get('chain_jobs', 0)),
+            help="run_WE.sh queues its own successor (afterany dependency) until this many follow-up jobs have run or max_total_iterations is reached. Every job resumes from west.h5; init.sh only runs when west.h5 is missing."
+        )
+        watchdog_modes = {
+            'alert': "Report stalled and straggling segments",
+            'kill': "Report, and kill stalled pmemd runs",
+            'off': "No watchdog"
+        }
+        st.session_state.form_data['watchdog'] = st.selectbox(
+            "Segment Watchdog",
+            options=list(watchdog_modes.keys()),
+            format_func=lambda x: watchdog_modes[x],
+            index=list(watchdog_modes.keys()).index(st.session_state.form_data.get('watchdog', 'alert')),
+            help="westpa_scripts/watchdog.py runs next to the ZMQ master and writes watchdog/alerts.log. A segment without "
+                 "pmemd output for about one expected segment runtime is stalled; 'kill' ends it so runseg.sh retries from "
+                 "its last restart. Hosts with repeated stalls go into unhealthy_nodes.txt and are excluded from chained jobs."
+        )
+        
         col1, col2 = st.columns([1, 4])
         with col1:
             back_btn = st.form_submit_button("← Back")
@@ -507,6 +668,58 @@ def render_gpu_options():
             st.session_state.current_step = 5
             st.rerun()
 
+def format_bytes(n_bytes: float) -> str:
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if n_bytes < 1000 or unit == 'TB':
+            return f"{n_bytes:,.1f} {unit}"
+        n_bytes /= 1000.0
+
+def render_resource_estimate():
+    """Predicted walkers, storage and GPU time, with warnings for settings over job limits"""
+    st.subheader("📊 Resource Estimate")
+    form_data = st.session_state.form_data
+    hpc_system = form_data.get('hpc_system', 'expanse')
+    default_rate = RESOURCE_CALIBRATION.get(hpc_system, RESOURCE_CALIBRATION['expanse'])['ns_per_day']
+    
+    col_a, col_b = st.columns(2)
+    with col_a:
+        ns_per_day = st.number_input(
+            "Measured ns/day (0 = calibration default)",
+            min_value=0.0, value=float(form_data.get('ns_per_day', 0.0)), step=50.0,
+            help=f"Per-segment pmemd.cuda throughput for this system with your segments per GPU, e.g. the "
+                 f"median from seg_telemetry.py. The default for {hpc_system} is {default_rate:g} ns/day for "
+                 f"chignolin alone on a GPU, scaled by atom count and split between segments sharing a GPU."
+        )
+    with col_b:
+        nodes = st.number_input(
+            "GPU nodes", min_value=1, value=int(form_data.get('nodes', 1)),
+            help="Nodes running segments concurrently"
+        )
+    form_data['ns_per_day'] = ns_per_day
+    form_data['nodes'] = nodes
+    
+    try:
+        result = st.session_state.config_generator.estimate_resources(form_data, st.session_state.uploaded_files)
+    except (KeyError, ValueError) as e:
+        st.warning(f"⚠️ Could not estimate resources: {str(e)}")
+        return
+    
+    est = result['estimates']
+    col_a, col_b, col_c = st.columns(3)
+    col_a.metric("Max walkers / iteration", f"{est['max_walkers']:,}")
+    col_b.metric("pcoord / iteration", format_bytes(est['pcoord_bytes_per_iteration']))
+    col_c.metric("Atoms", f"{est['n_atoms']:,}")
+    col_a.metric("west.h5", format_bytes(est['west_h5_bytes']))
+    col_b.metric("traj_segs", format_bytes(est['traj_segs_bytes']))
+    col_c.metric("Iteration wall time", f"{est['iteration_hours']:,.1f} h")
+    col_a.metric("GPU-hours", f"{est['gpu_hours']:,.0f}")
+    col_b.metric(f"{result['calibration']['max_job_hours']:g} h allocations", f"{est['allocations']:,}")
+    col_c.metric("ns/day", f"{est['ns_per_day']:,.0f}")
+    st.caption("Upper bounds: every bin is assumed full for all iterations.")
+    
+    for warning in result['warnings']:
+        st.warning(f"⚠️ {warning}")
+
 def render_review_and_edit():
     """Render review and edit step with live editor"""
     st.markdown('<div class="step-header"><h2>✏️ Review & Edit Configuration</h2></div>', unsafe_allow_html=True)
@@ -525,6 +738,12 @@ def render_review_and_edit():
     
     col1, col2 = st.columns([1, 1])
     
+    try:
+        bin_estimate = st.session_state.config_generator.estimate_max_walkers(st.session_state.form_data)
+    except (KeyError, ValueError) as e:
+        bin_estimate = {}
+        st.warning(f"⚠️ Could not estimate the walker count: {str(e)}")
+    
     with col1:
         st.subheader("📋 Configuration Summary")
         st.json({
@@ -538,24 +757,36 @@ def render_review_and_edit():
                 "Walkers per Bin": st.session_state.form_data.get('bin_target_counts', 4),
                 "Max Iterations": st.session_state.form_data.get('max_total_iterations', 1000),
                 "MD Steps": st.session_state.form_data.get('nstlim', 50000),
-                "Print Frequency": st.session_state.form_data.get('ntpr', 500)
+                "Print Frequency": st.session_state.form_data.get('ntpr', 500),
+                "Segment Logs": st.session_state.form_data.get('seg_log_mode', 'worker'),
+                "Binning": bin_estimate.get('bin_scheme', 'rectilinear'),
+                "Bins": bin_estimate.get('n_bins', '?'),
+                "Max Walkers per Iteration": bin_estimate.get('max_walkers', '?')
             },
             "Progress Coordinates": {
                 f"CV {i+1} ({cv.get('name', cv['type'])})": f"{cv['min']} to {cv['max']} (step: {cv['step']})"
                 for i, cv in enumerate(st.session_state.form_data.get('cv_list', []))
             },
             "GPU": {
-                "Multi-GPU": st.session_state.form_data.get('enable_gpu_parallelization', False)
+                "Multi-GPU": st.session_state.form_data.get('enable_gpu_parallelization', False),
+                "GPUs per Node": st.session_state.form_data.get('gpus_per_node', 0) or 'detect',
+                "Segments per GPU": st.session_state.form_data.get('segments_per_gpu', 1),
+                "Local Scratch Staging": st.session_state.form_data.get('local_scratch', False),
+                "Nodes": st.session_state.form_data.get('nodes', 1),
+                "Workers in Master": st.session_state.form_data.get('master_workers', False),
+                "Worker Timeout (s)": st.session_state.form_data.get('zmq_timeout', 0) or 'auto',
+                "Chained Jobs": st.session_state.form_data.get('chain_jobs', 0),
+                "Watchdog": st.session_state.form_data.get('watchdog', 'alert')
             }
         })
+        
+        render_resource_estimate()
     
     with col2:
         st.subheader("📝 Live Editor")
         
         # File selection dropdown (exclude binary files)
-        all_files = list(st.session_state.generated_configs.keys())
-        binary_extensions = ['.prmtop', '.inpcrd', '.rst', '.nc', '.dcd', '.trr', '.xtc']
-        file_options = [f for f in all_files if not any(f.endswith(ext) for ext in binary_extensions)]
+        file_options = text_file_paths(st.session_state.generated_configs)
         
         if not file_options:
             st.warning("No editable files found. All generated files are binary.")
@@ -635,12 +866,12 @@ def render_review_and_edit():
             # Reset to original button
             if st.button("Reset to Original", key=f"reset_{selected_file}"):
                 try:
-                    # Regenerate original content
-                    original_configs = st.session_state.config_generator.generate_configs(
+                    # Render only this file; unchanged files come from the generator's cache
+                    st.session_state.generated_configs[selected_file] = st.session_state.config_generator.render_file(
+                        selected_file,
                         st.session_state.form_data,
                         st.session_state.uploaded_files
                     )
-                    st.session_state.generated_configs[selected_file] = original_configs[selected_file]
                     st.success(f"✅ {selected_file} reset to original")
                     st.rerun()
                 except Exception as e:
@@ -655,6 +886,7 @@ def render_review_and_edit():
     with col2:
         if st.button("Regenerate All"):
             try:
+                # Only files whose parameters or uploads changed are rendered again
                 st.session_state.generated_configs = st.session_state.config_generator.generate_configs(
                     st.session_state.form_data,
                     st.session_state.uploaded_files
@@ -668,35 +900,18 @@ def render_review_and_edit():
             st.session_state.current_step = 6  # Go to download step
             st.rerun()
 
-def create_zip_file():
-    """Create ZIP file with all configurations"""
-    import base64
+def create_zip_file(compresslevel=DEFAULT_COMPRESSLEVEL):
+    """Create ZIP file with all configurations
     
+    The archive is streamed into a spooled temporary file; text is written
+    as UTF-8, binary entries (bytes / memoryview) exactly as uploaded.
+    Returns None if the archive could not be written.
+    """
     try:
-        zip_buffer = io.BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Add generated configuration files
-            for file_path, content in st.session_state.generated_configs.items():
-                # Check if this is a binary file that was base64 encoded
-                binary_extensions = ['.prmtop', '.inpcrd', '.rst']
-                if any(file_path.endswith(ext) for ext in binary_extensions):
-                    try:
-                        # Try to decode as base64 (binary files are stored as base64)
-                        binary_content = base64.b64decode(content)
-                        zip_file.writestr(file_path, binary_content)
-                    except:
-                        # If decoding fails, write as text (fallback)
-                        zip_file.writestr(file_path, content)
-                else:
-                    # Text files - write as is
-                    zip_file.writestr(file_path, content)
-        
-        zip_buffer.seek(0)
-        return zip_buffer
+        return write_bundle(st.session_state.generated_configs.items(), compresslevel=compresslevel)
     except Exception as e:
         st.error(f"Error creating ZIP file: {str(e)}")
-        return io.BytesIO()
+        return None
 
 def render_download():
     """Render download step"""
@@ -728,19 +943,30 @@ def render_download():
         st.write(f"**Uploaded files**: {list(st.session_state.uploaded_files.keys())}")
     
     # Create download button
-    zip_file = create_zip_file()
+    compresslevel = st.select_slider(
+        "Compression level",
+        options=list(range(10)),
+        value=DEFAULT_COMPRESSLEVEL,
+        help="0 stores files uncompressed (fastest); 9 gives the smallest archive"
+    )
+    zip_file = create_zip_file(compresslevel)
+    if zip_file is None:
+        return
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"ParGaMD_config_{timestamp}.zip"
     
-    st.download_button(
-        label="📦 Download Configuration Bundle",
-        data=zip_file.getvalue(),
-        file_name=filename,
-        mime="application/zip",
-        type="primary",
-        help="Download all configuration files as a ZIP archive"
-    )
+    # download_button reads a buffered file itself, so hand it a reader on the
+    # spooled archive (fileno() moves it to disk) instead of a bytes copy
+    with zip_file, open(os.dup(zip_file.fileno()), 'rb') as bundle:
+        st.download_button(
+            label="📦 Download Configuration Bundle",
+            data=bundle,
+            file_name=filename,
+            mime="application/zip",
+            type="primary",
+            help="Download all configuration files as a ZIP archive"
+        )
     
     # Completion message
     st.markdown("---")
@@ -761,10 +987,8 @@ def render_download():
     # Show file contents summary
     st.subheader("📁 Bundle Contents")
     
-    all_files = list(st.session_state.generated_configs.keys())
-    binary_extensions = ['.prmtop', '.inpcrd', '.rst', '.nc', '.dcd', '.trr', '.xtc']
-    text_files = [f for f in all_files if not any(f.endswith(ext) for ext in binary_extensions)]
-    binary_files = [f for f in all_files if any(f.endswith(ext) for ext in binary_extensions)]
+    text_files = text_file_paths(st.session_state.generated_configs)
+    binary_files = [f for f in st.session_state.generated_configs if f not in text_files]
     
     col1, col2 = st.columns(2)
     
@@ -0,0 +1,54 @@
+import os
+import sys
+import tarfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'westpa_scripts'))
+
+import archive_iters  # noqa: E402
+
+FILES = ('seg.rst', 'seg.nc', 'rmsd.dat', 'gamd.log')
+
+
+def write_segment(sim_root, run):
+    seg_dir = sim_root / 'traj_segs' / '000001' / '000000'
+    seg_dir.mkdir(parents=True, exist_ok=True)
+    for name in FILES:
+        # Same size in every run, different content
+        (seg_dir / name).write_text(f'{run}:{name}\n')
+    return seg_dir
+
+
+def archived(sim_root):
+    with tarfile.open(sim_root / 'traj_segs' / '000001.tar.gz') as tar:
+        return {member.name: tar.extractfile(member).read().decode()
+                for member in tar if member.isfile()}
+
+
+def test_rerun_with_same_size_files_is_archived_again(tmp_path):
+    keep = ['seg.rst', 'gamd.log']
+    write_segment(tmp_path, 'a')
+    archive_iters.archive_traj_segs(str(tmp_path), 1, keep, 'gz', 6)
+    assert archived(tmp_path)['000001/000000/seg.nc'] == 'a:seg.nc\n'
+
+    # w_truncate and a re-run, then archive_iters.py --recheck
+    seg_dir = write_segment(tmp_path, 'b')
+    message = archive_iters.archive_traj_segs(str(tmp_path), 1, keep, 'gz', 6)
+
+    assert not message.startswith('error')
+    content = archived(tmp_path)
+    assert {name: content[f'000001/000000/{name}'] for name in FILES} == \
+        {name: f'b:{name}\n' for name in FILES}
+    assert sorted(os.listdir(seg_dir)) == sorted(keep)
+    assert archive_iters.read_index(str(tmp_path / 'traj_segs' / '000001.tar.gz')) == \
+        archive_iters.scan_archive(str(tmp_path / 'traj_segs' / '000001.tar.gz'))
+
+
+def test_unchanged_sources_keep_the_archive(tmp_path):
+    write_segment(tmp_path, 'a')
+    archive_iters.archive_traj_segs(str(tmp_path), 1, ['seg.rst', 'gamd.log'], 'gz', 6)
+    archive = tmp_path / 'traj_segs' / '000001.tar.gz'
+    mtime = archive.stat().st_mtime_ns
+
+    archive_iters.archive_traj_segs(str(tmp_path), 1, ['seg.rst', 'gamd.log'], 'gz', 6)
+
+    assert archive.stat().st_mtime_ns == mtime
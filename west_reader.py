@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Shared read-only access to west.h5 for the ParGaMD analysis scripts
+
+The file is opened once (SWMR when the writer allows it). Iteration
+groups and dataset handles are cached, so repeated lookups don't walk the
+HDF5 B-trees again. Arrays that have been read are kept in an LRU cache
+limited by a memory budget. simtime.py, data_extract.py,
+lineage_index.py and westpa_scripts/cat_trajectory.py all read through
+this module.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+# w_run keeps west.h5 open for writing while the analysis tools read it
+os.environ.setdefault('HDF5_USE_FILE_LOCKING', 'FALSE')
+
+import h5py
+import numpy as np
+
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+MAX_HANDLES = 512
+
+
+class LRUCache:
+    """Least-recently-used cache bounded by total size"""
+
+    def __init__(self, max_size: int, size_of=lambda value: 1):
+        self.max_size = max_size
+        self.size_of = size_of
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        try:
+            value, size = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        size = self.size_of(value)
+        if size > self.max_size:
+            return value
+        if key in self._items:
+            self.size -= self._items.pop(key)[1]
+        self._items[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            self.size -= self._items.popitem(last=False)[1][1]
+        return value
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
+
+
+def _nbytes(array) -> int:
+    return getattr(array, 'nbytes', 0)
+
+
+class WestReader:
+    """Cached, read-only view of a WESTPA west.h5 file"""
+
+    def __init__(self, path: str = 'west.h5', cache_bytes: int = DEFAULT_CACHE_BYTES):
+        self.path = path
+        self.handles = LRUCache(MAX_HANDLES)
+        self.data = LRUCache(cache_bytes, _nbytes)
+        self.file = None
+        self.open()
+
+    def open(self):
+        try:
+            self.file = h5py.File(self.path, 'r', libver='latest', swmr=True)
+        except (OSError, ValueError):
+            self.file = h5py.File(self.path, 'r')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.handles.clear()
+        self.data.clear()
+
+    def refresh(self):
+        """Pick up iterations the writer has flushed since the file was opened"""
+        # w_run is not an SWMR writer, so metadata changes need a reopen
+        self.close()
+        self.open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- handles -------------------------------------------------------
+
+    def _handle(self, key: str):
+        handle = self.handles.get(key)
+        if handle is None:
+            handle = self.handles.put(key, self.file[key])
+        return handle
+
+    def iteration(self, n_iter: int):
+        """h5py group of one iteration"""
+        return self._handle('/iterations/iter_{:08d}'.format(n_iter))
+
+    def dataset(self, n_iter: int, name: str):
+        """Dataset handle inside an iteration group, e.g. 'pcoord' or 'auxdata/coord'"""
+        return self._handle('/iterations/iter_{:08d}/{}'.format(n_iter, name))
+
+    def has_iteration(self, n_iter: int) -> bool:
+        return 'iter_{:08d}'.format(n_iter) in self._handle('/iterations')
+
+    def iter_numbers(self) -> List[int]:
+        """Iteration numbers present in the file, in order"""
+        return sorted(int(key[5:]) for key in self._handle('/iterations'))
+
+    @property
+    def current_iteration(self) -> int:
+        return int(self.file.attrs['west_current_iteration'])
+
+    # -- bulk data -----------------------------------------------------
+
+    def _read(self, key, dataset, selection=()):
+        array = self.data.get(key)
+        if array is None:
+            array = dataset[selection] if selection != () else dataset[()]
+            if isinstance(array, np.ndarray):
+                # Shared between callers, so keep it immutable
+                array.setflags(write=False)
+            array = self.data.put(key, array)
+        return array
+
+    def summary(self) -> np.ndarray:
+        """The whole summary table"""
+        return self._read(('summary',), self._handle('/summary'))
+
+    def seg_index(self, n_iter: int, field: Optional[str] = None) -> np.ndarray:
+        """seg_index of one iteration, or a single field of it (e.g. 'parent_id')"""
+        seg_index = self._read(('seg_index', n_iter), self.dataset(n_iter, 'seg_index'))
+        return seg_index[field] if field else seg_index
+
+    def pcoord(self, n_iter: int) -> np.ndarray:
+        """pcoord of all segments of one iteration, shape (n_segs, pcoord_len, ndim)"""
+        return self._read(('pcoord', n_iter), self.dataset(n_iter, 'pcoord'))
+
+    def auxdata(self, n_iter: int, name: str, seg_ids: Optional[Sequence[int]] = None) -> np.ndarray:
+        """One auxdata dataset of an iteration, optionally only some segments
+
+        seg_ids may repeat or come in any order; the file is read with a
+        single sorted selection and the rows are expanded afterwards.
+        """
+        dataset = self.dataset(n_iter, 'auxdata/' + name)
+        if seg_ids is None:
+            return self._read(('auxdata', n_iter, name), dataset)
+        unique, inverse = np.unique(np.asarray(seg_ids, dtype=np.int64), return_inverse=True)
+        block = self._read(('auxdata', n_iter, name, unique.tobytes()), dataset, (unique.tolist(),))
+        return block[inverse]
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.data.hits, 'misses': self.data.misses, 'cached_bytes': self.data.size}
+
+
+_readers: Dict[str, WestReader] = {}
+
+
+def open_west(path: str = 'west.h5', cache_bytes: int = DEFAULT_CACHE_BYTES) -> WestReader:
+    """Process-wide shared reader for one west.h5 file"""
+    key = os.path.abspath(path)
+    reader = _readers.get(key)
+    if reader is None or reader.file is None:
+        reader = _readers[key] = WestReader(path, cache_bytes)
+    return reader
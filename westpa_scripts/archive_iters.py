@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Background archiver for completed WESTPA iterations
+
+Started by post_iter.sh after every iteration (and by tar_segs.sh by hand):
+
+    python3 archive_iters.py --current-iter 120 --workers 2
+    python3 archive_iters.py --keep-recent 1 --keep seg.rst,gamd.log
+
+Every completed iteration that is not archived yet is packed in a pool of
+worker processes:
+
+    seg_logs/NNNNNN/       ->  seg_logs/NNNNNN.tar.gz   (worker logs + index.tsv,
+    seg_logs/NNNNNN-*.log                                or one log per segment)
+    traj_segs/NNNNNN/      ->  traj_segs/NNNNNN.tar.gz  (only --keep files stay)
+
+While an archive is written, a member index (NNNNNN.index.tsv: sha1, size,
+name) is built from the source files. The finished archive is read back
+and compared with the index before any source file is removed; the index
+is renamed into place last and marks the iteration as archived.
+
+Only one archiver runs at a time (traj_segs/.archive.lock); a second one
+exits straight away and the next post_iter.sh call picks up the backlog.
+The newest --keep-recent iterations are left alone: the next iteration
+continues from their seg.rst and data_extract.py may still be reading
+them. With the default retention data_extract.py needs --source h5 or
+--source store for archived iterations.
+"""
+
+import os
+import sys
+import glob
+import fcntl
+import shutil
+import tarfile
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+CHUNK_BYTES = 1 << 20
+DEFAULT_KEEP = 'seg.rst,gamd.log'
+LOCK_FILE = '.archive.lock'
+
+# name -> (size, sha1 of file content, or 'link:<target>' for symlinks)
+Index = Dict[str, Tuple[int, str]]
+
+
+class HashingReader:
+    """File wrapper that hashes everything tarfile copies out of it"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha1 = hashlib.sha1()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.sha1.update(data)
+        return data
+
+
+def source_members(base_dir: str) -> List[str]:
+    """Files and symlinks below base_dir, relative to it, in a stable order"""
+    members = []
+    for root, dirs, files in os.walk(base_dir):
+        dirs.sort()
+        for name in sorted(files + [d for d in dirs if os.path.islink(os.path.join(root, d))]):
+            members.append(os.path.relpath(os.path.join(root, name), base_dir))
+    return members
+
+
+def write_archive(archive: str, base_dir: str, members: List[str], arc_prefix: str,
+                  compression: str, compresslevel: int) -> Index:
+    """Pack members into archive + '.part' and return their index"""
+    index: Index = {}
+    mode = 'w:' + compression if compression else 'w'
+    options = {'compresslevel': compresslevel} if compression in ('gz', 'bz2') else {}
+    with tarfile.open(archive + '.part', mode, **options) as tar:
+        for rel in members:
+            name = os.path.join(arc_prefix, rel) if arc_prefix else rel
+            info = tar.gettarinfo(os.path.join(base_dir, rel), arcname=name)
+            if info.isfile():
+                with open(os.path.join(base_dir, rel), 'rb') as f:
+                    reader = HashingReader(f)
+                    tar.addfile(info, reader)
+                index[name] = (info.size, reader.sha1.hexdigest())
+            elif info.issym():
+                tar.addfile(info)
+                index[name] = (0, 'link:' + info.linkname)
+    return index
+
+
+def read_index(archive: str) -> Index:
+    """Member index of an archive as stored by an earlier run (empty if absent)"""
+    index: Index = {}
+    try:
+        with open(index_path(archive)) as f:
+            for line in f:
+                digest, size, name = line.rstrip('\n').split('\t', 2)
+                index[name] = (int(size), digest)
+    except (OSError, ValueError):
+        return {}
+    return index
+
+
+def scan_archive(path: str) -> Index:
+    """Index recomputed from the archive content"""
+    index: Index = {}
+    with tarfile.open(path, 'r|*') as tar:
+        for member in tar:
+            if member.isfile():
+                sha1 = hashlib.sha1()
+                stream = tar.extractfile(member)
+                for chunk in iter(lambda: stream.read(CHUNK_BYTES), b''):
+                    sha1.update(chunk)
+                index[member.name] = (member.size, sha1.hexdigest())
+            elif member.issym():
+                index[member.name] = (0, 'link:' + member.linkname)
+    return index
+
+
+def index_path(archive: str) -> str:
+    return archive.split('.tar')[0] + '.index.tsv'
+
+
+def commit(archive: str, index: Index):
+    """Move a verified archive into place; the index goes last"""
+    os.replace(archive + '.part', archive)
+    with open(index_path(archive) + '.part', 'w') as f:
+        for name, (size, digest) in sorted(index.items()):
+            f.write(f"{digest}\t{size}\t{name}\n")
+    os.replace(index_path(archive) + '.part', index_path(archive))
+
+
+def source_entry(path: str) -> Tuple[int, str]:
+    """Index entry of one source file, as write_archive records it"""
+    if os.path.islink(path):
+        return 0, 'link:' + os.readlink(path)
+    sha1 = hashlib.sha1()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_BYTES), b''):
+            sha1.update(chunk)
+            size += len(chunk)
+    return size, sha1.hexdigest()
+
+
+def matches_index(base_dir: str, members: List[str], arc_prefix: str, index: Index) -> bool:
+    """Whether the sources still present are the ones the index describes
+
+    A mismatch means the iteration was re-run (w_truncate) after it was
+    archived. A re-run writes files of the same size (restarts, NetCDF
+    frames, fixed-width CV files), so the content digests are compared.
+    """
+    for rel in members:
+        entry = index.get(os.path.join(arc_prefix, rel) if arc_prefix else rel)
+        if entry is None or source_entry(os.path.join(base_dir, rel)) != entry:
+            return False
+    return True
+
+
+def archive_sources(archive: str, base_dir: str, members: List[str], arc_prefix: str,
+                    compression: str, compresslevel: int) -> Optional[str]:
+    """Archive members unless an index already covers them; None on success"""
+    if os.path.exists(archive) and matches_index(base_dir, members, arc_prefix, read_index(archive)):
+        return None
+    try:
+        index = write_archive(archive, base_dir, members, arc_prefix, compression, compresslevel)
+        if scan_archive(archive + '.part') != index:
+            return f"{archive}: archive content does not match its member index"
+        commit(archive, index)
+    except (OSError, tarfile.TarError) as e:
+        return f"{archive}: {e}"
+    finally:
+        if os.path.exists(archive + '.part'):
+            os.remove(archive + '.part')
+    return None
+
+
+def archive_seg_logs(sim_root: str, n_iter: int, compression: str, compresslevel: int) -> str:
+    logs_dir = os.path.join(sim_root, 'seg_logs')
+    iter_name = '%06d' % n_iter
+    iter_dir = os.path.join(logs_dir, iter_name)
+    loose = sorted(os.path.basename(p) for p in glob.glob(os.path.join(logs_dir, iter_name + '-*.log')))
+    members = loose
+    if os.path.isdir(iter_dir):
+        members = members + [os.path.join(iter_name, rel) for rel in source_members(iter_dir)]
+    if not members:
+        return f"iter {n_iter} seg_logs: nothing to archive"
+    archive = os.path.join(logs_dir, '%06d.tar%s' % (n_iter, '.' + compression if compression else ''))
+    error = archive_sources(archive, logs_dir, members, '', compression, compresslevel)
+    if error:
+        return 'error: ' + error
+    for name in loose:
+        os.remove(os.path.join(logs_dir, name))
+    shutil.rmtree(iter_dir, ignore_errors=True)
+    return f"iter {n_iter} seg_logs: {len(members)} files -> {os.path.basename(archive)}"
+
+
+def archive_traj_segs(sim_root: str, n_iter: int, keep: List[str], compression: str,
+                      compresslevel: int) -> str:
+    segs_dir = os.path.join(sim_root, 'traj_segs')
+    iter_name = '%06d' % n_iter
+    iter_dir = os.path.join(segs_dir, iter_name)
+    members = [rel for rel in source_members(iter_dir) if os.path.basename(rel) not in keep
+               or os.path.islink(os.path.join(iter_dir, rel))]
+    if not members:
+        return f"iter {n_iter} traj_segs: nothing to archive"
+    archive = os.path.join(segs_dir, '%s.tar%s' % (iter_name, '.' + compression if compression else ''))
+    # The archive holds the complete iteration, retained files included
+    error = archive_sources(archive, iter_dir, source_members(iter_dir), iter_name, compression, compresslevel)
+    if error:
+        return 'error: ' + error
+
+    for rel in members:
+        os.remove(os.path.join(iter_dir, rel))
+    if not keep:
+        shutil.rmtree(iter_dir, ignore_errors=True)
+    else:
+        for root, dirs, files in os.walk(iter_dir, topdown=False):
+            if root != iter_dir and not os.listdir(root):
+                os.rmdir(root)
+    return f"iter {n_iter} traj_segs: {len(members)} files archived, kept {', '.join(keep) or 'nothing'}"
+
+
+def pending_iterations(sim_root: str, upto: int, recheck: bool = False) -> Tuple[List[int], List[int]]:
+    """Iterations up to upto with loose seg_logs / unarchived traj_segs files
+
+    Iterations with an index are skipped without walking their segments
+    unless recheck is set (after w_truncate and a re-run).
+    """
+    logs = set()
+    for path in glob.glob(os.path.join(sim_root, 'seg_logs', '[0-9]*-[0-9]*.log')):
+        n_iter = int(os.path.basename(path)[:6])
+        if n_iter <= upto:
+            logs.add(n_iter)
+    for path in glob.glob(os.path.join(sim_root, 'seg_logs', '[0-9]' * 6)):
+        n_iter = int(os.path.basename(path))
+        if n_iter <= upto and os.path.isdir(path):
+            logs.add(n_iter)
+    segs = []
+    for path in glob.glob(os.path.join(sim_root, 'traj_segs', '[0-9]' * 6)):
+        n_iter = int(os.path.basename(path))
+        if n_iter <= upto and os.path.isdir(path) and (recheck or not glob.glob(path + '.index.tsv')):
+            segs.append(n_iter)
+    return sorted(logs), sorted(segs)
+
+
+def latest_iteration(sim_root: str) -> int:
+    iters = [int(os.path.basename(p)) for p in glob.glob(os.path.join(sim_root, 'traj_segs', '[0-9]' * 6))
+             if os.path.isdir(p)]
+    return max(iters, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive completed WESTPA iterations in the background')
+    parser.add_argument('--sim-root', default=os.environ.get('WEST_SIM_ROOT', '.'),
+                        help='WESTPA simulation root (default: $WEST_SIM_ROOT or .)')
+    parser.add_argument('--current-iter', type=int,
+                        help='iteration that just finished (default: newest traj_segs directory)')
+    parser.add_argument('--keep-recent', type=int, default=2,
+                        help='leave the newest N iterations untouched (default: 2)')
+    parser.add_argument('--keep', default=os.environ.get('WEST_ARCHIVE_KEEP', DEFAULT_KEEP),
+                        help='comma-separated file names kept in traj_segs after archiving '
+                             f'(default: $WEST_ARCHIVE_KEEP or {DEFAULT_KEEP}; empty removes the iteration)')
+    parser.add_argument('-j', '--workers', type=int, default=int(os.environ.get('WEST_ARCHIVE_WORKERS', 2)),
+                        help='parallel archive writers (default: $WEST_ARCHIVE_WORKERS or 2)')
+    parser.add_argument('--compression', choices=['gz', 'xz', 'bz2', 'none'], default='gz')
+    parser.add_argument('--compresslevel', type=int, default=6, help='gz/bz2 level (default: 6)')
+    parser.add_argument('--logs-only', action='store_true', help='archive seg_logs but leave traj_segs alone')
+    parser.add_argument('--recheck', action='store_true',
+                        help='also look at iterations archived before (re-archives re-run iterations)')
+    args = parser.parse_args()
+
+    sim_root = os.path.abspath(args.sim_root)
+    segs_dir = os.path.join(sim_root, 'traj_segs')
+    if not os.path.isdir(segs_dir):
+        sys.exit(f"no traj_segs directory under {sim_root}")
+
+    with open(os.path.join(segs_dir, LOCK_FILE), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("another archiver is running; leaving the backlog to it")
+            return
+
+        # Stay out of the way of the running WE iteration
+        os.nice(10)
+        current = args.current_iter if args.current_iter is not None else latest_iteration(sim_root)
+        upto = current - args.keep_recent
+        keep = [name for name in args.keep.split(',') if name]
+        compression = '' if args.compression == 'none' else args.compression
+
+        logs, segs = pending_iterations(sim_root, upto, args.recheck)
+        if args.logs_only:
+            segs = []
+        failed = 0
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            futures = [pool.submit(archive_seg_logs, sim_root, n_iter, compression, args.compresslevel)
+                       for n_iter in logs]
+            futures += [pool.submit(archive_traj_segs, sim_root, n_iter, keep, compression, args.compresslevel)
+                        for n_iter in segs]
+            for future in as_completed(futures):
+                message = future.result()
+                failed += message.startswith('error')
+                print(message, flush=True)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
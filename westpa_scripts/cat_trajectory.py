@@ -1,20 +1,95 @@
 #!/usr/bin/python
 
-import h5py, numpy, sys
-
-infile = numpy.loadtxt(sys.argv[1], usecols = (0, 1))
-west   = h5py.File('west.h5')
-coords = []
-for iteration, seg_id in infile[1:]:
-    iter_key = "iter_{0:08d}".format(int(iteration))
-    SOD      = west['iterations'][iter_key]['auxdata']['coord'][seg_id,1:,0,:]
-    CLA      = west['iterations'][iter_key]['auxdata']['coord'][seg_id,1:,1,:]
-    coords  += [numpy.column_stack((SOD, CLA))]
-with open(sys.argv[1][:-4] + ".xyz", 'w') as outfile:
-    for i, frame in enumerate(numpy.concatenate(coords)):
-        outfile.write("2\n")
-        outfile.write("{0}\n".format(i))
-        outfile.write("SOD {0:9.5f} {1:9.5f} {2:9.5f}\n".format(
-          float(frame[0]), float(frame[1]), float(frame[2])))
-        outfile.write("CLA {0:9.5f} {1:9.5f} {2:9.5f}\n".format(
-          float(frame[3]), float(frame[4]), float(frame[5])))
+import os, numpy, sys, struct, argparse
+
+# west_reader.py lives in the simulation root, one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from west_reader import open_west
+
+# Frames formatted per write when producing text xyz
+CHUNK_FRAMES = 10000
+
+
+def load_trace(path):
+    """(iteration, seg_id) rows of a w_trace output, without the initial state row"""
+    infile = numpy.loadtxt(path, usecols = (0, 1), ndmin = 2)
+    return infile[1:].astype(numpy.int64)
+
+
+def read_frames(west, trace):
+    """Coordinates of every traced segment, one fancy-index read per iteration"""
+    n_frames, n_atoms = west.dataset(int(trace[0, 0]), 'auxdata/coord').shape[1:3]
+
+    # Frame 0 of each segment duplicates the last frame of its parent
+    coords = numpy.empty((len(trace), n_frames - 1, n_atoms, 3), dtype = numpy.float32)
+    for iteration in numpy.unique(trace[:, 0]):
+        rows = numpy.flatnonzero(trace[:, 0] == iteration)
+        coords[rows] = west.auxdata(int(iteration), 'coord', trace[rows, 1])[:, 1:]
+    return coords.reshape(-1, n_atoms, 3)
+
+
+def atom_names(names, n_atoms):
+    names = names.split(',')
+    return (names + ['X'] * n_atoms)[:n_atoms]
+
+
+def write_xyz(path, frames, names):
+    frame_fmt = "{0}\n%d\n".format(len(names)) + "".join(
+        "{0} %9.5f %9.5f %9.5f\n".format(name) for name in names)
+    with open(path, 'w') as outfile:
+        for start in range(0, len(frames), CHUNK_FRAMES):
+            chunk  = frames[start:start + CHUNK_FRAMES]
+            values = numpy.column_stack((numpy.arange(start, start + len(chunk)),
+                                         chunk.reshape(len(chunk), -1)))
+            outfile.write((frame_fmt * len(chunk)) % tuple(values.ravel()))
+
+
+def write_dcd(path, frames):
+    """CHARMM/NAMD DCD trajectory, readable by VMD and cpptraj"""
+    n_frames, n_atoms = frames.shape[:2]
+
+    def record(payload):
+        return struct.pack('<i', len(payload)) + payload + struct.pack('<i', len(payload))
+
+    icntrl = struct.pack('<9i', n_frames, 0, 1, n_frames, 0, 0, 0, 0, 0) + \
+             struct.pack('<f', 1.0) + struct.pack('<10i', 0, 0, 0, 0, 0, 0, 0, 0, 0, 24)
+    title = 'Created by cat_trajectory.py'.ljust(80).encode('ascii')
+    with open(path, 'wb') as outfile:
+        outfile.write(record(b'CORD' + icntrl))
+        outfile.write(record(struct.pack('<i', 1) + title))
+        outfile.write(record(struct.pack('<i', n_atoms)))
+        # Each frame is three records: all x, all y, all z
+        marker = numpy.array([4 * n_atoms], dtype = '<i4')
+        for frame in frames:
+            for axis in range(3):
+                outfile.write(marker.tobytes())
+                outfile.write(numpy.ascontiguousarray(frame[:, axis], dtype = '<f4').tobytes())
+                outfile.write(marker.tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Concatenate the coordinates of a traced walker')
+    parser.add_argument('trace', help = 'trajectory trace file (iteration, seg_id columns)')
+    parser.add_argument('--west', default = 'west.h5', help = 'WESTPA data file')
+    parser.add_argument('--format', choices = ['xyz', 'npy', 'dcd'], default = 'xyz')
+    parser.add_argument('--atoms', default = 'SOD,CLA', help = 'comma-separated atom names for xyz output')
+    parser.add_argument('--output', help = 'output file (default: trace name with the format extension)')
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace)
+    if len(trace) == 0:
+        sys.exit("no segments in " + args.trace)
+
+    frames = read_frames(open_west(args.west), trace)
+
+    output = args.output or args.trace[:-4] + "." + args.format
+    if args.format == 'npy':
+        numpy.save(output, frames)
+    elif args.format == 'dcd':
+        write_dcd(output, frames)
+    else:
+        write_xyz(output, frames, atom_names(args.atoms, frames.shape[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+CPU-only stand-in for pmemd.cuda and cpptraj
+
+Runs the generated bundle end to end (w_init, runseg.sh, get_pcoord.sh,
+post_iter.sh, data_extract.py, reweighting) on a machine without AMBER
+or a GPU. env.sh points $PMEMD and $CPPTRAJ here when WEST_MOCK_ENGINE is
+set:
+
+    python3 mock_engine.py pmemd -O -i md.in -p sys.prmtop -c parent.rst -r seg.rst \\
+        -x seg.nc -o seg.log -inf seg.nfo -gamd gamd.log
+    echo -e "parm sys.prmtop\\n trajin seg.nc\\n rms r @CA reference out rmsd_1.dat\\n go" \\
+        | python3 mock_engine.py cpptraj
+    python3 mock_engine.py cpptraj -p sys.prmtop -y seg.nc -tl
+
+pmemd moves every atom by a Gaussian random walk (WEST_MOCK_STEP Angstrom
+per frame, seeded from ig in md.in) and writes seg.rst as an ASCII
+restart, the trajectory as ASCII mdcrd (whatever its extension), an mdout
+with energies and "Final Performance Info", and gamd.log with one boost row
+per frame. cpptraj reads those files back: rms (Kabsch fit, no mass
+weighting), radgyr and distance (first and last atom) are computed, other
+actions with an `out` file get the RMSD to the reference. Masks are ignored.
+Binary restarts such as NetCDF bstates cannot be read; they stand for the
+structure next to the topology (<name>.pdb / <name>.inpcrd).
+
+Environment:
+
+    WEST_MOCK_SECONDS    wall time of one pmemd run (default 0)
+    WEST_MOCK_JITTER     relative spread of that time, log-normal (default 0)
+    WEST_MOCK_FAIL_RATE  probability that a run crashes part way (default 0)
+    WEST_MOCK_HANG_RATE  probability that a run hangs part way (default 0)
+    WEST_MOCK_STEP       random walk step per frame in Angstrom (default 0.02)
+    WEST_MOCK_SEED       added to ig so repeated runs differ (default 0)
+
+A crashed run has written the frames and restart up to the crash, no
+"Final Performance Info", and exits 1, like a pmemd.cuda failure that
+runseg.sh retries. A hung run stops writing output and sleeps until it
+is killed, like a wedged GPU that westpa_scripts/watchdog.py has to catch.
+"""
+
+import os
+import re
+import sys
+import time
+import socket
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MDCRD_TITLE = 'mock_engine.py trajectory'
+RESTART_TITLE = 'mock_engine.py restart'
+# Actions whose per-frame value the mock computes; others fall back to rms
+CV_ACTIONS = ('rms', 'rmsd', 'radgyr', 'distance', 'nativecontacts', 'dihedral', 'hbond',
+              'surf', 'secstruct')
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        sys.exit(f"mock_engine.py: {name} must be a number, got {os.environ[name]!r}")
+
+
+def prmtop_atoms(path: str) -> int:
+    """NATOM from the POINTERS section of an ASCII AMBER topology"""
+    with open(path) as f:
+        lines = f.read().split('\n')
+    for i, line in enumerate(lines):
+        if line.startswith('%FLAG POINTERS'):
+            for pointer in lines[i + 1:i + 4]:
+                if not pointer.startswith('%') and pointer.split():
+                    return int(pointer.split()[0])
+    raise ValueError(f"{path}: no POINTERS section")
+
+
+def fixed_width(line: str, width: int) -> List[float]:
+    return [float(line[i:i + width]) for i in range(0, len(line.rstrip()), width)]
+
+
+def read_restart(path: str) -> Tuple[np.ndarray, float]:
+    """Coordinates and time of an ASCII restart / inpcrd (ValueError if not one)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith(b'CDF') or b'\0' in data[:1024]:
+        raise ValueError(f"{path} is binary")
+    lines = data.decode('ascii').split('\n')
+    header = lines[1].split()
+    natom = int(header[0])
+    sim_time = float(header[1]) if len(header) > 1 else 0.0
+    values = []
+    for line in lines[2:]:
+        values.extend(fixed_width(line, 12))
+        if len(values) >= 3 * natom:
+            break
+    return np.array(values[:3 * natom]).reshape(natom, 3), sim_time
+
+
+def read_pdb(path: str) -> np.ndarray:
+    with open(path) as f:
+        rows = [[float(line[30:38]), float(line[38:46]), float(line[46:54])]
+                for line in f if line.startswith(('ATOM', 'HETATM'))]
+    return np.array(rows)
+
+
+def read_structure(path: str) -> np.ndarray:
+    if path.endswith('.pdb'):
+        return read_pdb(path)
+    return read_restart(path)[0]
+
+
+def stand_in(prmtop: str, natom: int) -> np.ndarray:
+    """Structure used for a restart the mock cannot read"""
+    stem = os.path.splitext(os.path.realpath(prmtop))[0]
+    for ext in ('.pdb', '.inpcrd', '.rst7'):
+        if os.path.exists(stem + ext):
+            coords = read_structure(stem + ext)
+            if len(coords) >= natom:
+                return coords[:natom]
+    # Nothing next to the topology: a reproducible random chain
+    rng = np.random.default_rng(natom)
+    return np.cumsum(rng.normal(0.0, 1.5 / np.sqrt(3), (natom, 3)), axis=0)
+
+
+def write_restart(path: str, coords: np.ndarray, velocities: np.ndarray, sim_time: float):
+    def block(values):
+        flat = values.ravel()
+        return ''.join(''.join(f"{v:12.7f}" for v in flat[i:i + 6]) + '\n' for i in range(0, len(flat), 6))
+
+    with open(path + '.tmp', 'w') as f:
+        f.write(f"{RESTART_TITLE}\n{len(coords):6d}{sim_time:15.7E}\n")
+        f.write(block(coords))
+        f.write(block(velocities))
+    os.replace(path + '.tmp', path)
+
+
+def mdcrd_frame(coords: np.ndarray) -> str:
+    flat = coords.ravel()
+    return ''.join(''.join(f"{v:8.3f}" for v in flat[i:i + 10]) + '\n' for i in range(0, len(flat), 10))
+
+
+def read_mdcrd(path: str, natom: int) -> List[np.ndarray]:
+    values = []
+    with open(path) as f:
+        f.readline()
+        for line in f:
+            values.extend(fixed_width(line, 8))
+    nframes = len(values) // (3 * natom)
+    data = np.array(values[:nframes * 3 * natom])
+    return list(data.reshape(nframes, natom, 3))
+
+
+def read_frames(path: str, prmtop: str, natom: int) -> List[np.ndarray]:
+    """Frames of a trajectory or restart written by the mock (or a stand-in)"""
+    with open(path, 'rb') as f:
+        title = f.readline().decode('ascii', errors='replace').strip()
+    if title == MDCRD_TITLE:
+        return read_mdcrd(path, natom)
+    try:
+        return [read_structure(path)]
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return [stand_in(prmtop, natom)]
+
+
+def read_mdin(path: str) -> Dict[str, str]:
+    """&cntrl settings of an mdin file, comments removed"""
+    settings = {}
+    with open(path) as f:
+        for line in f:
+            line = line.split('!')[0]
+            for key, value in re.findall(r'(\w+)\s*=\s*([^,\s]+)', line):
+                settings[key.lower()] = value
+    return settings
+
+
+def mdin_int(settings: Dict[str, str], key: str, default: int) -> int:
+    try:
+        return int(float(settings.get(key, default)))
+    except ValueError:
+        return default
+
+
+# ---------------------------------------------------------------- pmemd
+
+def mdout_header(args, natom: int, nstlim: int, dt: float) -> str:
+    devices = os.environ.get('CUDA_VISIBLE_DEVICES', '0')
+    return (
+        "\n          -------------------------------------------------------\n"
+        "          Amber pmemd.cuda stand-in (westpa_scripts/mock_engine.py)\n"
+        "          -------------------------------------------------------\n\n"
+        f"| Run on {time.strftime('%m/%d/%Y at %H:%M:%S')}\n\n"
+        f"|   Executable path: {os.path.abspath(__file__)}\n"
+        f"| Working directory: {os.getcwd()}\n"
+        f"|          Hostname: {socket.gethostname()}\n\n"
+        f"|  MDIN: {args.mdin}\n|  MDOUT: {args.mdout}\n|  INPCRD: {args.inpcrd}\n"
+        f"|  PARM: {args.prmtop}\n|  RESTRT: {args.restrt}\n|  MDCRD: {args.mdcrd}\n\n"
+        f"|------------------- GPU DEVICE INFO --------------------\n"
+        f"|            CUDA_VISIBLE_DEVICES: {devices}\n"
+        f"|   CUDA Capable Devices Detected:      1\n"
+        f"|           CUDA Device ID in use:      0\n"
+        f"|                CUDA Device Name: mock_engine CPU\n"
+        f"|--------------------------------------------------------\n\n"
+        f" NATOM  = {natom:8d}\n nstlim = {nstlim:8d}, dt = {dt:10.5f}\n\n"
+        "   4.  RESULTS\n\n"
+    )
+
+
+def energy_block(step: int, sim_time: float, rng) -> str:
+    epot = -350.0 + rng.normal(0.0, 5.0)
+    ektot = 210.0 + rng.normal(0.0, 5.0)
+    return (
+        f" NSTEP = {step:8d}   TIME(PS) = {sim_time:11.3f}  TEMP(K) = {300.0 + rng.normal(0.0, 3.0):8.2f}"
+        f"  PRESS =     0.0\n"
+        f" Etot   = {epot + ektot:14.4f}  EKtot   = {ektot:14.4f}  EPtot      = {epot:14.4f}\n"
+        " ------------------------------------------------------------------------------\n\n"
+    )
+
+
+def timings(elapsed: float, steps: int, dt: float) -> str:
+    elapsed = max(elapsed, 1e-3)
+    ns_per_day = steps * dt / 1000.0 / elapsed * 86400.0
+    return (
+        f"|     Elapsed(s) = {elapsed:10.2f} Per Step(ms) = {elapsed / max(steps, 1) * 1000.0:12.2f}\n"
+        f"|         ns/day = {ns_per_day:10.2f}   seconds/ns = {86400.0 / max(ns_per_day, 1e-9):12.2f}\n"
+    )
+
+
+def performance_block(elapsed: float, nstlim: int, dt: float, last_elapsed: float, last_steps: int) -> str:
+    """TIMINGS section as pmemd.cuda prints it: the last-N-steps window, then all steps"""
+    elapsed = max(elapsed, 1e-3)
+    last = ""
+    if last_steps > 0:
+        last = (f"|     Average timings for last {last_steps:8d} steps:\n"
+                + timings(last_elapsed, last_steps, dt) + "|\n")
+    return (
+        "--------------------------------------------------------------------------------\n"
+        "   5.  TIMINGS\n"
+        "--------------------------------------------------------------------------------\n\n"
+        "|  Final Performance Info:\n"
+        "|     -----------------------------------------------------\n"
+        + last +
+        "|     Average timings for all steps:\n"
+        + timings(elapsed, nstlim, dt) +
+        "|     -----------------------------------------------------\n\n"
+        f"|  Master Setup wall time:           0    seconds\n"
+        f"|  Master NonSetup wall time:     {elapsed:6.0f}    seconds\n"
+        f"|  Master Total wall time:        {elapsed:6.0f}    seconds     {elapsed / 3600.0:.2f} hours\n"
+    )
+
+
+def run_pmemd(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog='mock_engine.py pmemd')
+    parser.add_argument('-O', action='store_true', help='overwrite outputs (always done)')
+    parser.add_argument('-i', dest='mdin', default='mdin')
+    parser.add_argument('-o', dest='mdout', default='mdout')
+    parser.add_argument('-p', dest='prmtop', default='prmtop')
+    parser.add_argument('-c', dest='inpcrd', default='inpcrd')
+    parser.add_argument('-r', dest='restrt', default='restrt')
+    parser.add_argument('-x', dest='mdcrd', default='mdcrd')
+    parser.add_argument('-inf', dest='mdinfo', default='mdinfo')
+    parser.add_argument('-gamd', dest='gamdlog', default='gamd.log')
+    args, _ = parser.parse_known_args(argv)
+
+    start = time.time()
+    settings = read_mdin(args.mdin)
+    nstlim = mdin_int(settings, 'nstlim', 0)
+    ntwx = max(mdin_int(settings, 'ntwx', 0) or nstlim, 1)
+    ntpr = max(mdin_int(settings, 'ntpr', 50), 1)
+    ntwr = abs(mdin_int(settings, 'ntwr', nstlim)) or max(nstlim, 1)
+    dt = float(settings.get('dt', 0.002))
+    ig = mdin_int(settings, 'ig', -1)
+    seed = (ig if ig > 0 else time.time_ns()) + int(env_float('WEST_MOCK_SEED', 0))
+    rng = np.random.default_rng(seed)
+
+    natom = prmtop_atoms(args.prmtop)
+    try:
+        coords, sim_time = read_restart(args.inpcrd)
+    except (ValueError, IndexError):
+        coords, sim_time = stand_in(args.prmtop, natom), 0.0
+    coords = coords[:natom].copy()
+
+    seconds = env_float('WEST_MOCK_SECONDS', 0.0)
+    jitter = env_float('WEST_MOCK_JITTER', 0.0)
+    if jitter > 0:
+        seconds *= rng.lognormal(0.0, jitter)
+    step_size = env_float('WEST_MOCK_STEP', 0.02)
+    fail_at = None
+    if nstlim and rng.random() < env_float('WEST_MOCK_FAIL_RATE', 0.0):
+        fail_at = int(rng.integers(0, nstlim))
+    hang_at = None
+    if nstlim and rng.random() < env_float('WEST_MOCK_HANG_RATE', 0.0):
+        hang_at = int(rng.integers(0, nstlim))
+
+    step_seconds = seconds / max(nstlim, 1)
+    mdout = open(args.mdout, 'w')
+    mdout.write(mdout_header(args, natom, nstlim, dt))
+    traj = open(args.mdcrd, 'w')
+    traj.write(MDCRD_TITLE + '\n')
+    gamd = open(args.gamdlog, 'w')
+    gamd.write("# Gaussian Accelerated Molecular Dynamics log file (mock_engine.py)\n"
+               "# All energy terms stored in units of kcal/mol\n"
+               "# ntwx,total_nstep,Unboosted-Potential-Energy,Unboosted-Dihedral-Energy,"
+               "Total-Force-Weight,Dihedral-Force-Weight,Boost-Energy-Potential,Boost-Energy-Dihedral\n")
+
+    # Advance in chunks of the smallest output interval, sleeping to pace the run
+    interval = min(ntwx, ntpr, ntwr)
+    step = 0
+    # pmemd.cuda also reports the second half of the run on its own
+    window_step, window_start = 0, start
+    while step < nstlim:
+        chunk = min(interval, nstlim - step)
+        if fail_at is not None and step + chunk > fail_at:
+            time.sleep(step_seconds * (fail_at - step))
+            mdout.write(f"\n mock_engine.py: injected failure at step {fail_at}\n")
+            print(f"mock_engine.py: injected failure at step {fail_at}", file=sys.stderr)
+            for f in (mdout, traj, gamd):
+                f.close()
+            return 1
+        if hang_at is not None and step + chunk > hang_at:
+            for f in (mdout, traj, gamd):
+                f.flush()
+            while True:
+                time.sleep(3600)
+        time.sleep(step_seconds * chunk)
+        step += chunk
+        if window_step == 0 and step >= nstlim // 2 and step < nstlim:
+            window_step, window_start = step, time.time()
+        coords += rng.normal(0.0, step_size * np.sqrt(chunk / ntwx), coords.shape)
+        now = sim_time + step * dt
+        if step % ntpr == 0:
+            mdout.write(energy_block(step, now, rng))
+        if step % ntwx == 0:
+            traj.write(mdcrd_frame(coords))
+            traj.flush()
+            gamd.write(f"{ntwx:11d}{step:16d}{-350.0 + rng.normal(0.0, 5.0):20.8f}"
+                       f"{120.0 + rng.normal(0.0, 2.0):20.8f}{rng.uniform(0.9, 1.0):20.8f}"
+                       f"{rng.uniform(0.9, 1.0):20.8f}{abs(rng.normal(2.0, 1.0)):20.8f}"
+                       f"{abs(rng.normal(1.5, 0.8)):20.8f}\n")
+            gamd.flush()
+        if step % ntwr == 0 or step == nstlim:
+            write_restart(args.restrt, coords, rng.normal(0.0, 0.5, coords.shape), now)
+
+    if nstlim == 0:
+        write_restart(args.restrt, coords, np.zeros_like(coords), sim_time)
+    end = time.time()
+    last_steps = nstlim - window_step if window_step else 0
+    mdout.write(performance_block(end - start, nstlim, dt, end - window_start, last_steps))
+    for f in (mdout, traj, gamd):
+        f.close()
+    with open(args.mdinfo, 'w') as f:
+        f.write(f" NSTEP = {nstlim:8d}   TIME(PS) = {sim_time + nstlim * dt:11.3f}\n")
+    return 0
+
+
+# -------------------------------------------------------------- cpptraj
+
+def kabsch_rmsd(coords: np.ndarray, ref: np.ndarray) -> float:
+    a = coords - coords.mean(axis=0)
+    b = ref - ref.mean(axis=0)
+    u, s, vt = np.linalg.svd(a.T @ b)
+    if np.linalg.det(u @ vt) < 0:
+        s[-1] = -s[-1]
+    msd = (np.sum(a * a) + np.sum(b * b) - 2.0 * np.sum(s)) / len(a)
+    return float(np.sqrt(max(msd, 0.0)))
+
+
+def cv_value(action: str, coords: np.ndarray, ref: Optional[np.ndarray]) -> float:
+    if action == 'radgyr':
+        centered = coords - coords.mean(axis=0)
+        return float(np.sqrt(np.mean(np.sum(centered * centered, axis=1))))
+    if action == 'distance':
+        return float(np.linalg.norm(coords[-1] - coords[0]))
+    if ref is None:
+        raise ValueError(f"{action} needs a reference structure")
+    return kabsch_rmsd(coords, ref)
+
+
+def trajin_range(frames: List[np.ndarray], words: List[str]) -> List[np.ndarray]:
+    """Apply 'trajin file [start [stop [offset]]]' (1-based, inclusive)"""
+    numbers = [w for w in words[2:] if re.fullmatch(r'-?\d+|last', w)]
+    start = int(numbers[0]) if numbers else 1
+    stop = len(frames) if len(numbers) < 2 or numbers[1] in ('last', '-1') else int(numbers[1])
+    offset = int(numbers[2]) if len(numbers) > 2 else 1
+    return frames[start - 1:stop:offset]
+
+
+def run_script(lines: List[str]) -> int:
+    prmtop, natom = None, None
+    frames: List[np.ndarray] = []
+    ref = None
+    outputs: Dict[str, List[Tuple[str, str]]] = {}
+    trajouts = []
+
+    def done():
+        # 'go' / end of input: write every data file and output trajectory
+        for path, actions in outputs.items():
+            columns = [[cv_value(action, frame, ref) for frame in frames] for action, _ in actions]
+            with open(path, 'w') as f:
+                f.write('#Frame ' + ' '.join(f"{name:>12}" for _, name in actions) + '\n')
+                for i, row in enumerate(zip(*columns), 1):
+                    f.write(f"{i:8d} " + ' '.join(f"{value:12.4f}" for value in row) + '\n')
+        for path in trajouts:
+            with open(path, 'w') as f:
+                f.write(MDCRD_TITLE + '\n')
+                f.writelines(mdcrd_frame(frame) for frame in frames)
+
+    for raw in lines:
+        words = raw.split('#')[0].split()
+        if not words:
+            continue
+        command = words[0].lower()
+        if command in ('parm', 'parmin'):
+            prmtop = words[1]
+            natom = prmtop_atoms(prmtop)
+        elif command == 'trajin':
+            frames.extend(trajin_range(read_frames(words[1], prmtop, natom), words))
+        elif command == 'reference':
+            ref = read_frames(words[1], prmtop, natom)[0]
+        elif command == 'trajout':
+            trajouts.append(words[1])
+        elif command in ('go', 'run'):
+            done()
+            outputs, trajouts = {}, []
+        elif command in ('quit', 'exit'):
+            break
+        elif 'out' in words[:-1]:
+            path = words[words.index('out') + 1]
+            action = command if command in CV_ACTIONS else 'rms'
+            name = words[1] if len(words) > 1 and words[1] != 'out' else command
+            outputs.setdefault(path, []).append((action, name))
+        else:
+            print(f"mock_engine.py: ignoring '{raw.strip()}'", file=sys.stderr)
+    if outputs or trajouts:
+        done()
+    return 0
+
+
+def run_cpptraj(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog='mock_engine.py cpptraj')
+    parser.add_argument('-p', dest='prmtop')
+    parser.add_argument('-y', dest='trajin')
+    parser.add_argument('-i', dest='script', help='input script (default: stdin)')
+    parser.add_argument('-tl', action='store_true', help='print the frame count of -y and exit')
+    args, _ = parser.parse_known_args(argv)
+
+    if args.tl:
+        natom = prmtop_atoms(args.prmtop)
+        print(f"Frames: {len(read_frames(args.trajin, args.prmtop, natom))}")
+        return 0
+    lines = []
+    if args.prmtop:
+        lines.append(f"parm {args.prmtop}")
+    if args.trajin:
+        lines.append(f"trajin {args.trajin}")
+    if args.script:
+        with open(args.script) as f:
+            lines += f.read().split('\n')
+    else:
+        lines += sys.stdin.read().split('\n')
+    return run_script(lines)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('pmemd', 'cpptraj'):
+        sys.exit("usage: mock_engine.py {pmemd|cpptraj} [program arguments]")
+    try:
+        status = run_pmemd(sys.argv[2:]) if sys.argv[1] == 'pmemd' else run_cpptraj(sys.argv[2:])
+    except (OSError, ValueError, IndexError) as e:
+        sys.exit(f"mock_engine.py {sys.argv[1]}: {e}")
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
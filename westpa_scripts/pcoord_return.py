@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Write $WEST_PCOORD_RETURN from CPPTRAJ data files in one process
+
+Replaces the per-CV `cat | tail | awk` pipelines joined with `paste`:
+
+    python3 pcoord_return.py --length 101 -o $WEST_PCOORD_RETURN rmsd_1.dat radius_gyration_1.dat
+    python3 pcoord_return.py --last -o $WEST_PCOORD_RETURN rmsd_1.dat     # get_pcoord.sh
+
+Column i of the output is the value column of the i-th file. Every file
+must hold exactly --length rows; a short (or long) CV file stops the
+segment with an error instead of handing WESTPA a ragged pcoord.
+"""
+
+import sys
+import argparse
+
+
+def read_values(path):
+    """Value column (second field) of a CPPTRAJ data file, header skipped"""
+    values = []
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if len(fields) < 2:
+                raise ValueError(f"{path}:{line_no}: expected 'frame value', got {line.strip()!r}")
+            values.append(fields[1])
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the WESTPA pcoord return file from CPPTRAJ outputs')
+    parser.add_argument('files', nargs='+', help='CPPTRAJ data files, one per progress coordinate dimension')
+    parser.add_argument('-o', '--output', required=True, help='pcoord return file ($WEST_PCOORD_RETURN)')
+    rows = parser.add_mutually_exclusive_group(required=True)
+    rows.add_argument('--length', type=int, help='expected rows per file (pcoord_len)')
+    rows.add_argument('--last', action='store_true', help='use only the final row of each file')
+    args = parser.parse_args()
+
+    columns = []
+    for path in args.files:
+        try:
+            values = read_values(path)
+        except (OSError, ValueError) as e:
+            sys.exit(f"pcoord_return.py: {e}")
+        if args.last:
+            if not values:
+                sys.exit(f"pcoord_return.py: {path} has no data rows")
+            values = values[-1:]
+        elif len(values) != args.length:
+            sys.exit(f"pcoord_return.py: {path} has {len(values)} rows, expected pcoord_len = {args.length}")
+        columns.append(values)
+
+    with open(args.output, 'w') as f:
+        f.write(''.join('\t'.join(row) + '\n' for row in zip(*columns)))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,17 @@ fi
 
 cd $WEST_SIM_ROOT || exit 1
 
-ITER=$(printf "%06d" $WEST_CURRENT_ITER)
-tar -cf seg_logs/$ITER.tar seg_logs/$ITER-*.log
-rm  -f  seg_logs/$ITER-*.log
+# Append the previous iteration's GaMD boost and CV frames to analysis.h5
+# while the next one propagates. The data manager has flushed that one to
+# west.h5 already, unlike the iteration w_run is still writing; re-running
+# an iteration simply rewrites it
+if [ $WEST_CURRENT_ITER -gt 1 ] ; then
+    nohup python3 $WEST_SIM_ROOT/data_extract.py --path $WEST_SIM_ROOT --aggregate-iter $((WEST_CURRENT_ITER - 1)) \
+        < /dev/null >> $WEST_SIM_ROOT/seg_logs/aggregate.log 2>&1 &
+fi
+
+# Archive seg_logs and traj_segs of older iterations in the background
+# (verified against a member index, then pruned to the retained files);
+# a run that is still busy makes this one exit immediately
+nohup python3 $WEST_SIM_ROOT/westpa_scripts/archive_iters.py --sim-root $WEST_SIM_ROOT \
+    --current-iter $WEST_CURRENT_ITER < /dev/null >> $WEST_SIM_ROOT/seg_logs/archive.log 2>&1 &
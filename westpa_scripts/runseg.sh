@@ -32,6 +32,11 @@ while ! grep -q "Final Performance Info" seg.log; do
           -r seg.rst -x seg.nc      -o seg.log    -inf seg.nfo -gamd gamd.log
 done
 
+# Keep host, device and timings in the segment log for seg_telemetry.py
+echo "RUNSEG.SH: HOSTNAME = " $(hostname)
+grep -E "^\|.*(Hostname|CUDA_VISIBLE_DEVICES|CUDA Device)" seg.log
+sed -n '/Final Performance Info/,$p' seg.log
+
 RMSD=rmsd.dat
 RG=rg.dat
 COMMAND="         parm chignolin.prmtop\n"
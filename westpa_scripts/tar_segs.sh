@@ -1,16 +1,11 @@
 #!/bin/bash
+#
+# Archive every iteration but the newest one by hand; extra arguments go to
+# archive_iters.py (e.g. --keep seg.rst,gamd.log,seg.nc -j 8)
 
 [ -z "$WEST_SIM_ROOT" ] &&
     exit 1
 [ ! -d $WEST_SIM_ROOT/traj_segs ] &&
     exit 1
 
-cd $WEST_SIM_ROOT/traj_segs
-
-ITERS=($(ls | grep '^[0-9][0-9][0-9][0-9][0-9][0-9]$'))
-ITERS=("${ITERS[@]:0:${#ITERS[@]}-1}")
-for ITER in ${ITERS[@]}; do
-    [ ! -f $ITER.tar ] &&
-        tar -cvf $ITER.tar $ITER
-done
-
+python3 $WEST_SIM_ROOT/westpa_scripts/archive_iters.py --sim-root $WEST_SIM_ROOT --keep-recent 1 "$@"
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Stall and straggler watchdog for a running WE iteration
+
+run_WE.sh starts it next to the ZMQ master. Every running segment keeps a
+record in watchdog/running/NNNNNN-NNNNNN that runseg.sh refreshes in the
+background:
+
+    n_iter=.. seg_id=.. host=.. worker=.. start=.. progress=.. pmemd=..
+
+pmemd is the PID of the running pmemd attempt and progress the last time
+it started or wrote its trajectory or mdout; between attempts and after
+pmemd (backoff, cpptraj) progress is the current time.
+Each poll the watchdog prints the iteration's progress and checks:
+
+    stalled    no new pmemd output for --stall seconds
+    straggler  running longer than --straggler-factor x the median time
+               of the segments finished in this iteration
+    lost       the record is no longer refreshed (worker or node died)
+
+Every finding is appended to watchdog/alerts.log. With --mode kill a
+stalled pmemd is killed, so runseg.sh retries the segment from its last
+restart. A host with --unhealthy-after stalls, or one that lost a
+segment, is added to unhealthy_nodes.txt; run_WE.sh excludes those nodes
+from the next chained job, and the queued job given by --next-job is
+updated at once.
+
+    python3 westpa_scripts/watchdog.py --mode kill --master-pid 1234
+"""
+
+import os
+import sys
+import glob
+import time
+import signal
+import socket
+import argparse
+import statistics
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+WATCHDOG_MODES = ('alert', 'kill')
+RECORD_FIELDS = ('n_iter', 'seg_id', 'start', 'progress')
+MIN_SAMPLES = 5
+
+Key = Tuple[int, int]
+Record = Dict[str, object]
+
+
+def read_record(path: str) -> Optional[Record]:
+    """Fields of one running-segment record, None if it is unreadable or gone"""
+    try:
+        with open(path) as f:
+            text = f.read()
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    record: Record = dict(field.split('=', 1) for field in text.split() if '=' in field)
+    try:
+        for name in RECORD_FIELDS:
+            record[name] = int(record[name])
+    except (KeyError, ValueError):
+        return None
+    record['pmemd'] = int(record['pmemd']) if str(record.get('pmemd', '')).isdigit() else None
+    record['host'] = record.get('host') or '?'
+    record['refreshed'] = mtime
+    record['path'] = path
+    return record
+
+
+class Watchdog:
+    def __init__(self, args):
+        self.args = args
+        self.running_dir = os.path.join(args.sim_root, 'watchdog', 'running')
+        self.alerts_path = os.path.join(args.sim_root, 'watchdog', 'alerts.log')
+        self.unhealthy_path = os.path.join(args.sim_root, 'unhealthy_nodes.txt')
+        self.local_host = socket.gethostname().split('.')[0]
+        self.seen: Dict[Key, Record] = {}
+        self.durations: Dict[int, List[int]] = {}
+        self.stalls: Dict[str, int] = {}
+        self.reported = set()
+        self.unhealthy = set(self._read_unhealthy())
+
+    def _read_unhealthy(self) -> List[str]:
+        if not os.path.exists(self.unhealthy_path):
+            return []
+        with open(self.unhealthy_path) as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def alert(self, kind: str, record: Record, message: str):
+        line = (f"{datetime.now().isoformat(timespec='seconds')} {kind} n_iter={record['n_iter']} "
+                f"seg_id={record['seg_id']} host={record['host']} {message}")
+        print(line, flush=True)
+        with open(self.alerts_path, 'a') as f:
+            f.write(line + '\n')
+
+    def mark_unhealthy(self, host: str, reason: str):
+        if host in self.unhealthy or host == '?':
+            return
+        self.unhealthy.add(host)
+        with open(self.unhealthy_path, 'a') as f:
+            f.write(host + '\n')
+        print(f"unhealthy: {host} ({reason})", flush=True)
+        if self.args.next_job:
+            nodes = ','.join(sorted(self.unhealthy))
+            subprocess.run(['scontrol', 'update', f'JobId={self.args.next_job}', f'ExcNodeList={nodes}'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def kill(self, record: Record) -> bool:
+        """SIGTERM the pmemd attempt of a record, over ssh on other hosts"""
+        pid = record['pmemd']
+        if pid is None:
+            return False
+        if record['host'] == self.local_host:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                return False
+            return True
+        result = subprocess.run(['ssh', '-o', 'StrictHostKeyChecking=no', '-o', 'BatchMode=yes',
+                                 record['host'], 'kill', str(pid)],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return result.returncode == 0
+
+    def median(self, n_iter: int) -> Optional[float]:
+        durations = self.durations.get(n_iter, [])
+        return statistics.median(durations) if len(durations) >= MIN_SAMPLES else None
+
+    def poll(self, now: float):
+        records = {}
+        for path in glob.glob(os.path.join(self.running_dir, '*[0-9]')):
+            record = read_record(path)
+            if record is not None:
+                records[(record['n_iter'], record['seg_id'])] = record
+
+        # Records removed by runseg.sh are finished segments
+        for key, record in self.seen.items():
+            if key not in records:
+                self.durations.setdefault(key[0], []).append(int(record['last_seen'] - record['start']))
+
+        lost = set()
+
+        for key, record in records.items():
+            record['last_seen'] = now
+            elapsed = now - record['start']
+            idle = now - record['progress']
+            median = self.median(key[0])
+
+            if now - record['refreshed'] > self.args.lost:
+                self.alert('LOST', record, f"record not refreshed for {now - record['refreshed']:.0f} s")
+                self.mark_unhealthy(record['host'], 'lost a segment')
+                lost.add(key)
+                try:
+                    os.remove(record['path'])
+                except OSError:
+                    pass
+                continue
+
+            if idle > self.args.stall:
+                if ('stall', key, record['pmemd']) in self.reported:
+                    continue
+                self.reported.add(('stall', key, record['pmemd']))
+                action = 'killed pmemd' if self.args.mode == 'kill' and self.kill(record) else 'alert only'
+                self.alert('STALLED', record, f"no pmemd output for {idle:.0f} s, elapsed {elapsed:.0f} s, {action}")
+                self.stalls[record['host']] = self.stalls.get(record['host'], 0) + 1
+                if self.stalls[record['host']] >= self.args.unhealthy_after:
+                    self.mark_unhealthy(record['host'], f"{self.stalls[record['host']]} stalled segments")
+            elif median and elapsed > self.args.straggler_factor * median:
+                if ('straggler', key) in self.reported:
+                    continue
+                self.reported.add(('straggler', key))
+                self.alert('STRAGGLER', record, f"elapsed {elapsed:.0f} s, iteration median {median:.0f} s")
+
+        self.seen = {key: record for key, record in records.items() if key not in lost}
+        self.status(records, now)
+
+    def status(self, records: Dict[Key, Record], now: float):
+        if not records:
+            return
+        n_iter = max(key[0] for key in records)
+        current = [record for key, record in records.items() if key[0] == n_iter]
+        median = self.median(n_iter)
+        oldest = max(now - record['start'] for record in current)
+        print(f"{datetime.now().isoformat(timespec='seconds')} iteration {n_iter}: {len(current)} running, "
+              f"{len(self.durations.get(n_iter, []))} finished, median "
+              f"{f'{median:.0f} s' if median else '-'}, oldest {oldest:.0f} s", flush=True)
+
+    def run(self):
+        os.makedirs(self.running_dir, exist_ok=True)
+        while self.args.master_pid is None or _alive(self.args.master_pid):
+            self.poll(time.time())
+            time.sleep(self.args.interval)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def main():
+    interval = int(os.environ.get('WEST_WATCHDOG_INTERVAL', 30))
+    parser = argparse.ArgumentParser(description='Watch running WESTPA segments for stalls and stragglers')
+    parser.add_argument('--mode', choices=WATCHDOG_MODES, default='alert',
+                        help='alert only, or also kill stalled pmemd runs (default: alert)')
+    parser.add_argument('--sim-root', default=os.environ.get('WEST_SIM_ROOT', '.'),
+                        help='WESTPA simulation root (default: $WEST_SIM_ROOT or .)')
+    parser.add_argument('--stall', type=int, default=int(os.environ.get('WEST_WATCHDOG_STALL', 900)),
+                        help='seconds without pmemd output before a segment is stalled (default: $WEST_WATCHDOG_STALL or 900)')
+    parser.add_argument('--straggler-factor', type=float, default=3.0,
+                        help='report segments running longer than this x the iteration median (default: 3)')
+    parser.add_argument('--unhealthy-after', type=int, default=2,
+                        help='stalled segments before a host goes into unhealthy_nodes.txt (default: 2)')
+    parser.add_argument('--interval', type=int, default=interval,
+                        help='seconds between polls (default: $WEST_WATCHDOG_INTERVAL or 30)')
+    parser.add_argument('--lost', type=int, default=max(4 * interval, 120),
+                        help='seconds without a record refresh before a segment counts as lost')
+    parser.add_argument('--master-pid', type=int, help='exit when this process (the ZMQ master) is gone')
+    parser.add_argument('--next-job', help='queued SLURM job whose ExcNodeList follows unhealthy_nodes.txt')
+    args = parser.parse_args()
+
+    try:
+        Watchdog(args).run()
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()